@@ -1,23 +1,10 @@
 import importlib
+import importlib.util
 import os
 import traceback
 
-try:
-    import pcot.macros as macros
-except AttributeError as e:
-    traceback.print_exc()
-    print("""
-    This error MAY mean that you should turn off Qt Compatible debugging in PyCharm. It's a bug
-    https://youtrack.jetbrains.com/issue/PY-50959
-    """)
-    exit(0)
-
-import pcot.ui as ui
-import pcot.xform as xform
-import pcot.xforms
+import pcot.config
 from pcot.config import getUserName, addMainWindowHook, addExprFuncHook
-from pcot.utils import archive
-from pcot.xforms import *
 import logging
 import pkgutil
 
@@ -25,6 +12,35 @@ import faulthandler
 
 faulthandler.enable()
 
+
+def __getattr__(name):
+    """Subpackages and modules which aren't needed just to import PCOT (in particular those which load Qt, like
+    the UI and the nodes) are imported by setup(), or when they are first used."""
+    try:
+        return importlib.import_module(f"{__name__}.{name}")
+    except ModuleNotFoundError as e:
+        if e.name != f"{__name__}.{name}":
+            raise
+        raise AttributeError(f"module {__name__} has no attribute {name}") from None
+
+
+def importAll():
+    """Import the modules which define the macro system and all the node types. setup() calls this."""
+    try:
+        import pcot.macros
+    except AttributeError as e:
+        traceback.print_exc()
+        print("""
+        This error MAY mean that you should turn off Qt Compatible debugging in PyCharm. It's a bug
+        https://youtrack.jetbrains.com/issue/PY-50959
+        """)
+        exit(0)
+
+    import pcot.xforms
+    for x in pcot.xforms.__all__:
+        importlib.import_module(f"pcot.xforms.{x}")
+
+
 plugins_loaded = False
 
 
@@ -62,6 +78,8 @@ def setup():
     """Call this to initialise PCOT. We could just call it here, but other things would break then.
     You'll see that main() calls it."""
 
+    importAll()
+
     # forces the file to be parsed, which uses decorators to register functions etc.
     import pcot.expressions.register
     # force import of builtin functions!
@@ -72,12 +90,12 @@ def setup():
     # creates xform type singletons, which also causes the expression evaluator to be
     # created as part of XFormExpr, running the functions registered above and thus
     # allowing *them* to register functions etc.
-    xform.createXFormTypeInstances()
+    pcot.xform.createXFormTypeInstances()
 
     # load camera set data
-    config.loadCameras()
+    pcot.config.loadCameras()
     # and reflectances
-    config.loadReflectances()
+    pcot.config.loadReflectances()
 
     # If we run without a GUI, we still need an application. This will provide that.
     from pcot.app import checkApp
@@ -12,7 +12,7 @@ import getpass
 import sys
 
 import pcot.config
-import pcot.ui.mainwindow
+import pcot.ui
 from pcot.document import Document
 from pcot.ui import collapser
 
@@ -1,4 +1,5 @@
 import logging
+from typing import List
 
 from pcot.cameras.filters import DUMMY_FILTER
 from pcot.cameras.filtresponse import FilterResponse
@@ -136,7 +137,8 @@ class CameraData:
     def __init__(self, fileName=None):
         """Load the CameraParams object from an archive, and embed it in our new CameraData object. Also store
         the filename of the archive and the archive itself, because we are going to be loading other data (e.g.
-        flatfields) when we need them."""
+        flatfields) when we need them. The archive is only open while we're reading it, so that the file can be
+        replaced (e.g. by gencam) while PCOT is running."""
         from pcot.utils.archive import FileArchive, ArchiveType
         from pcot.utils.datumstore import DatumStore
 
@@ -233,3 +235,9 @@ class CameraData:
     def getFlat(self, filtname) -> Datum:
         """Get the flatfield for the given filter and position."""
         return self.archive.get(f"flat_{filtname}")
+
+    def getFlats(self, filtnames) -> List[Datum]:
+        """Get the flatfields for several filters, opening the archive only once to read those which
+        aren't already cached."""
+        with self.archive.readBatch():
+            return [self.getFlat(x) for x in filtnames]
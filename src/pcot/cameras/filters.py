@@ -6,8 +6,6 @@ from pathlib import Path
 from typing import List, Optional
 
 import numpy as np
-from scipy.interpolate import RegularGridInterpolator
-from skimage.data import camera
 
 from pcot import ui
 from pcot.cameras.filtresponse import FilterResponse
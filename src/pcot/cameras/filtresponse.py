@@ -8,10 +8,13 @@ Filter response classes, which consist of interpolators
 """
 import logging
 import re
-from typing import Optional
+from typing import Optional, TYPE_CHECKING
 
 import numpy as np
-from scipy.interpolate import RegularGridInterpolator
+
+if TYPE_CHECKING:
+    # scipy.interpolate is slow to import, so we only import it when we make an interpolator
+    from scipy.interpolate import RegularGridInterpolator
 
 logger = logging.getLogger(__name__)
 
@@ -25,34 +28,41 @@ class FilterResponse:
     class will simulate).
     """
 
-    _interpolator: RegularGridInterpolator
+    _interpolator: Optional['RegularGridInterpolator']
     _is_simulated: bool  # essentially determines if this gets saved to the camera data file.
     clipped_to: Optional[float]
 
-    def __init__(self, interpolator: Optional[RegularGridInterpolator],
+    def __init__(self, interpolator: Optional['RegularGridInterpolator'],
                  wavelengths: Optional[np.ndarray]=None,
                  values: Optional[np.ndarray]=None,
                  clipped_to: Optional[float]=None,
                  is_simulated=False):
-        """If an interpolator is provided, use it. Otherwise create a simulated interpolator from wavelengths and values."""
-        if interpolator is None:
-            self._interpolator = RegularGridInterpolator((wavelengths,), values,
-                                                     method="linear",
-                                                     bounds_error=False,  # no error on out-of-bounds
-                                                     fill_value=None)  # we extrapolate the data if out-of-bounds
-        else:
-            self._interpolator = interpolator
+        """If an interpolator is provided, use it. Otherwise create a simulated interpolator from wavelengths and values
+        when it is first needed (so that making the dummy filter at startup doesn't import scipy.interpolate)."""
+        self._interpolator = interpolator
+        self._simulatedData = (wavelengths, values)
         self._is_simulated = is_simulated
         self.clipped_to = clipped_to   # the level to which this response has been clipped (percentage), or None
 
+    @property
+    def interpolator(self) -> 'RegularGridInterpolator':
+        if self._interpolator is None:
+            from scipy.interpolate import RegularGridInterpolator
+            wavelengths, values = self._simulatedData
+            self._interpolator = RegularGridInterpolator((wavelengths,), values,
+                                                         method="linear",
+                                                         bounds_error=False,  # no error on out-of-bounds
+                                                         fill_value=None)  # we extrapolate the data if out-of-bounds
+        return self._interpolator
+
     def __str__(self):
         """Used in debugging"""
-        dims = "x".join(map(str, self._interpolator.values.shape))
+        dims = "x".join(map(str, self.interpolator.values.shape))
         return f"FilterResponse(sim={self.is_simulated}, interp={dims})"
 
     def sourceDesc(self):
         """Used in Source descriptions"""
-        dims = "x".join(map(str, self._interpolator.values.shape))
+        dims = "x".join(map(str, self.interpolator.values.shape))
         return f"{'sim' if self._is_simulated else 'real'},{dims}"
 
     @staticmethod
@@ -76,11 +86,11 @@ class FilterResponse:
         return res
 
     def getResponse(self, wavelengths: np.ndarray, angle=0.0) -> np.ndarray:
-        dims = len(self._interpolator.values.shape)
+        dims = len(self.interpolator.values.shape)
         if dims == 1:
-            return self._interpolator(wavelengths)
+            return self.interpolator(wavelengths)
         elif dims == 2:
-            return self._interpolator((wavelengths, angle))
+            return self.interpolator((wavelengths, angle))
         else:
             raise NotImplementedError(f"{dims}-dimensional interpolators not implemented")
 
@@ -90,15 +100,16 @@ class FilterResponse:
             return None
         else:
             return {
-                "points": self._interpolator.grid,
-                "values": self._interpolator.values,
-                "method": self._interpolator.method,
+                "points": self.interpolator.grid,
+                "values": self.interpolator.values,
+                "method": self.interpolator.method,
                 "clipped_to": self.clipped_to,
             }
 
     @staticmethod
     def deserialise(data):
         # this should only be called on a non-simulated filter, because of the check in serialise()
+        from scipy.interpolate import RegularGridInterpolator
         v = data["values"]
         interp = RegularGridInterpolator(data["points"], v, method=data["method"],
                                          bounds_error=False, fill_value=0.0)
@@ -121,6 +132,8 @@ class FilterResponse:
         if it was necessary.
         """
 
+        from scipy.interpolate import RegularGridInterpolator
+
         # We're not using the csv package, and we're opening with latin-1 because my data has a degree symbol!
 
         NUMBER_RE = re.compile(r"-?\d+(?:\.\d+)?")      # regex for finding first valid number as a group
@@ -8,9 +8,8 @@ having this loaded in startup isn't a problem.
 """
 # See Notes on PCT Reflectance data in Obsidian
 
-from scipy.interpolate import RegularGridInterpolator
 from pathlib import Path
-from typing import Dict, Optional, Any, List, Set, Tuple
+from typing import Dict, Optional, Any, List, Set, Tuple, TYPE_CHECKING
 
 import numpy as np
 import logging
@@ -18,6 +17,10 @@ import logging
 from pcot.cameras.filters import Filter
 from pcot.utils import archive
 
+if TYPE_CHECKING:
+    # scipy.interpolate is slow to import, so it's only imported when reflectance data is actually built
+    from scipy.interpolate import RegularGridInterpolator
+
 
 logger = logging.getLogger(__name__)
 
@@ -155,6 +158,7 @@ class Reflectance:
         """
         Interpolators are loaded on demand by the superclass
         """
+        from scipy.interpolate import RegularGridInterpolator
         if len(self._interpolators) == 0:
             # only if we haven't loaded them already (or set them another way)
             dims = None
@@ -183,6 +187,7 @@ class Reflectance:
         
     def _check_interpolators(self):
         """check the interpolators are valid for this reflectance"""
+        from scipy.interpolate import RegularGridInterpolator
         assert isinstance(self._interpolators,dict)
         for v in self._interpolators.values():
             assert isinstance(v,RegularGridInterpolator)
@@ -199,6 +204,7 @@ class SimpleReflectance(Reflectance):
 
     def load_simple_csv(self,csv:Path):
         """Load data from a CSV file with the columns patch,wavelength,mean,sd"""
+        from scipy.interpolate import RegularGridInterpolator
         with open(csv) as f:
             import csv
             reader = csv.DictReader(f)
@@ -281,7 +287,7 @@ class PCTReflectance(Reflectance):
     rev_name_map = {v: k for k, v in name_map.items()}
 
     # this is the thing that we get data from!
-    _interpolators: Dict[str,RegularGridInterpolator]
+    _interpolators: Dict[str,'RegularGridInterpolator']
 
     def __init__(self, interpolators=None, metadata=None, path=None, patches=None):
         """Initialise from interpolators, or create empty dict"""
@@ -377,6 +383,7 @@ class PCTReflectance(Reflectance):
         return (thetas, wvls, np.array(refldata_by_theta))
 
     def load_jack(self, patch: str, path: Path):
+        from scipy.interpolate import RegularGridInterpolator
         phis = []
         thetas = None
         wvls = None
@@ -23,6 +23,7 @@ from pcot.imagecube import ImageCube
 
 # normalisation modes
 from pcot.utils.image import imgsplit, imgmerge
+from pcot.utils.tilestats import TileStats
 
 NormToRGB = 0  # normalise to visible RGB bands' range
 NormToImg = 1  # normalise to entire image's range
@@ -52,41 +53,42 @@ def canvasNormalise(img: ImageCube,
                     rgbUncropped: np.ndarray,
                     normMode: int,
                     normToCropped: bool,
-                    rect: Optional[Tuple[int, int, int, int]]) -> np.ndarray:
+                    rect: Optional[Tuple[int, int, int, int]],
+                    rgbStats: Optional[TileStats] = None,
+                    imgStats: Optional[TileStats] = None) -> np.ndarray:
     """
     This does normalisation for the canvas. The parameter list may seem rather eccentric, but this
     set of parameters helps things run more smoothly with fewer copies and cuts.
     Arguments:
-        img: image cube for entire image, all channels, not cropped
-        rgbCropped: RGB numpy image array, cropped to view
-        rgbUncropped: uncropped RGB image array (need this for normToEntireImage)
+        img: image data for entire image, all channels, not cropped
+        rgbCropped: RGB numpy image array, cropped to view (and possibly reduced in size - see utils.pyramid)
+        rgbUncropped: uncropped RGB image array at full size (the normalisation range is found from this)
         normMode: see above
         normToCropped: do we normalise to he range of the entire image or just the cropped section?
-        rect: rectangle we are 'cutting' which may be None. Only this range is considered.
+        rect: rectangle we are 'cutting' in the full size image, which may be None. Only this range is considered.
+        rgbStats, imgStats: cached range statistics for rgbUncropped and img (see utils.tilestats). The canvas
+            keeps these between repaints; if they aren't given they are created here.
     """
+    if normMode == NormNone:
+        return rgbCropped  # we leave the RGB unchanged
+
+    # the ranges are found from the full size image (or its crop), so they are the same whatever
+    # size rgbCropped has been reduced to.
+    rangeRect = rect if normToCropped else None
     if normMode == NormSeparately:
         # process each band in the cropped image separately
-        bands = []
-        for normband, imageband in zip(imgsplit(rgbCropped if normToCropped else rgbUncropped), imgsplit(rgbCropped)):
-            mn = np.min(normband)
-            mx = np.max(normband)
-            bands.append(normOrZero(imageband, mn, mx))
+        stats = rgbStats or TileStats(rgbUncropped)
+        mns, mxs = stats.range(rangeRect)
+        bands = [normOrZero(imageband, mn, mx) for imageband, mn, mx in zip(imgsplit(rgbCropped), mns, mxs)]
         out = imgmerge(bands)
     elif normMode == NormToRGB:  # we're normalising to the entire cropped image
-        x = rgbCropped if normToCropped else rgbUncropped
-        mn = np.min(x)  # so we get the normalisation range from there
-        mx = np.max(x)
-        out = normOrZero(rgbCropped, mn, mx)
+        stats = rgbStats or TileStats(rgbUncropped)
+        mns, mxs = stats.range(rangeRect)
+        out = normOrZero(rgbCropped, np.min(mns), np.max(mxs))
     elif normMode == NormToImg:  # now normalising to all bands
-        if normToCropped:
-            # crop if required
-            x, y, w, h = rect
-            img = img[y:y + h, x:x + w]
-        mn = np.min(img)  # so we get the normalisation range from there
-        mx = np.max(img)
-        out = normOrZero(rgbCropped, mn, mx)
-    elif normMode == NormNone:
-        out = rgbCropped  # otherwise we leave the RGB unchanged
+        stats = imgStats or TileStats(img)
+        mns, mxs = stats.range(rangeRect)
+        out = normOrZero(rgbCropped, np.min(mns), np.max(mxs))
     else:
         out = rgbCropped
         ui.error(f"unknown canvas normalisation mode {normMode}")
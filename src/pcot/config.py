@@ -4,14 +4,15 @@ Configuration data system, also handles hooks for plugins
 import getpass
 import logging
 import os
+import tempfile
 from collections import deque
 from pathlib import Path
 from typing import Optional, List
 
 import yaml
-from PySide2 import QtWidgets
 
 from pcot.parameters.taggedaggregates import TaggedDictType, Maybe, TaggedDict, TaggedListType
+from pcot.utils.archive import COMPRESSION_TYPES
 from pcot.utils.demosaicing import VALID_BAYER_PATTERNS
 
 logger = logging.getLogger(__name__)
@@ -42,6 +43,42 @@ CONFIG_DICT_TYPE = TaggedDictType(
         macrosandfaves=("List of macro and favourites archives", TaggedListType(Path,[], deflt_append=Path.home()/"archive.pcot", valid_choices=False)),
     ).setOrdered(), None),
 
+    nodecache=("On-disk cache of node outputs, reused between sessions and batch runs", TaggedDictType(
+        enabled=("Store node outputs in the cache and reuse them", bool, False),
+        location=("Directory for the cache", Path, CONFIG_PATH.parent / "pcot_nodecache", True),
+        maxsize=("Maximum size of the cache in megabytes", int, 4096, (1, 10000000)),
+    ).setOrdered(), None),
+
+    outofcore=("Storing large images in memory-mapped temporary files rather than RAM", TaggedDictType(
+        enabled=("Store large image arrays in temporary files", bool, False),
+        location=("Directory for the temporary files", Path, Path(tempfile.gettempdir()), True),
+        threshold=("Size in megabytes above which an array is stored in a file", int, 512, (1, 10000000)),
+        tilesize=("Size in megabytes of the strips in which such arrays are processed", int, 64, (1, 100000)),
+    ).setOrdered(), None),
+
+    loading=("Loading image files", TaggedDictType(
+        threads=("Threads used to load files in parallel (0 to choose automatically)", int, 0, (0, 1024)),
+        cachesize=("Size in megabytes of the cache of loaded files shared by all inputs (0 for no cache)",
+                   int, 1024, (0, 10000000)),
+        labelindex=("Keep an index of the PDS4 labels in scanned directories, so they can be rescanned quickly",
+                    bool, True),
+        labelindexlocation=("Directory for the PDS4 label index", Path, CONFIG_PATH.parent / "pcot_labelindex", True),
+    ).setOrdered(), None),
+
+    canvas=("Displaying images in canvases", TaggedDictType(
+        backgroundrender=("Prepare canvas images in a background thread, showing a low resolution preview first",
+                          bool, True),
+    ).setOrdered(), None),
+
+    archives=("Storage of data in PARC files and other archives", TaggedDictType(
+        storearrays=("Store arrays uncompressed, so that they can be memory-mapped when read", bool, False),
+        mmaparrays=("Memory-map uncompressed arrays when reading archives rather than loading them", bool, True),
+        compression=("Compression method: deflate, lzma (smaller but slower), bzip2 or stored (none, fastest)",
+                     str, "deflate", list(COMPRESSION_TYPES)),
+        level=("Compression level for deflate and bzip2 (higher is smaller but slower)", int, 6, (0, 9)),
+        threads=("Threads used to compress and decompress arrays (0 for one per CPU)", int, 0, (0, 1024)),
+    ).setOrdered(), None),
+
     testpds4data=("Location of testpds4data files (testing only)",Maybe(Path),None, True),
     nativefiledialog=("Use the native file dialog (best not)", bool, False),
 
@@ -163,6 +200,8 @@ def getFileDialogOptions():
     """There is a problem in the Qt->native file dialog code which causes native file dialogs to crash
     on some systems. For that reason, I'm defaulting to the Qt implementations.
     """
+    from PySide2 import QtWidgets
+
     if data.nativefiledialog:
         return QtWidgets.QFileDialog.Options()
     else:
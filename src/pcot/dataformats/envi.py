@@ -30,6 +30,25 @@ import numpy as np
 import pcot.ui as ui
 from pcot.cameras.filters import Filter
 from pcot.imagecube import ImageCube
+from pcot.utils import outofcore
+
+# ENVI data type codes and the numpy types they correspond to. We don't support the complex types.
+DATA_TYPES = {
+    '1': np.uint8,
+    '2': np.int16,
+    '3': np.int32,
+    '4': np.float32,
+    '5': np.float64,
+    '12': np.uint16,
+    '13': np.uint32,
+    '14': np.int64,
+    '15': np.uint64,
+}
+
+INTERLEAVES = ('bsq', 'bil', 'bip')
+
+# how many bytes of the output we write at a time
+_WRITE_CHUNK = 16 * 1024 * 1024
 
 
 def parseHeader(lines):
@@ -99,13 +118,19 @@ class ENVIHeader:
         self.h = int(d['lines'])
         self.bands = int(d['bands'])
 
-        self.headerOffset = [int(d['headerOffset']) if 'headerOffset' in d else 0]
-        self.byteorder = 'little' if d['byte order'] == '0' else 'big'
+        self.headerOffset = int(d.get('header offset', d.get('headeroffset', 0)))
+        self.byteorder = 'little' if d.get('byte order', '0') == '0' else 'big'
+
+        self.interleave = d.get('interleave', 'bsq').lower()
+        if self.interleave not in INTERLEAVES:
+            raise Exception(f"Unsupported interleave {self.interleave}")
+        if d['data type'] not in DATA_TYPES:
+            raise Exception(f"Unsupported data type {d['data type']}")
+        self.dtype = np.dtype(DATA_TYPES[d['data type']]).newbyteorder('<' if self.byteorder == 'little' else '>')
 
-        if d['interleave'] != 'bsq':
-            raise Exception("Only BSQ interleave is supported")
-        if d['data type'] != '4':
-            raise Exception("Data type must be 32-bit float")
+        # gains and offsets to convert the data into real values; None if there aren't any.
+        self.gains = [float(x) for x in d['data gain values']] if 'data gain values' in d else None
+        self.offsets = [float(x) for x in d['data offset values']] if 'data offset values' in d else None
 
         if 'default bands' in d:
             # based at one, for heaven's sake.
@@ -125,12 +150,7 @@ class ENVIHeader:
             else:
                 fwhm = [0 for _ in wavelengths]
 
-            if 'data gain values' in d:
-                gain = [float(x) for x in d['data gain values']]
-            else:
-                gain = [0 for _ in wavelengths]
-
-            self.gains = gain
+            gain = self.gains if self.gains is not None else [0 for _ in wavelengths]
 
             self.filters = []
             for w, f, g, n in zip(wavelengths, fwhm, gain, bandNames):
@@ -143,7 +163,12 @@ class ENVIHeader:
 
 
 def load(fn:Path|str) -> Tuple[ENVIHeader, np.ndarray]:
-    """Takes the ENVI header name. Actually loads the envi, returning a tuple of (header, ndarray)"""
+    """Takes the ENVI header name. Actually loads the envi, returning a tuple of (header, ndarray).
+    The data file is memory-mapped, so data is only read when it is used. If it is 32-bit float BIP data
+    in the machine's byte order with no gains or offsets to apply, the array is a (copy-on-write) view
+    of the file. Otherwise it is converted into a new float32 array of shape (h, w, bands) a few rows at a
+    time, so we never need more than one copy of the data in memory (and that array can be out of core:
+    see pcot.utils.outofcore)."""
 
     if not fn:
         raise Exception("No filename given in ENVI load!")
@@ -166,36 +191,49 @@ def load(fn:Path|str) -> Tuple[ENVIHeader, np.ndarray]:
         raise Exception("cannot find ENVI data file")
 
     size = os.stat(datfile).st_size
-
-    # remember, we only support float format BSQ right now.
-
-    requiredSize = 4 * h.bands * h.w * h.h
+    requiredSize = h.headerOffset + h.dtype.itemsize * h.bands * h.w * h.h
 
     if size != requiredSize:
         raise Exception("Size of ENVI data file is incorrect")
 
-    bands = []
-    with open(datfile, "rb") as f:
-        for i in range(0, h.bands):
-            band = np.fromfile(f, np.float32, h.w * h.h).reshape(h.h, h.w)
-            gain = h.gains[i]
-            if sys.byteorder != h.byteorder:
-                band = band.byteswap()
-            bands.append(band)  # Do I need to apply the data gain values here??
-
-    # now have list of 6 bands. Interleave.
-    img = np.stack(bands, axis=-1)
+    # map the file with the shape of its interleave, and get a (h, w, bands) view of it
+    shape = {'bsq': (h.bands, h.h, h.w), 'bil': (h.h, h.bands, h.w), 'bip': (h.h, h.w, h.bands)}[h.interleave]
+    data = np.memmap(datfile, dtype=h.dtype, mode='c', offset=h.headerOffset, shape=shape)
+    if h.interleave == 'bsq':
+        data = data.transpose(1, 2, 0)
+    elif h.interleave == 'bil':
+        data = data.transpose(0, 2, 1)
+
+    gains = None if h.gains is None else np.array(h.gains, dtype=np.float32)
+    offsets = None if h.offsets is None else np.array(h.offsets, dtype=np.float32)
+    if gains is not None and np.all(gains == 1):
+        gains = None
+    if offsets is not None and np.all(offsets == 0):
+        offsets = None
+
+    if h.interleave == 'bip' and h.dtype == np.dtype(np.float32) and gains is None and offsets is None:
+        return h, data
+
+    img = outofcore.allocate((h.h, h.w, h.bands), np.float32)
+    rows = max(1, _WRITE_CHUNK // max(1, h.w * h.bands * 4))
+    for y in range(0, h.h, rows):
+        sl = slice(y, y + rows)
+        img[sl] = data[sl]
+        if gains is not None:
+            img[sl] *= gains
+        if offsets is not None:
+            img[sl] += offsets
 
     return h, img
 
 
-def _genheader(f, w: int, h: int, freqs: List[float], camname="LWAC"):
+def _genheader(f, w: int, h: int, freqs: List[float], camname="LWAC", interleave="bsq"):
     """Crude envi header writer"""
 
     f.write("ENVI\n")
     f.write(f"samples = {w}\nlines   = {h}\nbands   = {len(freqs)}\n")
-    f.write("data type = 4\ninterleave = bsq\nfile type = ENVI Standard\n")
-    f.write("header offset = 0\nbyte order = 0\n")
+    f.write(f"data type = 4\ninterleave = {interleave}\nfile type = ENVI Standard\n")
+    f.write(f"header offset = 0\nbyte order = {0 if sys.byteorder == 'little' else 1}\n")
     f.write("geo points = {\n")
     f.write(f"    0.00000000,    0.00000000,    0.00000000,    0.00000000,\n")
     f.write(f" {w - 1}.00000000,    0.00000000,    0.00000000, {w - 1}.00000000,\n")
@@ -228,29 +266,50 @@ def _genheader(f, w: int, h: int, freqs: List[float], camname="LWAC"):
     f.write("units = DN/s\n")
 
 
-def _write(name: str, freqs: List[float], img: np.ndarray, camname):
+def _write(name: str, freqs: List[float], img: np.ndarray, camname, interleave="bsq"):
     """The input here a filename base, a (h,w,depth) numpy array,
-    and a set of frequencies of the same number as the depth."""
+    and a set of frequencies of the same number as the depth. The data is written
+    a few rows of a band (or of all bands, for BIL and BIP) at a time, converting
+    to 32-bit float as we go, so no copy of the whole image is made."""
+    if len(img.shape) == 2:
+        img = img[:, :, np.newaxis]
     assert (len(img.shape) == 3)
     h, w, depth = img.shape
     assert depth == len(freqs)
+    if interleave not in INTERLEAVES:
+        raise ValueError(f"Unsupported interleave {interleave}")
 
-    # first, write out the header
-    with open(f"{name}.hdr", "w") as f:
-        _genheader(f, w, h, freqs, camname)
+    # write the data to a temporary file which replaces the .dat file at the end: the image may be
+    # memory-mapped from the file we're replacing (see load()).
+    datfile = f"{name}.dat"
+    tmpfile = f"{datfile}.{os.getpid()}.tmp"
+    try:
+        with open(tmpfile, "wb") as f:
+            if interleave == 'bsq':
+                rows = max(1, _WRITE_CHUNK // (w * 4))
+                for b in range(depth):
+                    for y in range(0, h, rows):
+                        f.write(np.ascontiguousarray(img[y:y + rows, :, b], dtype=np.float32).data)
+            else:
+                rows = max(1, _WRITE_CHUNK // (w * depth * 4))
+                for y in range(0, h, rows):
+                    chunk = img[y:y + rows]
+                    if interleave == 'bil':
+                        chunk = chunk.transpose(0, 2, 1)
+                    f.write(np.ascontiguousarray(chunk, dtype=np.float32).data)
+    except BaseException:
+        os.remove(tmpfile)
+        raise
 
-    # now output the actual ENVI data
-    bands = [np.reshape(x, img.shape[:2]) for x in np.dsplit(img, img.shape[-1])]
-    with open(f"{name}.dat", "wb") as f:
-        for b in bands:
-            assert b.shape == img.shape[:2]
-            data = b.reshape(w * h).astype(np.float32)
-            f.write(data)
+    with open(f"{name}.hdr", "w") as f:
+        _genheader(f, w, h, freqs, camname, interleave)
+    os.replace(tmpfile, datfile)
 
 
-def write(fn: str, img: ImageCube, camname="LWAC"):
+def write(fn: str, img: ImageCube, camname="LWAC", interleave="bsq"):
+    """Write an image as ENVI, to fn.hdr and fn.dat. The interleave can be bsq, bil or bip."""
     # convert the sources to frequencies, assuming there is only
     # one source per channel and they all have centre wavelength values
     freqs = [next(iter(s)).getFilter().cwl for s in img.sources]
 
-    _write(fn, freqs, img.img, camname)
+    _write(fn, freqs, img.img, camname, interleave)
@@ -16,7 +16,7 @@ from pcot.datum import Datum
 from pcot.imagecube import ChannelMapping, ImageCube, load_rgb_image
 from pcot.sources import StringExternal, MultiBandSource, Source
 from pcot.ui.presetmgr import PresetOwner
-from pcot.utils import image
+from pcot.utils import filecache, outofcore
 from pcot.utils.datumstore import readParc
 
 logger = logging.getLogger(__name__)
@@ -103,7 +103,7 @@ def multifile(directory: Path|str,
               rawloader: Optional[RawLoader] = None,
               inpidx: int = None,
               mapping: ChannelMapping = None,
-              cache: Dict[str, Tuple[np.ndarray, float]] = None,
+              cache: bool = True,
               really_no_camera: bool = False) -> Datum:
     """Load an imagecube from multiple files (e.g. a directory of .png files),
     where each file is a monochrome image of a different band. The names of
@@ -127,8 +127,8 @@ def multifile(directory: Path|str,
     - camera: the name of the camera to use for filter name lookup etc. If not set or None, default camera is used
       (but see really_no_camera)
     - rawloader: a RawLoader object to use for loading raw files (unused if we're not loading raw files)
-    - cache: a dictionary of cached data to avoid loading the same file multiple times.
-      The key is the filename and the value is a tuple of the image data and the time it was loaded.
+    - cache: if true, use the process-wide cache of loaded files (see pcot.utils.filecache) to avoid loading
+      the same file multiple times.
     - really_no_camera: really set the camera to None! This is used when we are just loading images with no regard to band etc.
 
     The regular expression works thus:
@@ -245,13 +245,12 @@ def multifile(directory: Path|str,
         filterre = None
 
     sources = []  # array of source sets for each image
-    imgs = []  # array of actual images (greyscale, numpy)
+    paths = []  # and the paths of the files
 
     # make sure we're dealing with a Path
     directory = Path(directory)
 
-    # load each image - they must all be the same size and will be converted
-    # to greyscale
+    # first find the files and build their sources
 
     for fname in fnames:
         if fname is not None:
@@ -271,35 +270,6 @@ def multifile(directory: Path|str,
                 if not path.exists():
                         raise FileNotFoundError(errno.ENOENT, os.strerror(errno.ENOENT), path)
 
-            def load(path: Path) -> np.ndarray:
-                logger.debug(f"Loading {path} at bitdepth {bitdepth}")
-                if rawloader is not None and rawloader.is_raw_file(path):
-                    return rawloader.load(path, bitdepth=bitdepth)
-                else:
-                    return load_rgb_image(path, bitdepth=bitdepth)
-
-            if cache is None:
-                img = load(path)
-            else:
-                date = os.path.getmtime(path)
-                # if the file is in the cache and the date is the same, use the cached data
-                if path in cache and cache[path][1] == date:
-                    # use the cached data
-                    img = cache[path][0]
-                    ui.log(f"Using cached image for {path}")
-                else:
-                    # update the cache
-                    ui.log(f"Loading image for {path} into cache")
-                    img = load(path)
-                    cache[path] = (img, date)
-
-            # convert to greyscale if required. But we don't use the
-            # cvtColor function because it will use a more complex formula
-            # that takes human perception into account. We want to keep the
-            # original values, so we just take the mean of the three channels.
-            if len(img.shape) == 3:
-                img = np.mean(img, axis=2).astype(np.float32)
-
             # build source data for this image
             filtpos, searchtype = getFilterSearchParam(path)
             ext = StringExternal("Multi", os.path.abspath(path))
@@ -311,19 +281,87 @@ def multifile(directory: Path|str,
                 # This can happen in gencam.
                 source = Source().setBand(f"{searchtype}={filtpos}").setInputIdx(inpidx).setExternal(ext)
 
-            # img /= filt.transmission
-            imgs.append(img)
+            paths.append(path)
             sources.append(source)
 
-    # construct the imagecube
-    if len(imgs) > 0:
-        if len(set([x.shape for x in imgs])) != 1:
+    if len(paths) == 0:
+        return Datum(Datum.IMG, None)
+
+    # Now load the files. They must all be the same size and will be converted to greyscale. This is done
+    # in a thread pool (the decoders release the GIL, and the files may be on slow storage), each band being
+    # written straight into the cube.
+
+    def decode(path) -> np.ndarray:
+        logger.debug(f"Loading {path} at bitdepth {bitdepth}")
+        if rawloader is not None and rawloader.is_raw_file(path):
+            img = rawloader.load(path, bitdepth=bitdepth)
+        else:
+            img = load_rgb_image(path, bitdepth=bitdepth)
+        # convert to greyscale if required. But we don't use the
+        # cvtColor function because it will use a more complex formula
+        # that takes human perception into account. We want to keep the
+        # original values, so we just take the mean of the three channels.
+        if len(img.shape) == 3:
+            img = np.mean(img, axis=2).astype(np.float32)
+        return img
+
+    # the cache key must include everything which affects how the file is decoded
+    loaderKey = (bitdepth, None if rawloader is None else tuple(sorted(rawloader.serialise().items())))
+
+    def loadBand(path) -> np.ndarray:
+        if cache:
+            return filecache.cache.load(path, loaderKey, decode)
+        return decode(path)
+
+    def store(i, band):
+        if band.shape != img.shape[:2]:
             raise Exception("all images must be the same size in a multifile")
-        img = image.imgmerge(imgs).astype(np.float32)
-        img = ImageCube(img, mapping, MultiBandSource(sources))
+        img[:, :, i] = band
+
+    if rawloader is not None and all(rawloader.is_raw_file(p) for p in paths):
+        # raw files all have the same size, so they can be decoded straight into a cube - either all of them,
+        # or just those which aren't in the cache.
+        if cache and filecache.enabled():
+            keys = [filecache.cache.key(p, loaderKey) for p in paths]
+            bands = [filecache.cache.get(k) for k in keys]
+            missing = [i for i, b in enumerate(bands) if b is None]
+        else:
+            keys, bands, missing = None, None, range(len(paths))
+
+        img = rawloader.loadMany([paths[i] for i in missing], bitdepth=bitdepth) if missing else None
+        if keys is not None:
+            # cache copies of the new bands (the cached arrays are read-only and shared)
+            for j, i in enumerate(missing):
+                filecache.cache.put(keys[i], img[:, :, j].copy())
+            if len(missing) < len(paths):
+                decoded = img
+                img = outofcore.allocate(rawloader.shape() + (len(paths),), np.float32)
+                for j, i in enumerate(missing):
+                    img[:, :, i] = decoded[:, :, j]
+                del decoded
+                for i, band in enumerate(bands):
+                    if band is not None:
+                        store(i, band)
     else:
-        img = None
-
+        # load the first file to find out how big the cube is
+        first = loadBand(paths[0])
+        img = outofcore.allocate(first.shape[:2] + (len(paths),), np.float32)
+        store(0, first)
+        del first
+
+        pool = filecache.pool(len(paths) - 1)
+        if pool is None:
+            for i, path in enumerate(paths[1:], 1):
+                store(i, loadBand(path))
+        else:
+            with pool:
+                futures = [pool.submit(lambda i, path: store(i, loadBand(path)), i, path)
+                           for i, path in enumerate(paths[1:], 1)]
+                for f in futures:
+                    f.result()  # re-raises any exception
+
+    # img /= filt.transmission
+    img = ImageCube(img, mapping, MultiBandSource(sources))
     return Datum(Datum.IMG, img)
 
 
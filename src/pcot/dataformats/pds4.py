@@ -1,3 +1,8 @@
+import hashlib
+import json
+import logging
+import os
+import tempfile
 from datetime import datetime
 from pathlib import Path
 from typing import Dict, List, Optional, Union
@@ -5,6 +10,7 @@ from typing import Dict, List, Optional, Union
 import numpy as np
 from dateutil import parser
 from proctools.products import DataProduct
+from xml.parsers.expat import ExpatError
 
 import pcot
 import pcot.dq
@@ -13,6 +19,9 @@ from pcot.datum import Datum
 from pcot.cameras.filters import Filter
 from pcot.imagecube import ImageCube, ChannelMapping
 from pcot.sources import External, MultiBandSource, Source
+from pcot.utils import filecache, outofcore
+
+logger = logging.getLogger(__name__)
 
 
 def show_meta_debug(m):
@@ -231,9 +240,13 @@ class ProductList:
                 out.append(PDS4ImageProduct(d))
             else:
                 raise ValueError(f"Can't create ProductList from DataProducts of type {d.type}")
-        # we sort by camera, then freq, then bandwidth, then start
-        out.sort(key=lambda p: (p.camera, p.filt.cwl, p.filt.fwhm, p.start))
-        return out
+        return cls.sortProducts(out)
+
+    @staticmethod
+    def sortProducts(lst: List[PDS4ImageProduct]) -> List[PDS4ImageProduct]:
+        """Sort image products by camera, then freq, then bandwidth, then start"""
+        lst.sort(key=lambda p: (p.camera, p.filt.cwl, p.filt.fwhm, p.start))
+        return lst
 
     def serialise(self) -> List:
         """Serialise the product list into a list"""
@@ -286,31 +299,45 @@ class ProductList:
     @staticmethod
     def _toImageDatum(selected: List[PDS4Product], multValue, mapping, inpidx) -> Datum:
         """Convert the selected list into an image datum. Must be all image products,
-        and the same size."""
-
-        def getDQBits(data, uncertainty, dq):
-            """Converts DQ data in the PDS4 QUALITY array into our DQ bits, and adds others
-            depending on the other data too."""
-            out = np.where(dq == 1, 0, pcot.dq.NODATA)  # where DQ is 1, output 0. Else output NODATA.
-            out |= np.where(data > 0.9999999, pcot.dq.SAT,
-                            0)  # where data is greater than or equal to 1 add the SAT bit
-            out |= np.where(uncertainty == 0.0, pcot.dq.NOUNCERTAINTY, 0)  # set NOUNC bit if zero uncertainty data
-            return out.astype(np.uint16)
-
-        # get the data from each product and combine it
-        try:
-            # I'm converting to float32 here because I'm occasionally seeing errors in the ImageCube
-            # constructor when the data is '>f4', which apparently is a different type to float32.
-            def chk_float32(x):
-                if x.dtype == '>f4':
-                    return x.astype(np.float32)
-                return x
-
-            imgdata = chk_float32(np.dstack([x.p.data for x in selected]) * multValue)
-            uncertainty = chk_float32(np.dstack([x.p.err for x in selected]))
-            dq = np.dstack([getDQBits(x.p.data * multValue, x.p.err, x.p.dq) for x in selected])
-        except ValueError as e:
+        and the same size. The products are decoded in parallel, each straight into its band of the
+        image, uncertainty and DQ arrays."""
+
+        def fetch(x, i):
+            """Read a product into band i, converting the DQ data in the PDS4 QUALITY array into our DQ bits
+            and adding others depending on the other data too. This is all done in one pass over the band."""
+            data = np.asarray(x.p.data)
+            if data.shape != imgdata.shape[:2]:
+                raise ValueError("Error in combining image products - are they all the same size?")
+            # this also converts big-endian '>f4' data, which the ImageCube constructor doesn't like
+            img = imgdata[:, :, i]
+            np.multiply(data, multValue, out=img, casting='unsafe')
+            unc = uncertainty[:, :, i]
+            unc[...] = np.asarray(x.p.err)
+            out = dq[:, :, i]
+            # where DQ is 1, output 0. Else output NODATA.
+            np.multiply(np.asarray(x.p.dq) != 1, np.uint16(pcot.dq.NODATA), out=out)
+            # where data is greater than or equal to 1 add the SAT bit
+            np.bitwise_or(out, np.uint16(pcot.dq.SAT), out=out, where=img > 0.9999999)
+            # set NOUNC bit if zero uncertainty data
+            np.bitwise_or(out, np.uint16(pcot.dq.NOUNCERTAINTY), out=out, where=unc == 0.0)
+
+        # the first product tells us how big the image is
+        shape = np.shape(selected[0].p.data)
+        if len(shape) != 2:
             raise ValueError("Error in combining image products - are they all the same size?")
+        shape = shape + (len(selected),)
+        imgdata = outofcore.allocate(shape, np.float32)
+        uncertainty = outofcore.allocate(shape, np.float32)
+        dq = outofcore.allocate(shape, np.uint16)
+
+        pool = filecache.pool(len(selected), prefix="pds4")
+        if pool is None:
+            for i, x in enumerate(selected):
+                fetch(x, i)
+        else:
+            with pool:
+                for f in [pool.submit(fetch, x, i) for i, x in enumerate(selected)]:
+                    f.result()  # re-raises any exception
 
         # now handle the sources
         sources = MultiBandSource([Source()
@@ -323,3 +350,109 @@ class ProductList:
                         uncertainty=uncertainty, dq=dq)
 
         return Datum(Datum.IMG, img)
+
+
+# Scanning directories for PDS4 labels. Reading every label in a directory of thousands of products is slow, so
+# we keep an index for each directory we scan (if "labelindex" is set in the "loading" section of the
+# configuration). This is a JSON file mapping each label's path to its modification time, size and the
+# serialised PDS4Product read from it. When the directory is scanned again only new or changed labels are
+# read, and the rest of the products are created from the index; their DataProducts are loaded from the
+# labels when their data is needed (see PDS4Product.load()).
+
+def _indexPath(directory: Path, recursive: bool) -> Optional[Path]:
+    """Get the path of the label index for a directory, or None if we're not using an index"""
+    conf = pcot.config.data.loading
+    if not conf.labelindex:
+        return None
+    key = hashlib.sha256(f"{directory}:{recursive}".encode()).hexdigest()
+    return Path(conf.labelindexlocation).expanduser() / (key + ".json")
+
+
+def _readIndex(path: Optional[Path]) -> Dict:
+    """Read a label index, returning an empty one if there isn't one or it can't be read"""
+    if path is None or not path.is_file():
+        return {}
+    try:
+        with open(path) as f:
+            return json.load(f)['labels']
+    except Exception as e:
+        logger.warning(f"Cannot read PDS4 label index {path}: {e}")
+        return {}
+
+
+def _writeIndex(path: Optional[Path], directory: Path, labels: Dict):
+    """Write a label index, via a temporary file so that other processes never see a partial index"""
+    if path is None:
+        return
+    try:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(suffix=".tmp", dir=path.parent)
+        with os.fdopen(fd, 'w') as f:
+            json.dump({'directory': str(directory), 'labels': labels}, f)
+        os.replace(tmp, path)
+    except Exception as e:
+        logger.warning(f"Cannot write PDS4 label index {path}: {e}")
+
+
+def _readLabel(path: Path) -> Optional[Dict]:
+    """Read a label, returning an index entry: the product type and the serialised product (if it's a type we
+    can handle), or None if it isn't a valid product."""
+    try:
+        product = DataProduct.from_file(path)
+    except (TypeError, ExpatError) as e:
+        logger.warning(f"{e}; ignoring")
+        return None
+    if product.type == "spec-rad":
+        return {'type': product.type, 'product': PDS4ImageProduct(product).serialise()}
+    return {'type': product.type, 'product': None}
+
+
+def scanDirectory(directory: Union[Path, str], recursive: bool = True) -> ProductList:
+    """Find all the PDS4 products in a directory, using and updating the label index. New and changed labels
+    are read in parallel."""
+    directory = Path(directory).expanduser().absolute()
+    indexPath = _indexPath(directory, recursive)
+    oldLabels = _readIndex(indexPath)
+
+    labels = {}     # the new index: relative path -> [mtime, size, entry]
+    toRead = []     # the relative paths of labels we need to read
+    glob = directory.rglob if recursive else directory.glob
+    for path in glob("*.xml"):
+        rel = str(path.relative_to(directory))
+        st = path.stat()
+        old = oldLabels.get(rel)
+        if old is not None and old[0] == st.st_mtime_ns and old[1] == st.st_size:
+            labels[rel] = old
+        else:
+            labels[rel] = [st.st_mtime_ns, st.st_size, None]
+            toRead.append(rel)
+
+    logger.debug(f"Scanning {directory}: {len(labels)} labels, {len(toRead)} new or changed")
+    pool = filecache.pool(len(toRead), prefix="pds4")
+    if pool is None:
+        entries = [_readLabel(directory / rel) for rel in toRead]
+    else:
+        with pool:
+            entries = list(pool.map(lambda rel: _readLabel(directory / rel), toRead))
+    for rel, entry in zip(toRead, entries):
+        labels[rel][2] = entry
+    if len(toRead) > 0 or len(labels) != len(oldLabels):
+        _writeIndex(indexPath, directory, labels)
+
+    # now build the products, ignoring those with the same LID as one we already have
+    products = []
+    lids = set()
+    for rel in sorted(labels):
+        entry = labels[rel][2]
+        if entry is None:
+            continue
+        if entry['product'] is None:
+            raise ValueError(f"Can't create ProductList from DataProducts of type {entry['type']}")
+        p = deserialiseProduct(dict(entry['product']))
+        if p.lid in lids:
+            logger.warning(f"'{p.lid}' already loaded; ignoring")
+            continue
+        lids.add(p.lid)
+        p.path = str(directory / rel)
+        products.append(p)
+    return ProductList(ProductList.sortProducts(products))
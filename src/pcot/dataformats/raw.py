@@ -1,5 +1,6 @@
 """Loading 'raw' files into an ImageCube object."""
 from pathlib import Path
+from typing import List
 
 import numpy as np
 import os
@@ -77,16 +78,17 @@ class RawLoader:
                f"bigendian={self.bigendian}, offset={self.offset}, " \
                f"rot={self.rot}, horzflip={self.horzflip}, vertflip={self.vertflip}"
 
-    def load(self, filename: str|Path, bitdepth=None) -> np.ndarray:
-        """Loads the raw file and returns an array object."""
+    def _typeAndScale(self, bitdepth=None):
+        """Get the numpy dtype of the data in the file (with its byte order) and the factor which converts it
+        to the range 0-1"""
         if self.format == RawLoader.FLOAT32:
-            dtype = np.float32
+            dtype = np.dtype(np.float32)
             scale = 1.0
         elif self.format == RawLoader.UINT16:
-            dtype = np.uint16
+            dtype = np.dtype(np.uint16)
             scale = 1.0 / 65535.0
         elif self.format == RawLoader.UINT8:
-            dtype = np.uint8
+            dtype = np.dtype(np.uint8)
             scale = 1.0 / 255.0
         else:
             raise ValueError(f"Unknown format {self.format}")
@@ -94,30 +96,80 @@ class RawLoader:
         # override the scale if we have an explicit bit depth
         if bitdepth is not None:
             scale = 1.0 / ((1 << bitdepth) - 1)
-
-        data = np.fromfile(filename, dtype=dtype, offset=self.offset)
-        if self.bigendian:
-            data.byteswap(True)
-        if len(data)>self.width*self.height:
+        return dtype.newbyteorder('>' if self.bigendian else '<'), scale
+
+    def shape(self):
+        """The shape of the loaded image, after rotation"""
+        if int(self.rot / 90) % 2:
+            return self.width, self.height
+        return self.height, self.width
+
+    def _map(self, filename: str | Path, dtype) -> np.ndarray:
+        """Memory-map the data in a file, returning a (read-only) view of it with the rotation and flips
+        applied. No data is read until it is used."""
+        npix = self.width * self.height
+        count = (os.path.getsize(filename) - self.offset) // dtype.itemsize
+        if count < npix:
+            raise ValueError(f"{filename} is too short: it has {max(count, 0)} pixels, "
+                             f"expected {self.width}x{self.height}")
+        if count > npix:
             from pcot.ui import log
-            extra = len(data)-self.width*self.height
-            log(f"{filename} is too long by {extra} pixels.",logging.WARNING)
-            data = data[:self.width * self.height]      # crop if spurious data at the end
+            log(f"{filename} is too long by {count - npix} pixels.", logging.WARNING)
 
-        data = data.reshape(self.height, self.width)
+        # only the pixels we need are mapped, so any spurious data at the end is ignored
+        data = np.memmap(filename, dtype=dtype, mode='r', offset=self.offset, shape=(self.height, self.width))
         data = np.rot90(data, int(self.rot / 90))
         if self.horzflip:
             data = np.fliplr(data)
         if self.vertflip:
             data = np.flipud(data)
+        return data
+
+    def loadInto(self, filename: str | Path, out: np.ndarray, bitdepth=None):
+        """Load a raw file into an existing float32 array of the right shape (see shape()), which may be a view
+        such as a band of a cube. The byte swap, rotation, flips and scaling are all done as the data is
+        copied from the mapped file into the array, so no other full-size arrays are created."""
+        dtype, scale = self._typeAndScale(bitdepth)
+        if out.shape != self.shape():
+            raise ValueError(f"Raw image is {self.shape()}, but the output array is {out.shape}")
+        data = self._map(filename, dtype)
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(f"Loading data, range is {data.min()} to {data.max()}, format is {dtype}")
 
         # convert to float32 if necessary, dividing down to the range 0-1
-        if dtype != np.float32:
-            logger.debug(f"Loading data, currently the range is {data.min()} to {data.max()}, format is {dtype}")
-            data = data.astype(np.float32) * scale
-            logger.debug(f"Loaded as F32. Range is now {data.min()} to {data.max()}")
-        logger.info(f"Image loaded into multifile - size is {data.shape}")
-        return data
+        if dtype.kind == 'f':
+            np.copyto(out, data)
+        else:
+            np.multiply(data, np.float32(scale), out=out)
+        del data  # close the mapping
+
+    def load(self, filename: str|Path, bitdepth=None) -> np.ndarray:
+        """Loads the raw file and returns an array object."""
+        out = np.empty(self.shape(), dtype=np.float32)
+        self.loadInto(filename, out, bitdepth=bitdepth)
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(f"Loaded as F32. Range is now {out.min()} to {out.max()}")
+        logger.info(f"Image loaded into multifile - size is {out.shape}")
+        return out
+
+    def loadMany(self, filenames: List[str | Path], bitdepth=None) -> np.ndarray:
+        """Load several raw files with these settings into a single float32 cube, each file becoming a band.
+        The cube is allocated once (out-of-core if it is large enough) and the files are decoded straight into
+        it, in parallel if more than one thread is configured for loading."""
+        from pcot.utils import filecache, outofcore
+
+        out = outofcore.allocate(self.shape() + (len(filenames),), np.float32)
+        pool = filecache.pool(len(filenames), prefix="raw")
+        if pool is None:
+            for i, f in enumerate(filenames):
+                self.loadInto(f, out[:, :, i], bitdepth=bitdepth)
+        else:
+            with pool:
+                futures = [pool.submit(self.loadInto, f, out[:, :, i], bitdepth=bitdepth)
+                           for i, f in enumerate(filenames)]
+                for f in futures:
+                    f.result()  # re-raises any exception
+        return out
 
     @staticmethod
     def is_raw_file(path):
@@ -49,8 +49,8 @@ def func_wrapper(fn, d):
 
         # make copies of the source data into which we will splice the results
         imgcopy = subimage.img.copy()
-        unccopy = subimage.uncertainty.copy()
-        dqcopy = subimage.dq.copy()
+        unccopy = subimage.peekUncertainty().copy()
+        dqcopy = subimage.peekDQ().copy()
 
         # Perform the calculation on the entire subimage rectangle, but only the results covered by ROI
         # will be spliced back into the image (modifyWithSub does this).
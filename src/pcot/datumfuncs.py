@@ -53,8 +53,8 @@ def flat(val, *args):
             # we ignore "bad" pixels in the data
             mask = subimage.fullmask(maskBadPixels=True)
             cp = subimage.img.copy()
-            cpu = subimage.uncertainty.copy()
-            cpd = subimage.dq.copy()
+            cpu = subimage.peekUncertainty().copy()
+            cpd = subimage.peekDQ().copy()
 
             sources.append(x.sources)
             masked = np.ma.masked_array(cp, mask=~mask)
@@ -818,13 +818,11 @@ def interp(img, factor, w=-1):
     """
     Using trilinear interpolation, generate an image by interpolating between the bands of an existing image.
     If an ROI is attached, the image generated will be interpolated from the pixels in the ROI. The width of the image
-    will be either given in an optional parameter, or will be the same as the input image.
-
-    WARNING - IS VERY SLOW
-
+    will be either given in an optional parameter, or will be the same as the input image. If the wavelength is
+    a vector, an image with a band for each wavelength will be generated.
 
     @param img:img:the image to interpolate - the bands must be in ascending wavelength order
-    @param factor:number:the "wavelength" we want to generate an image for
+    @param factor:number:the "wavelength" (or vector of wavelengths) we want to generate an image for
     @param w:number:optional width of the image to generate
     """
     img = img.get(Datum.IMG)
@@ -858,33 +856,27 @@ def interp(img, factor, w=-1):
     if not all([x < y for x, y in zip(wavelengths, wavelengths[1:])]):
         raise XFormException('DATA', 'image wavelengths must be in ascending order')
 
-    # get the interpolation value, which will be a wavelength
-    factor = factor.get(Datum.NUMBER).n
-
-    # construct the volume - the x and y coordinates are those of the image, the z coordinate is the wavelength
-    x_volume = np.arange(img.w)
-    y_volume = np.arange(img.h)
-    z_volume = np.array(wavelengths)
-
-    # the volume is the image data
-    volume = img.img
-    # create the destination array
-    outimg = np.zeros((height, width), dtype=np.float32)
+    # get the interpolation values, which will be wavelengths
+    factors = np.atleast_1d(factor.get(Datum.NUMBER).n)
 
     import pcot.utils.interp as ip
 
     with Timer("interp"):
-        # perform the interpolation; an expensive operation!
-        xfactor = rect.w / width
-        yfactor = rect.h / height
-        for x in range(width):
-            for y in range(height):
-                xx = x * xfactor + rect.x
-                yy = y * yfactor + rect.y
-                outimg[y, x] = ip.trilinear_interpolation_fast(y_volume, x_volume, z_volume, volume, yy, xx, factor)
-            print(x)
+        # the coordinates in the source image of each column and row of the output
+        xs = np.arange(width) * (rect.w / width) + rect.x
+        ys = np.arange(height) * (rect.h / height) + rect.y
+        outimg = ip.trilinear_interpolation_bands(img.img, wavelengths, xs, ys, factors)
+
+    # each output band comes from the two input bands on either side of its wavelength
+    sources = []
+    for f in factors:
+        k = int(np.clip(np.searchsorted(wavelengths, f), 1, len(wavelengths) - 1))
+        sources.append(SourceSet([img.sources.sourceSets[k - 1], img.sources.sourceSets[k]]))
+
+    if len(factors) == 1:
+        outimg = outimg[:, :, 0]
     # construct the new imagecube
-    img = ImageCube(outimg, None, img.sources, uncertainty=None, dq=None)
+    img = ImageCube(outimg, None, MultiBandSource(sources), uncertainty=None, dq=None)
 
     return Datum(Datum.IMG, img)
 
@@ -1073,7 +1065,15 @@ def getflats(img):
 
     # now we can get the camera objects - will raise exception if not found
     # and we can get the flats - which should be images.
-    flats = [pcot.cameras.getCamera(x.camera_name).getFlat(x.name) for x in filters]
+    # Each camera's flats are read together, so its archive is only opened once.
+    namesByCamera = {}
+    for x in filters:
+        namesByCamera.setdefault(x.camera_name, []).append(x.name)
+    flatsByName = {}
+    for cameraName, names in namesByCamera.items():
+        for name, flat in zip(names, pcot.cameras.getCamera(cameraName).getFlats(names)):
+            flatsByName[(cameraName, name)] = flat
+    flats = [flatsByName[(x.camera_name, x.name)] for x in filters]
 
     # these should all be single-channel images; we can check that.
     if any([x is None for x in flats]):
@@ -9,7 +9,6 @@ import pcot.datumexceptions
 import pcot.imagecube
 import pcot.sources
 import pcot.value
-import pcot.datum
 
 typesByName = dict()
 
@@ -174,7 +173,7 @@ class ImgType(Type):
 
     def getSize(self, d):
         v = d.val
-        return v.img.nbytes + v.uncertainty.nbytes + v.dq.nbytes
+        return v.img.nbytes + v.peekUncertainty().nbytes + v.peekDQ().nbytes
 
     def writeBatchOutputFile(self, d, output: 'TaggedDict'):
         if not (output.append or output.clobber) and os.path.exists(output.file):
@@ -194,7 +193,9 @@ class ImgType(Type):
                  name=output.name,
                  description=output.description,
                  pixelWidth=output.width,
-                 append=output.append)
+                 append=output.append,
+                 compression=output.compression,
+                 level=output.level)
 
     def getByIndices(self, d, args):
         # turn the arguments into a list of band wavelengths or names
@@ -366,3 +367,7 @@ class NoneType(Type):
 
     def copy(self, d):
         return d    # this type is immutable
+
+
+# pcot.datum needs the types above when it is imported, so it's imported at the end
+import pcot.datum
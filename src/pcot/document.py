@@ -9,7 +9,6 @@ from pcot import inputs, ui
 from pcot.documentsettings import DocumentSettings
 from pcot.inputs.inp import InputManager
 from pcot.macros import XFormMacro
-from pcot.ui.mainwindow import MainUI
 from pcot.utils import archive
 from pcot.xform import XFormGraph, XForm, XFormType
 
@@ -292,7 +291,7 @@ class Document:
 
         # we don't delete any old tabs here.
         self.deserialise(data, internal=True, closetabs=False)
-        for w in MainUI.getWindowsForDocument(self):
+        for w in ui.mainWindows(self):
             w.replaceDocumentForUndo(self)  # and this must repatch the tabs we didn't delete
         self.showUndoStatus()
 
@@ -336,7 +335,7 @@ class Document:
         self.showUndoStatus()
 
     def showUndoStatus(self):
-        for w in MainUI.getWindowsForDocument(self):
+        for w in ui.mainWindows(self):
             w.showUndoStatus()
 
     def clear(self):
@@ -380,7 +379,8 @@ class Document:
                 f = Favourite(json=s)
                 self.favourites[name] = f
 
-        ui.mainwindow.MainUI.rebuildPalettes(doc=self)
+        if ui.mainWindows(self):
+            ui.mainwindow.MainUI.rebuildPalettes(doc=self)
 
     def importFromConfigArchives(self):
         """Import macros and favourites from all PCOT files listed in the config.
@@ -1,4 +1,4 @@
 """The expression parser used in the expr nodes"""
 
-from .eval import ExpressionEvaluator
+from .eval import ExpressionEvaluator, CompiledExpression
 from .parse import Parameter
@@ -3,13 +3,17 @@
 Anything in here should be specific to PCOT itself, and all data should be as Datum objects.
 """
 import logging
+import threading
+from collections import ChainMap
+from collections.abc import Mapping
 from functools import partial
-from typing import Dict, Callable, Union
+from typing import Dict, Callable, Union, ClassVar, Iterable, List
 
 import pcot.config
 from pcot.config import parserhook
 from pcot.expressions.ops import binop, unop, Operator
-from .parse import Parser, execute
+from .fused import fusableBinops, fusableUnops, fuse
+from .parse import Parser, Variable, execute
 
 # TODO: keep expression guide in help updated
 from ..datum import Datum
@@ -20,10 +24,11 @@ logger = logging.getLogger(__name__)
 
 @parserhook
 def registerBuiltinOperatorSyntax(p):
-    p.registerBinop('+', 10, lambda a, b: binop(Operator.ADD, a, b))
-    p.registerBinop('-', 10, lambda a, b: binop(Operator.SUB, a, b))
-    p.registerBinop('/', 20, lambda a, b: binop(Operator.DIV, a, b))
-    p.registerBinop('*', 20, lambda a, b: binop(Operator.MUL, a, b))
+    # the arithmetic operators can be fused together (see fused.py)
+    p.registerBinop('+', 10, fusableBinops[Operator.ADD])
+    p.registerBinop('-', 10, fusableBinops[Operator.SUB])
+    p.registerBinop('/', 20, fusableBinops[Operator.DIV])
+    p.registerBinop('*', 20, fusableBinops[Operator.MUL])
     p.registerBinop('^', 30, lambda a, b: binop(Operator.POW, a, b))
 
 
@@ -38,13 +43,16 @@ def registerBuiltinOperatorSyntax(p):
     p.registerBinop('>', 60, lambda a, b: binop(Operator.GREATERTHAN, a, b))
 
     # unary ops bind tight
-    p.registerUnop('-', 70, lambda a: unop(Operator.NEG, a))
-    p.registerUnop('!', 80, lambda a: unop(Operator.NOT, a))
+    p.registerUnop('-', 70, fusableUnops[Operator.NEG])
+    p.registerUnop('!', 80, fusableUnops[Operator.NOT])
 
 class ExpressionEvaluator(Parser):
     """The core class for the expression evaluator, based on a generic Parser. The constructor
     is responsible for registering most functions."""
 
+    # if true, trees of arithmetic operators are evaluated together (see fused.py)
+    fuseOps: ClassVar[bool] = True
+
     def __init__(self):
         """Initialise the evaluator, registering functions and operators.
         Caller may add other things (e.g. variables)"""
@@ -59,16 +67,17 @@ class ExpressionEvaluator(Parser):
             #  print(f"Calling   {x}")
             x(self)
 
-    def run(self, s, varDict: Dict[str, Union[Datum, Callable[[], Datum]]] = None, descDict: Dict[str, str] = None):
-        """Parse and evaluate an expression:
+    def optimise(self, seq):
+        """Fuse the arithmetic in newly compiled expressions if fuseOps is set"""
+        return fuse(seq) if self.fuseOps else seq
 
-         - s is the expression
+    def optimiseKey(self):
+        return self.fuseOps
 
-         The following two arguments are not used by the expression node, but by libraries.
-
-         - varDict is an optional dictionary of string to Datum or Callable for assigning variables
-         - descDict is an optional dictionary providing descriptions for the variables in varDict
-         """
+    @staticmethod
+    def makeVars(varDict: Dict[str, Union[Datum, Callable[[], Datum]]] = None,
+                 descDict: Dict[str, str] = None) -> List[Variable]:
+        """Make Variable objects for the variables in varDict (see run())"""
 
         def getvar(d):
             """check that a variable is not ANY (unwired). Also, if it's an image, make a shallow copy (see Issue #56, #65)"""
@@ -80,18 +89,115 @@ class ExpressionEvaluator(Parser):
                     d = Datum(Datum.IMG, d.val.shallowCopy())
             return d
 
+        out = []
         if varDict:
             for k, v in varDict.items():
                 # if there's no description just use the name again
                 desc = descDict[k] if descDict and k in descDict else k
-                # register a lambda to return the value if it isn't callable - it will also try to
+                # use a lambda to return the value if it isn't callable - it will also try to
                 # ensure that a shallow copy is made of images (just as the expr node does). And we have
                 # the late binding problem here too!
                 if callable(v):
-                    self.registerVar(k, desc, v)
+                    out.append(Variable(k, v, desc))
                 else:
-                    self.registerVar(k, desc, partial(lambda xx: getvar(xx), v))
+                    out.append(Variable(k, partial(lambda xx: getvar(xx), v), desc))
+        return out
 
-        self.parse(s)
+    def bindVars(self, varDict: Dict[str, Union[Datum, Callable[[], Datum]]] = None, descDict: Dict[str, str] = None):
+        """Register the variables in varDict (see run()), replacing any existing variables with the same names"""
+        for v in self.makeVars(varDict, descDict):
+            self.registerVar(v.name, v.desc, v.fn)
+
+    def run(self, s, varDict: Dict[str, Union[Datum, Callable[[], Datum]]] = None, descDict: Dict[str, str] = None):
+        """Parse and evaluate an expression:
+
+         - s is the expression
+
+         The following two arguments are not used by the expression node, but by libraries.
+
+         - varDict is an optional dictionary of string to Datum or Callable for assigning variables
+         - descDict is an optional dictionary providing descriptions for the variables in varDict
+
+         The compiled expression is cached, so running the same expression again with the same set of
+         variable names does not parse it again.
+         """
+        self.bindVars(varDict, descDict)
         stack = []
-        return execute(self.output, stack)
+        return execute(self.compile(s), stack)
+
+    def precompile(self, s, varNames: Iterable[str] = ()) -> 'CompiledExpression':
+        """Compile an expression which will be run many times with different values for the variables
+        named in varNames, which must be given values when it is run. These variables belong to the
+        compiled expression: they are looked up in a scope of its own in front of the evaluator's
+        variables, so they don't become visible to other expressions."""
+        scope = ChainMap(_RunVars({k: Variable(k, partial(_unbound, k), k) for k in varNames}), self.varRegistry)
+        # compile against the scope. This doesn't go through compile(), because its cache is for the
+        # evaluator's own variables.
+        shared = self.varRegistry
+        self.varRegistry = scope
+        try:
+            self.parse(s)
+            seq = self.optimise(self.output)
+        finally:
+            self.varRegistry = shared
+        return CompiledExpression(self, s, seq, scope)
+
+
+def _unbound(name):
+    raise XFormException("DATA", f"variable {name} has not been given a value")
+
+
+class _RunVars(Mapping):
+    """The variables belonging to a CompiledExpression. Each thread running the expression sees only the
+    values it was given for that run; outside a run, the variables are bound to placeholders which raise
+    an error."""
+
+    def __init__(self, unbound: Dict[str, Variable]):
+        self.unbound = unbound
+        self.local = threading.local()
+
+    def _current(self) -> Dict[str, Variable]:
+        return getattr(self.local, 'vars', self.unbound)
+
+    def __getitem__(self, k):
+        return self._current()[k]
+
+    def __iter__(self):
+        return iter(self._current())
+
+    def __len__(self):
+        return len(self._current())
+
+
+class CompiledExpression:
+    """An expression compiled by ExpressionEvaluator.precompile(), which can be run repeatedly with
+    different variable values without parsing it again."""
+
+    def __init__(self, evaluator: ExpressionEvaluator, expr: str, seq, scope: ChainMap):
+        self.evaluator = evaluator
+        self.expr = expr
+        self.seq = seq
+        self.scope = scope  # the expression's own variables, in front of the evaluator's
+
+    def run(self, varDict: Dict[str, Union[Datum, Callable[[], Datum]]] = None,
+            descDict: Dict[str, str] = None) -> Datum:
+        """Run the expression with the given variables (as in ExpressionEvaluator.run()). Only variables
+        which were known when the expression was compiled can be used. Variables not given a value in
+        this run are unbound, even if they were given one in an earlier run."""
+        runVars = self.scope.maps[0]
+        unknown = [k for k in (varDict or {}) if k not in runVars.unbound]
+        if unknown:
+            raise XFormException("DATA", f"expression '{self.expr}' has no variable(s) {', '.join(unknown)}")
+        bindings = dict(runVars.unbound)
+        for v in self.evaluator.makeVars(varDict, descDict):
+            bindings[v.name] = v
+        prev = getattr(runVars.local, 'vars', None)
+        runVars.local.vars = bindings
+        try:
+            stack = []
+            return execute(self.seq, stack)
+        finally:
+            if prev is None:
+                del runVars.local.vars
+            else:
+                runVars.local.vars = prev
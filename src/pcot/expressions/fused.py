@@ -0,0 +1,255 @@
+"""Fused evaluation of image arithmetic in expressions.
+
+Normally each operator in an expression like (a-b)/(a+b) is performed separately: each builds Value objects
+from the whole of both images, calculates the nominal values, uncertainties and DQ bits and then splices the
+result into a copy of an image. That's a lot of full-size temporary arrays.
+
+Here we find the parts of a compiled expression (an instruction list from the parser) which are made up of
+the built-in arithmetic operators, and replace each with a single InstFused instruction. When that runs, if
+its operands are images without ROIs (all the same shape) and scalar numbers, the whole tree is evaluated in
+one pass over horizontal strips of the image, calculating the nominal value, uncertainty and DQ for each strip
+before moving on to the next. Otherwise - or for parts of the tree which only involve numbers - it calls the
+operators as usual, so the results are always the same as the unfused expression.
+"""
+from typing import List, Union, Optional
+
+import numpy as np
+
+from pcot import dq
+from pcot.datum import Datum
+from pcot.expressions.ops import binop, unop, Operator, combineSources
+from pcot.expressions.parse import Instruction, InstOp, InstCall, InstCreateVector, InstIndex, \
+    InstNumber, InstIdent, InstString, InstVar, InstFunc
+from pcot.imagecube import ImageCube
+from pcot.sources import MultiBandSource
+from pcot.utils import outofcore
+from pcot.value import Value, add_sub_unc, mul_unc, div_unc
+
+# approximate number of array elements in each strip of the image we process
+STRIP_ELEMENTS = 65536
+
+# The callbacks for the operators which can be fused; these are registered with the parser in eval.py.
+# If an operator is registered with a different callback (e.g. by a plugin) it won't be fused.
+fusableBinops = {op: (lambda a, b, op=op: binop(op, a, b))
+                 for op in (Operator.ADD, Operator.SUB, Operator.MUL, Operator.DIV)}
+fusableUnops = {op: (lambda a, op=op: unop(op, a))
+                for op in (Operator.NEG, Operator.NOT)}
+
+_opsByCallback = {f: op for op, f in list(fusableBinops.items()) + list(fusableUnops.items())}
+
+
+class _Node:
+    """A node in the tree built from an instruction list: the instruction and the nodes which
+    produce the values it takes from the stack."""
+
+    def __init__(self, inst: Instruction, children: List['_Node']):
+        self.inst = inst
+        self.children = children
+
+    def isFusable(self):
+        return isinstance(self.inst, InstOp) and self.inst.callback in _opsByCallback
+
+
+class FusedOp:
+    """An operator in a fused tree; the arguments are either FusedOps or integer indices of the operands
+    taken from the stack"""
+
+    def __init__(self, op: Operator, callback, args: List[Union['FusedOp', int]]):
+        self.op = op
+        self.callback = callback
+        self.args = args
+
+
+class _Strip:
+    """An image-valued part of a fused tree ready to be evaluated a strip at a time. The arguments are
+    _Strips, ImageCubes (the images on the stack) or Values (scalars)."""
+
+    def __init__(self, op: Operator, args, sources, base: Optional[ImageCube]):
+        self.op = op
+        self.args = args
+        self.sources = sources
+        # the image the result would be a copy of if it were calculated in the normal way, or None if
+        # it would be a new image
+        self.base = base
+
+    def evaluate(self, sl):
+        """Calculate the nominal, uncertainty and DQ for a slice of rows of the result"""
+        if self.op == Operator.NEG or self.op == Operator.NOT:
+            n, u, d = _evaluate(self.args[0], sl)
+            return (-n if self.op == Operator.NEG else 1 - n), u, d
+
+        an, au, ad = _evaluate(self.args[0], sl)
+        bn, bu, bd = _evaluate(self.args[1], sl)
+        if self.op == Operator.ADD:
+            return an + bn, add_sub_unc(au, bu), ad | bd
+        elif self.op == Operator.SUB:
+            return an - bn, add_sub_unc(au, bu), ad | bd
+        elif self.op == Operator.MUL:
+            return an * bn, mul_unc(an, au, bn, bu), ad | bd
+        else:
+            # division, with the same handling of division by zero as Value
+            zero = bn == 0
+            with np.errstate(divide='ignore', invalid='ignore', over='ignore'):
+                n = np.where(zero, 0, an / bn)
+                u = np.where(zero, 0, div_unc(an, au, bn, bu))
+            extra = np.where(zero, dq.DIVZERO, dq.NONE) | np.where(zero & (an == 0), dq.UNDEF, dq.NONE)
+            return n, u, ad | bd | extra.astype(np.uint16)
+
+
+def _evaluate(x, sl):
+    if isinstance(x, ImageCube):
+        return x.img[sl], x.peekUncertainty()[sl], x.peekDQ()[sl]
+    elif isinstance(x, Value):
+        return x.n, x.u, x.dq
+    return x.evaluate(sl)
+
+
+class InstFused(Instruction):
+    """A VM instruction which performs a tree of arithmetic operations at once. It takes the operands
+    (the results of the non-arithmetic parts of the expression) from the stack."""
+
+    def __init__(self, tree: FusedOp, argcount: int):
+        self.tree = tree
+        self.argcount = argcount
+
+    def __str__(self):
+        return "FUSED argcount: {}".format(self.argcount)
+
+    def exec(self, stack):
+        args = stack[-self.argcount:]
+        del stack[-self.argcount:]
+        if self._canFuse(args):
+            stack.append(self._fused(args))
+        else:
+            stack.append(self._unfused(self.tree, args))
+
+    @staticmethod
+    def _canFuse(args: List[Datum]):
+        shape = None
+        for d in args:
+            if d is None:
+                return False
+            if d.tp == Datum.IMG:
+                if d.val is None or d.val.hasROI():
+                    return False
+                if shape is not None and d.val.img.shape != shape:
+                    return False
+                shape = d.val.img.shape
+            elif d.tp != Datum.NUMBER or not d.val.isscalar():
+                return False
+        return shape is not None
+
+    def _unfused(self, node, args):
+        """Perform the operators in the normal way"""
+        if isinstance(node, int):
+            return args[node]
+        return node.callback(*[self._unfused(x, args) for x in node.args])
+
+    def _plan(self, node, args):
+        """Turn the tree into _Strips, calculating the parts which only involve numbers (which will
+        give Datums) in the normal way."""
+        if isinstance(node, int):
+            d = args[node]
+            return d.val if d.tp == Datum.IMG else d
+        kids = [self._plan(x, args) for x in node.args]
+        if all(isinstance(k, Datum) for k in kids):
+            return node.callback(*kids)
+
+        def sources(k):
+            return k.sources if isinstance(k, (ImageCube, _Strip)) else None
+
+        def base(k):
+            return k if isinstance(k, ImageCube) else k.base
+
+        # work out the sources and the image we would copy, as the operator functions in ops.py would.
+        if len(kids) == 1:
+            srcs, img = sources(kids[0]), None
+        else:
+            a, b = kids
+            if isinstance(a, Datum):
+                srcs, img = combineSources(sources(b), a.sources), base(b)
+            elif isinstance(b, Datum):
+                srcs, img = combineSources(sources(a), b.sources), base(a)
+            else:
+                srcs, img = MultiBandSource.createBandwiseUnion([sources(a), sources(b)]), base(a)
+        return _Strip(node.op, [k.val if isinstance(k, Datum) else k for k in kids], srcs, img)
+
+    def _fused(self, args):
+        plan = self._plan(self.tree, args)
+        if isinstance(plan, ImageCube):
+            # can't happen with a tree of operators, but just in case
+            return Datum(Datum.IMG, plan)
+
+        shape = next(d.val.img.shape for d in args if d.tp == Datum.IMG)
+        n = outofcore.allocate(shape, np.float32)
+        u = outofcore.allocate(shape, np.float32)
+        d = outofcore.allocate(shape, np.uint16)
+        rows = max(1, STRIP_ELEMENTS // (n.size // shape[0]))
+        for y in range(0, shape[0], rows):
+            sl = slice(y, y + rows)
+            n[sl], u[sl], d[sl] = plan.evaluate(sl)
+
+        if plan.base is None:
+            img = ImageCube(n, sources=plan.sources, uncertainty=u, dq=d)
+        else:
+            img = plan.base._copybase(n, u, d)
+            img.sources = plan.sources
+        return Datum(Datum.IMG, img)
+
+
+def _popCount(inst: Instruction) -> Optional[int]:
+    """How many values does an instruction take from the stack? None if we don't know."""
+    if isinstance(inst, InstOp):
+        return 1 if inst.prefix else 2
+    elif isinstance(inst, (InstCall, InstIndex)):
+        return inst.argcount + 1
+    elif isinstance(inst, InstCreateVector):
+        return inst.argcount
+    elif isinstance(inst, (InstNumber, InstIdent, InstString, InstVar, InstFunc)):
+        return 0
+    return None
+
+
+def fuse(seq: List[Instruction]) -> List[Instruction]:
+    """Given an instruction list, return a list in which each tree of fusable operators has been
+    replaced by the instructions for its operands followed by an InstFused. If we can't make sense of
+    the list, it is returned unchanged (and will presumably fail when it is executed)."""
+
+    # build the tree (or trees - there should only be one) from the instruction list
+    stack = []
+    for inst in seq:
+        n = _popCount(inst)
+        if n is None or n > len(stack):
+            return seq
+        children = stack[len(stack) - n:]
+        del stack[len(stack) - n:]
+        stack.append(_Node(inst, children))
+
+    out = []
+
+    def build(node: _Node, operands: List[_Node]):
+        """build a FusedOp from a fusable node, adding the nodes for its operands to a list"""
+        args = []
+        for c in node.children:
+            if c.isFusable():
+                args.append(build(c, operands))
+            else:
+                args.append(len(operands))
+                operands.append(c)
+        return FusedOp(_opsByCallback[node.inst.callback], node.inst.callback, args)
+
+    def emit(node: _Node):
+        if node.isFusable():
+            operands = []
+            tree = build(node, operands)
+            for c in operands:
+                emit(c)
+            out.append(InstFused(tree, len(operands)))
+        else:
+            for c in node.children:
+                emit(c)
+            out.append(node.inst)
+
+    for node in stack:
+        emit(node)
+    return out
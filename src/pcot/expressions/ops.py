@@ -10,6 +10,7 @@ from pcot.datumtypes import Type
 from pcot.imagecube import ImageCube
 from pcot.rois import BadOpException, ROI
 from pcot.sources import MultiBandSource, SourceSet, nullSourceSet, SourcesObtainable
+from pcot.utils import image
 from pcot.value import Value
 
 
@@ -125,13 +126,17 @@ def imageUnop(d: Datum, f: Callable[[np.ndarray], np.ndarray]) -> Datum:
         subimg = img.subimage()
         masked = subimg.masked()
         ressubimg = f(masked)
-        rimg = img.modifyWithSub(subimg, ressubimg).img
+        # splice the result into a copy of the image, keeping (and sharing) the original uncertainty and DQ.
+        cp = img.copyOnWrite().modifyWithSub(subimg, ressubimg, uncertainty=subimg.peekUncertainty(),
+                                             dqv=subimg.peekDQ(), inPlace=True)
+        rimg, uncs, dqs = cp.img, cp.peekUncertainty(), cp.peekDQ()
     else:
         rimg = f(img.img)
+        # we copy the uncertainty and DQ from the original image (constant planes can just be shared).
+        uncs, dqs = [a if image.isConstantPlane(a) else np.copy(a) for a in (img.peekUncertainty(), img.peekDQ())]
 
-    # originally this built a new source set. Don't know why. We do, however, copy the uncertainty
-    # and DQ from the original image.
-    out = ImageCube(rimg, sources=img.sources, uncertainty=np.copy(img.uncertainty), dq=np.copy(img.dq))
+    # originally this built a new source set. Don't know why.
+    out = ImageCube(rimg, sources=img.sources, uncertainty=uncs, dq=dqs)
     out.rois = img.rois.copy()
     return Datum(Datum.IMG, out)
 
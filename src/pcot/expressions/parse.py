@@ -6,12 +6,13 @@ handle type checking. Help texts are also generated.
 
 import numbers
 import logging
+from collections import OrderedDict
 
 from io import BytesIO
 from tokenize import tokenize, TokenInfo, NUMBER, NAME, OP, ENCODING, ENDMARKER, NEWLINE, ERRORTOKEN, PERCENT, DOT, \
     STRING
 
-from typing import List, Any, Optional, Callable, Dict, Tuple, Union
+from typing import List, Any, Optional, Callable, Dict, Tuple, Union, ClassVar
 
 from pcot.datum import Datum
 from pcot.datumtypes import Type, AnyType
@@ -274,18 +275,21 @@ class InstString(Instruction):
 
 class InstVar(Instruction):
     """A VM instruction for stacking a variable.
-    This encapsulates a function which should be called by the VM to get the variable's value."""
-    var: Variable
+    The variable is looked up in the registry when the instruction is executed, and its function
+    called to get the value. This means that a compiled expression can be run again after the variable
+    has been registered with a different function (see Parser.compile)."""
     name: str
+    registry: Dict[str, Variable]
 
-    def __init__(self, var):
-        self.var = var
+    def __init__(self, name: str, registry: Dict[str, Variable]):
+        self.name = name
+        self.registry = registry
 
     def exec(self, stack: Stack):
-        stack.append(self.var.fn())
+        stack.append(self.registry[self.name].fn())
 
     def __str__(self):
-        return "VAR {}".format(self.var.name)
+        return "VAR {}".format(self.name)
 
 
 class InstFunc(Instruction):
@@ -495,12 +499,22 @@ class Parser:
     ## if true, naked identifiers are stacked as strings.
     nakedIdents: bool
 
+    ## incremented whenever a change to the registries could change how an expression compiles
+    registryVersion: int
+
+    ## compiled instruction lists keyed by expression and registry version, most recently used last
+    compiled: OrderedDict
+
+    ## maximum number of compiled expressions kept by each parser
+    compileCacheSize: ClassVar[int] = 256
+
     ## binops are names (e.g. '+') mapped to precedence and two-arg fn which return a value
     binopRegistry: Dict[str, Tuple[int, Optional[Callable[[Any, Any], Any]]]]
 
     def registerBinop(self, name: str, precedence: int, fn: Callable[[Any, Any], Any]):
         """Register a binary operation"""
         self.binopRegistry[name] = (precedence, fn)
+        self.registryVersion += 1
 
     ## unary ops are names mapped to precedence and single arg function which returns a value
     unopRegistry: Dict[str, Tuple[int, Optional[Callable[[Any], Any]]]]
@@ -508,13 +522,17 @@ class Parser:
     def registerUnop(self, name: str, precedence: int, fn: Callable[[Any], Any]):
         """Register a unary operation"""
         self.unopRegistry[name] = (precedence, fn)
+        self.registryVersion += 1
 
     ## vars are names mapped to argless fns (wrapped in a class) which
     # return their value
     varRegistry: Dict[str, Variable]
 
     def registerVar(self, name: str, description: str, fn: Callable[[], Any]):
-        """register a variable with a parameterless function to fetch it"""
+        """register a variable with a parameterless function to fetch it. Variables are looked up when the
+        expression is run, so re-registering an existing variable doesn't require expressions to be recompiled."""
+        if name not in self.varRegistry:
+            self.registryVersion += 1
         self.varRegistry[name] = Variable(name, fn, description)
 
     ## other functions are names mapped to functions
@@ -539,6 +557,7 @@ class Parser:
         Also takes a description and two lists of argument types: mandatory and optional."""
         # print(f"Registered func {name}")
         self.funcRegistry[name] = Function(name, fn, description, mandatoryParams, optParams, varargs)
+        self.registryVersion += 1
 
     # property dict - keys are (name,type), values are (desc,func) where the func
     # takes Datum and gives Datum
@@ -548,6 +567,7 @@ class Parser:
     def registerProperty(self, name: str, tp: Type, desc: str, func: Callable[[Datum], Datum]):
         """add a property (e.g. the 'w' in 'a.w'), given name, input type, description and function"""
         self.properties[(name, tp)] = (desc, func)
+        self.registryVersion += 1
 
     def getProperty(self, a: Datum, b: Datum):
         """Get the value of a property - requires two Datum arguments, the first is the object and the second is
@@ -627,6 +647,8 @@ class Parser:
         self.funcRegistry = dict()
         self.properties = dict()
         self.toks = []
+        self.registryVersion = 0
+        self.compiled = OrderedDict()
 
         self.nakedIdents = nakedIdents
 
@@ -638,6 +660,30 @@ class Parser:
         # getProperty is built into the parser, but can be bound to any operator.
         self.registerBinop('.', 80, lambda a, b: self.getProperty(a, b))
 
+    def compile(self, s: str) -> List[Instruction]:
+        """Return the instruction list for an expression, parsing it only if it hasn't been parsed already
+        with the same registries and optimisation settings (see optimiseKey()). The list is passed through
+        optimise() before it is stored."""
+        key = (s, self.registryVersion, self.optimiseKey())
+        if key in self.compiled:
+            self.compiled.move_to_end(key)
+            return self.compiled[key]
+        self.parse(s)
+        seq = self.optimise(self.output)
+        self.compiled[key] = seq
+        while len(self.compiled) > self.compileCacheSize:
+            self.compiled.popitem(last=False)
+        return seq
+
+    def optimise(self, seq: List[Instruction]) -> List[Instruction]:
+        """Transform a newly parsed instruction list before it is cached by compile(); does nothing by default"""
+        return seq
+
+    def optimiseKey(self):
+        """Return the settings which change what optimise() does, so that compile() doesn't return lists
+        optimised with different settings; there are none by default"""
+        return None
+
     def parse(self, s: str):
         """Parsing function - uses the shunting algorithm.
         See also
@@ -709,7 +755,7 @@ class Parser:
                     wantOperand = False
                 elif t.type == NAME:
                     if t.string in self.varRegistry:
-                        self.out(InstVar(self.varRegistry[t.string]))
+                        self.out(InstVar(t.string, self.varRegistry))
                     elif t.string in self.funcRegistry:
                         fn = self.funcRegistry[t.string]
                         self.out(InstFunc(t.string, fn))
@@ -9,25 +9,26 @@ import logging
 import os.path
 from collections.abc import Iterable
 from pathlib import Path
-from typing import List, Optional, Tuple, Sequence, Union
+from typing import List, Optional, Tuple, Sequence, Union, TYPE_CHECKING
 
 import cv2 as cv
 import numpy as np
-from PySide2.QtGui import QPainter
 
 import pcot
 from pcot import dq, ui
 from pcot.documentsettings import DocumentSettings
 from pcot.rois import ROI, ROIBoundsException
 from pcot.sources import MultiBandSource, SourcesObtainable, Source
-from pcot.utils import annotations, debayering
-from pcot.utils.annotations import annotFont
+from pcot.utils import annotations, debayering, outofcore
 from pcot.utils import image
 from pcot.utils.archive import FileArchive,ArchiveType
 from pcot.utils.geom import Rect
 import pcot.dq
 from pcot.value import Value
 
+if TYPE_CHECKING:
+    from PySide2.QtGui import QPainter
+
 logger = logging.getLogger(__name__)
 
 # these are files we can load directly - not PARC or Raw. They are used by the ImageCube.load() method,
@@ -44,7 +45,9 @@ class SubImageCube:
     * a boolean mask the same size as the BB, True for pixels contained in the ROIs and which
       should be manipulated.
 
-    Remember that these will be slices into the original imagecube.
+    Remember that these will be slices into the original imagecube. The uncertainty and DQ slices are
+    taken when they are used, so that constant planes in the image (see ImageCube) are only turned into
+    real arrays if something might write to them.
     """
 
     def __init__(self, img, imgToUse=None, roi: Optional[ROI] = None, clip=True):
@@ -96,8 +99,7 @@ class SubImageCube:
 
                 # create views into the array
                 self.img = img.img[y:y + h, x:x + w]
-                self.uncertainty = img.uncertainty[y:y + h, x:x + w]
-                self.dq = img.dq[y:y + h, x:x + w]
+                self._setSource(img, (slice(y, y + h), slice(x, x + w)))
 
                 if self.img.shape[:2] != self.mask.shape:
                     raise Exception("Internal error: shape still incorrect after clip")
@@ -107,34 +109,62 @@ class SubImageCube:
             # WARNING - these were originally copies, but as noted above we actually make slices into
             # the original array so we might as well do that here. Careful not to modify directly.
             self.img = img.img
-            self.dq = img.dq
-            self.uncertainty = img.uncertainty
+            self._setSource(img, (slice(None), slice(None)))
             self.bb = Rect(0, 0, img.w, img.h)  # whole image
             self.mask = np.full((img.h, img.w), True)  # full mask
 
+    def _setSource(self, img, region):
+        """Set the image and region the uncertainty and DQ come from"""
+        self._source = img
+        self._region = region
+        self._bands = None
+
+    def _plane(self, a):
+        """Get our part of an uncertainty or DQ array from the source image"""
+        a = a[self._region]
+        return a if self._bands is None else a[:, :, self._bands]
+
+    @property
+    def uncertainty(self) -> np.ndarray:
+        """The uncertainty data - a view into the image's uncertainty (unless bands have been selected)"""
+        return self._plane(self._source.uncertainty)
+
+    @property
+    def dq(self) -> np.ndarray:
+        """The DQ data - a view into the image's DQ (unless bands have been selected)"""
+        return self._plane(self._source.dq)
+
+    def peekUncertainty(self) -> np.ndarray:
+        """The uncertainty data, which may be a read-only constant plane (see ImageCube.peekUncertainty)"""
+        return self._plane(self._source.peekUncertainty())
+
+    def peekDQ(self) -> np.ndarray:
+        """The DQ data, which may be a read-only constant plane (see ImageCube.peekDQ)"""
+        return self._plane(self._source.peekDQ())
+
     def selectBands(self, bands:List[int]):
         """
         Make this subimage only have certain bands in it
         """
         self.img = self.img[:,:,bands]
-        self.dq = self.dq[:,:,bands]
-        self.uncertainty = self.uncertainty[:,:,bands]
+        self._bands = bands
 
-    def fullmask(self, maskBadPixels=False):
+    def fullmask(self, maskBadPixels=False, rows: slice = slice(None)):
         """the main mask is just a single channel - this will generate a mask
         of the same number of channels, so an x,y image will make an x,y mask
          and an x,y,n image will make an x,y,n mask.
          It will also optionally remove BAD bits from the mask, as indicated by the DQ array.
+         If rows is given, only the mask for those rows of the subimage is generated.
         """
 
         # so at this point the mask is (x,y).
+        mask = self.mask[rows]
 
-        if len(self.img.shape) == 2:
-            mask = self.mask  # the existing mask is fine
-        else:
-            h, w, chans = self.img.shape
+        if len(self.img.shape) == 3:
+            h, w = mask.shape
+            chans = self.img.shape[2]
             # flatten and repeat each element for each channel
-            x = np.repeat(np.ravel(self.mask), chans)
+            x = np.repeat(np.ravel(mask), chans)
             # put into a h,w,chans array
             mask = np.reshape(x, (h, w, chans))
 
@@ -143,7 +173,7 @@ class SubImageCube:
 
         if maskBadPixels:
             # make another mask out of the DQ bits, selecting any pixels with "bad" bits
-            badmask = (self.dq & pcot.dq.BAD).astype(bool)
+            badmask = (self.peekDQ()[rows] & pcot.dq.BAD).astype(bool)
             # Negate that mask - it shows the bad pixels but we only want it to be
             # true where the good pixels are - then AND it into the main mask
             return mask & ~badmask
@@ -153,16 +183,17 @@ class SubImageCube:
         """Return all the data masked by the ROI. This is a tuple of three masked arrays:
         the means (i.e. the image), the uncertainty and the DQ. The mask is the same for all three.
         If noDQ is set, only means and uncertainty are returned.
+        This is for reading the data: the uncertainty and DQ may be read-only constant planes.
         """
         mask = self.fullmask(maskBadPixels)
         if noDQ:
             return (np.ma.masked_array(self.img, mask=~mask),
-                    np.ma.masked_array(self.uncertainty, mask=~mask)
+                    np.ma.masked_array(self.peekUncertainty(), mask=~mask)
                     )
         else:
             return (np.ma.masked_array(self.img, mask=~mask),
-                    np.ma.masked_array(self.uncertainty, mask=~mask),
-                    np.ma.masked_array(self.dq, mask=~mask)
+                    np.ma.masked_array(self.peekUncertainty(), mask=~mask),
+                    np.ma.masked_array(self.peekDQ(), mask=~mask)
                     )
 
     def masked(self, maskBadPixels=False):
@@ -182,8 +213,8 @@ class SubImageCube:
         Copies the sources list from that image."""
         x, y, w, h = self.bb
         return ImageCube(img2.img[y:y + h, x:x + w], img2.mapping, img2.sources,
-                         dq=img2.dq[y:y + h, x:x + w],
-                         uncertainty=img2.uncertainty[y:y + h, x:x + w]
+                         dq=img2.peekDQ()[y:y + h, x:x + w],
+                         uncertainty=img2.peekUncertainty()[y:y + h, x:x + w]
                          )
 
     def sameROI(self, other):
@@ -221,8 +252,7 @@ class SubImageCube:
 
         x, y, w, h = self.bb  # this works even though self.bb is Rect
         self.img = img.img[y:y + h, x:x + w]
-        self.dq = img.dq[y:y + h, x:x + w]
-        self.uncertainty = img.uncertainty[y:y + h, x:x + w]
+        self._setSource(img, (slice(y, y + h), slice(x, x + w)))
 
 
 class ChannelMapping:
@@ -381,10 +411,11 @@ class ImageCube(SourcesObtainable):
     An RGB mapping can be provided, saying how the image should be represented in RGB (via the rgb() method)
     There is also a MultiBandSource describing the source sets associated with each channel.
     """
-    # the numpy arrays containing the image data, the uncertainty data and the data quality bit data
+    # the numpy arrays containing the image data, the uncertainty data and the data quality bit data.
+    # The latter two are accessed through properties (see below).
     img: np.ndarray  # H x W x Depth, float32
-    uncertainty: np.ndarray  # H x W x Depth, float32
-    dq: np.ndarray  # H x W x Depth, uint16
+    _uncertainty: np.ndarray  # H x W x Depth, float32
+    _dq: np.ndarray  # H x W x Depth, uint16
 
     # the regions of interest - these are also annotations! They are in a separate list
     # so they can be passed through or removed separately.
@@ -429,6 +460,11 @@ class ImageCube(SourcesObtainable):
                             If None, a zero array is created - but if a zero array is used (or created) for
                             uncertainty, the "no uncertainty data" bit is set on all pixels.
 
+        The arrays created when uncertainty or DQ are not given are read-only constant planes
+        (see utils.image.constantPlane) which take no memory. They are replaced with real arrays
+        when the uncertainty and dq properties are used, because the caller may write to them.
+        Code which only reads them can use peekUncertainty() and peekDQ() instead.
+
         """
 
         def cvt1channel(x):
@@ -489,7 +525,7 @@ class ImageCube(SourcesObtainable):
 
         # uncertainty data
         if uncertainty is None:
-            uncertainty = np.zeros(img.shape, dtype=np.float32)
+            uncertainty = image.constantPlane(img.shape, np.float32, 0)
             dqOnAllPixels |= pcot.dq.NOUNCERTAINTY
         uncertainty = cvt1channel(uncertainty)
         if uncertainty.dtype != np.float32:
@@ -501,14 +537,21 @@ class ImageCube(SourcesObtainable):
 
         # DQ data
         if dq is None:
-            dq = np.zeros(img.shape, dtype=np.uint16)
+            dq = image.constantPlane(img.shape, np.uint16, dqOnAllPixels)
+            dqOnAllPixels = 0
         if dq.dtype != np.uint16:
             raise Exception("DQ data is not 16-bit unsigned integers")
         dq = cvt1channel(dq)
         if dq.shape != img.shape:
             raise Exception("DQ data is not same shape as image data")
 
-        dq |= dqOnAllPixels
+        if dqOnAllPixels:
+            if image.isConstantPlane(dq):
+                dq = image.constantPlane(img.shape, np.uint16, dq.flat[0] | dqOnAllPixels)
+            elif not dq.flags.writeable:
+                dq = dq | dqOnAllPixels     # shared with another image (see copyOnWrite())
+            else:
+                dq |= dqOnAllPixels
         self.dq = dq
 
     def setMapping(self, mapping: ChannelMapping):
@@ -582,8 +625,8 @@ class ImageCube(SourcesObtainable):
         Quite a bit of code duplication here from rgb() but it can't really be helped."""
 
         if self.channels == 1:
-            unc = np.dstack([self.uncertainty, self.uncertainty, self.uncertainty])
-            dq = np.dstack([self.dq, self.dq, self.dq])
+            unc = np.dstack([self.peekUncertainty(), self.peekUncertainty(), self.peekUncertainty()])
+            dq = np.dstack([self.peekDQ(), self.peekDQ(), self.peekDQ()])
             img = np.dstack([self.img, self.img, self.img])
         else:
             if mapping is None:
@@ -596,14 +639,14 @@ class ImageCube(SourcesObtainable):
                 self.img[:, :, mapping.blue]]
             )
             dq = np.dstack([
-                self.dq[:, :, mapping.red],
-                self.dq[:, :, mapping.green],
-                self.dq[:, :, mapping.blue]]
+                self.peekDQ()[:, :, mapping.red],
+                self.peekDQ()[:, :, mapping.green],
+                self.peekDQ()[:, :, mapping.blue]]
             )
             unc = np.dstack([
-                self.uncertainty[:, :, mapping.red],
-                self.uncertainty[:, :, mapping.green],
-                self.uncertainty[:, :, mapping.blue]]
+                self.peekUncertainty()[:, :, mapping.red],
+                self.peekUncertainty()[:, :, mapping.green],
+                self.peekUncertainty()[:, :, mapping.blue]]
             )
         # The RGB mapping here should be just [0,1,2], since this output is the RGB representation.
         return ImageCube(img, ChannelMapping(0, 1, 2), self.rgbSources(mapping),
@@ -686,8 +729,8 @@ class ImageCube(SourcesObtainable):
                       self.mapping,
                       self.sources.copy(),
                       defaultMapping=self.defaultMapping,
-                      uncertainty=self.uncertainty,
-                      dq=self.dq)
+                      uncertainty=self._uncertainty,
+                      dq=self._dq)
         i.rois = self.rois.copy()
         if copyAnnotations:
             i.annotations = self.annotations.copy()
@@ -718,10 +761,44 @@ class ImageCube(SourcesObtainable):
 
 
 
+    @property
+    def uncertainty(self) -> np.ndarray:
+        """The uncertainty array. If this is a constant plane or shared with another image (see copyOnWrite()),
+        it is replaced by a real array of its own first."""
+        if not self._uncertainty.flags.writeable:
+            self._uncertainty = outofcore.copy(self._uncertainty)
+        return self._uncertainty
+
+    @uncertainty.setter
+    def uncertainty(self, a: np.ndarray):
+        self._uncertainty = a
+
+    @property
+    def dq(self) -> np.ndarray:
+        """The DQ array. If this is a constant plane or shared with another image (see copyOnWrite()),
+        it is replaced by a real array of its own first."""
+        if not self._dq.flags.writeable:
+            self._dq = outofcore.copy(self._dq)
+        return self._dq
+
+    @dq.setter
+    def dq(self, a: np.ndarray):
+        self._dq = a
+
+    def peekUncertainty(self) -> np.ndarray:
+        """Get the uncertainty array for reading - it may be a read-only constant plane."""
+        return self._uncertainty
+
+    def peekDQ(self) -> np.ndarray:
+        """Get the DQ array for reading - it may be a read-only constant plane."""
+        return self._dq
+
     def copy(self, keepMapping=False, copyAnnotations=True):
         """copy an image. If keepMapping is false, the image mapping will also be a copy. If true, the mapping
         is a reference to the same mapping as in the original image.
 
+        Constant uncertainty and DQ planes are shared rather than copied, because they are read-only.
+
         If you notice that you're changing the RGB mappings in a canvas and the image isn't changing,
         it might be because of this.
 
@@ -730,16 +807,35 @@ class ImageCube(SourcesObtainable):
         a copy of the image! If you want to make a shallow copy of the image, use shallowCopy.
         """
 
-        return self._copybase(self.img.copy(), self.uncertainty.copy(), self.dq.copy(),
+        def copyPlane(a):
+            return a if image.isConstantPlane(a) else outofcore.copy(a)
+
+        return self._copybase(outofcore.copy(self.img), copyPlane(self._uncertainty), copyPlane(self._dq),
                               keepMapping = keepMapping, copyAnnotations = copyAnnotations)
 
+    def copyOnWrite(self, keepMapping=False, copyAnnotations=True):
+        """Like copy(), but the uncertainty and DQ of the copy are read-only views of this image's arrays.
+        They are only copied if they are fetched for writing through the uncertainty and dq properties, so
+        a copy which only changes its nominal data (or nothing outside a region, see modifyWithSub()) shares
+        them. This image's arrays must not be changed afterwards."""
+
+        def sharePlane(a):
+            if not a.flags.writeable:
+                return a    # constant planes and views which are already shared
+            v = a.view()
+            v.flags.writeable = False
+            return v
+
+        return self._copybase(outofcore.copy(self.img), sharePlane(self._uncertainty), sharePlane(self._dq),
+                              keepMapping=keepMapping, copyAnnotations=copyAnnotations)
+
     def zeros_like(self, keepMapping=False, copyAnnotations=True):
         """
         Rather like copy, but instead creates a zero image of the same dimensions.
         """
-        return self._copybase(np.zeros_like(self.img.copy()),
-                              np.zeros_like(self.uncertainty.copy()),
-                              np.zeros_like(self.dq.copy()),
+        return self._copybase(outofcore.zeros(self.img.shape, self.img.dtype),
+                              outofcore.zeros(self._uncertainty.shape, self._uncertainty.dtype),
+                              outofcore.zeros(self._dq.shape, self._dq.dtype),
                               keepMapping = keepMapping, copyAnnotations = copyAnnotations)
 
 
@@ -749,7 +845,7 @@ class ImageCube(SourcesObtainable):
     def modifyWithSub(self, subimage: SubImageCube, newimg: np.ndarray,
                       sources=None, keepMapping=False,
                       dqv=None, dqOR=np.uint16(0), uncertainty=None,
-                      dontWriteBadPixels=False
+                      dontWriteBadPixels=False, inPlace=False
                       ) -> 'ImageCube':
         """return a copy of the image, with the given image spliced in at the subimage's coordinates and masked
         according to the subimage. keepMapping will ensure that the new image has the same mapping as the old.
@@ -760,38 +856,56 @@ class ImageCube(SourcesObtainable):
         in the DQ bits.
 
         DQ can either be set by passing in dqv (value or array), or a value or array can be provided to OR in.
+
+        The splice is done in strips of rows if the image is out-of-core (see utils/outofcore.py).
+
+        If inPlace is true, the image consumes itself: the splice is done into this image's own arrays and the
+        result shares them, so only the region covered by the subimage is written and nothing is copied.
+        Only do this if nothing else can see the image's data - typically because the caller has just
+        created or copied it. Uncertainty and DQ which are read-only (constant planes, or shared by
+        copyOnWrite()) are left shared if the splice wouldn't change them, and copied otherwise.
         """
 
-        i = self.copy(keepMapping)
-        x, y, w, h = subimage.bb
-        # we only want to paste into the bits in the image that are covered
-        # by the mask - and we want the full mask
-        mask = subimage.fullmask(maskBadPixels=dontWriteBadPixels)
-
-        # if the dq we're going to OR in isn't a scalar, make it fit the mask.
-        if not np.isscalar(dqOR):
-            dqOR = dqOR[mask]
-
-        if newimg is not None:
-            # copy the new image bits in
-            i.img[y:y + h, x:x + w][mask] = newimg[mask]
-        if uncertainty is not None:
-            # if uncertainty is provided copy that in
-            i.uncertainty[y:y + h, x:x + w][mask] = uncertainty[mask]
-        else:
-            # if no uncertainty data is provided, set the uncertainty to zero and also OR in a NOUNCERTAINTY flag
-            i.uncertainty[y:y + h, x:x + w][mask] = 0
-            dqOR |= dq.NOUNCERTAINTY
-
-        if dqv is not None:
-            # DQ data is provided - make sure it fits the mask and then combine with the dqOR bits
-            # to generate the new DQ data
-            if not np.isscalar(dqv):
-                dqv = dqv[mask]
-            i.dq[y:y + h, x:x + w][mask] = dqv | dqOR
+        if inPlace:
+            i = self._copybase(self.img, self._uncertainty, self._dq, keepMapping=keepMapping)
         else:
-            # No DQ data is provided, just OR in the dqOR bits
-            i.dq[y:y + h, x:x + w][mask] |= dqOR
+            i = self.copy(keepMapping)
+        x, y, w, h = subimage.bb
+
+        if uncertainty is None:
+            # if no uncertainty data is provided, we set the uncertainty to zero and also OR in a NOUNCERTAINTY flag
+            dqOR = dqOR | dq.NOUNCERTAINTY
+
+        def unchanged(plane, ys, mask, v):
+            # would writing v into the masked region of a read-only plane leave it as it is?
+            return not plane.flags.writeable and np.all(plane[ys, x:x + w][mask] == v)
+
+        for rows in outofcore.strips(i.img[y:y + h, x:x + w]):
+            # we only want to paste into the bits in the image that are covered
+            # by the mask - and we want the full mask
+            mask = subimage.fullmask(maskBadPixels=dontWriteBadPixels, rows=rows)
+            ys = slice(y + rows.start, y + rows.stop)
+
+            if newimg is not None:
+                # copy the new image bits in
+                i.img[ys, x:x + w][mask] = newimg[rows][mask]
+            # copy the uncertainty in if provided, or zero it
+            u = 0 if uncertainty is None else uncertainty[rows][mask]
+            if not unchanged(i.peekUncertainty(), ys, mask, u):
+                i.uncertainty[ys, x:x + w][mask] = u
+
+            # if the dq we're going to OR in isn't a scalar, make it fit the mask.
+            o = dqOR if np.isscalar(dqOR) else dqOR[rows][mask]
+            if dqv is not None:
+                # DQ data is provided - make sure it fits the mask and then combine with the dqOR bits
+                # to generate the new DQ data
+                v = dqv if np.isscalar(dqv) else dqv[rows][mask]
+                v = v | o
+            else:
+                # No DQ data is provided, just OR in the dqOR bits
+                v = i.peekDQ()[ys, x:x + w][mask] | o
+            if not unchanged(i.peekDQ(), ys, mask, v):
+                i.dq[ys, x:x + w][mask] = v
 
         # can replace sources if required
         if sources is not None:
@@ -825,12 +939,12 @@ class ImageCube(SourcesObtainable):
             if self.channels == 1:
                 # sometimes I really regret not making single band images (h,w,1) shape. This is one of those times.
                 chans.append(self.img)
-                dqs.append(self.dq)
-                uncertainties.append(self.uncertainty)
+                dqs.append(self.peekDQ())
+                uncertainties.append(self.peekUncertainty())
             else:
                 chans.append(self.img[:, :, i])
-                dqs.append(self.dq[:, :, i])
-                uncertainties.append(self.uncertainty[:, :, i])
+                dqs.append(self.peekDQ()[:, :, i])
+                uncertainties.append(self.peekUncertainty()[:, :, i])
 
         if len(lstOfChannels) == 1:
             # single channel case
@@ -849,8 +963,8 @@ class ImageCube(SourcesObtainable):
     def cropROI(self):
         subimg = self.subimage()
         img = ImageCube(subimg.img,
-                        uncertainty=subimg.uncertainty,
-                        dq=subimg.dq,
+                        uncertainty=subimg.peekUncertainty(),
+                        dq=subimg.peekDQ(),
                         rgbMapping=self.mapping, defaultMapping=self.defaultMapping, sources=self.sources)
         img.rois = [roi.rebase(subimg.bb.x, subimg.bb.y) for roi in self.rois]
         #        img.rois = [ROIPainted(subimg.mask, "crop")]
@@ -912,8 +1026,8 @@ class ImageCube(SourcesObtainable):
             'mapping': self.mapping.serialise(),
             'defmapping': self.defaultMapping.serialise() if self.defaultMapping else None,
             'sources': self.sources.serialise(),
-            'dq': encodeArrayValue(self.dq),
-            'uncertainty': encodeArrayValue(self.uncertainty)
+            'dq': encodeArrayValue(self.peekDQ()),
+            'uncertainty': encodeArrayValue(self.peekUncertainty())
         }
 
     @classmethod
@@ -924,7 +1038,7 @@ class ImageCube(SourcesObtainable):
         def decodeArrayValue(tup):
             isAllSame, v, shape, tp = tup
             if isAllSame:
-                v = np.full(shape, v, dtype=np.dtype(tp))
+                v = image.constantPlane(shape, np.dtype(tp), v)
             return v
 
         data = d['data']  # should already have been converted into an ndarray
@@ -1029,7 +1143,7 @@ class ImageCube(SourcesObtainable):
         non-zero in size"""
         return [r for r in self.rois if not self.isROIBad(r)]
 
-    def drawAnnotationsAndROIs(self, p: QPainter,
+    def drawAnnotationsAndROIs(self, p: 'QPainter',
                                onlyROI: Union[ROI, Sequence] = None,
                                inPDF: bool = False,
                                alpha: float = 1.0):
@@ -1037,7 +1151,7 @@ class ImageCube(SourcesObtainable):
         Will save and restore font because we might be doing font resizing"""
 
         oldFont = p.font()
-        p.setFont(annotFont)
+        p.setFont(annotations.annotationFont())
 
         rois = self._getROIList(onlyROI)
 
@@ -1054,8 +1168,8 @@ class ImageCube(SourcesObtainable):
         """get a Value (or tuple of Values for a multiband image) containing a pixel. Takes x,y."""
         x, y = pixTuple
         ns = self.img[y, x]
-        us = self.uncertainty[y, x]
-        ds = self.dq[y, x]
+        us = self.peekUncertainty()[y, x]
+        ds = self.peekDQ()[y, x]
 
         if self.channels == 1:
             return Value(ns, us, ds)
@@ -1064,9 +1178,9 @@ class ImageCube(SourcesObtainable):
 
     def countBadPixels(self):
         if self.channels == 1:
-            d = self.dq
+            d = self.peekDQ()
         else:
-            d = np.bitwise_or.reduce(self.dq, axis=2)
+            d = np.bitwise_or.reduce(self.peekDQ(), axis=2)
         return np.count_nonzero(d & dq.BAD)
 
     def rotate(self, angleDegrees):
@@ -1081,8 +1195,8 @@ class ImageCube(SourcesObtainable):
         # make a copy of the image and rotate its arrays in-place that many times
         img = self.copy()
         img.img = np.rot90(img.img, n)
-        img.uncertainty = np.rot90(img.uncertainty, n)
-        img.dq = np.rot90(img.dq, n)
+        img.uncertainty = np.rot90(img.peekUncertainty(), n)
+        img.dq = np.rot90(img.peekDQ(), n)
         # remove all annotations and ROIs
         img.annotations = []
         img.rois = []
@@ -1096,12 +1210,12 @@ class ImageCube(SourcesObtainable):
         img = self.copy()
         if vertical:
             img.img = np.flipud(img.img)
-            img.uncertainty = np.flipud(img.uncertainty)
-            img.dq = np.flipud(img.dq)
+            img.uncertainty = np.flipud(img.peekUncertainty())
+            img.dq = np.flipud(img.peekDQ())
         else:
             img.img = np.fliplr(img.img)
-            img.uncertainty = np.fliplr(img.uncertainty)
-            img.dq = np.fliplr(img.dq)
+            img.uncertainty = np.fliplr(img.peekUncertainty())
+            img.dq = np.fliplr(img.peekDQ())
         # remove all annotations and ROIs
         img.annotations = []
         img.rois = []
@@ -1115,7 +1229,10 @@ class ImageCube(SourcesObtainable):
         """
         try:
             outimg = cv.resize(self.img, (w, h), interpolation=method)
-            outunc = cv.resize(self.uncertainty, (w, h), interpolation=method)
+            if image.isConstantPlane(self._uncertainty):
+                outunc = image.constantPlane(outimg.shape, np.float32, self._uncertainty.flat[0])
+            else:
+                outunc = cv.resize(self.uncertainty, (w, h), interpolation=method)
         except Exception as e:
             ui.log(str(e))
             raise Exception(f"OpenCV error - could not resize image")
@@ -1124,12 +1241,12 @@ class ImageCube(SourcesObtainable):
         if self.channels == 1:
             # dammit. Two cases because two different image formats.
             # OR together all the DQ bits in the channel
-            badbits = np.bitwise_or.reduce(self.dq, axis=None) & pcot.dq.BAD
+            badbits = np.bitwise_or.reduce(self.peekDQ(), axis=None) & pcot.dq.BAD
             outdq = np.full((h, w), badbits, dtype=np.uint16)
         else:
             dqs = []
             for i in range(self.channels):
-                dqbits = self.dq[:, :, i]
+                dqbits = self.peekDQ()[:, :, i]
                 # OR together all the DQ bits in the channel
                 badbits = np.bitwise_or.reduce(dqbits, axis=None) & pcot.dq.BAD
                 dqbits = np.full((h, w), badbits, dtype=np.uint16)
@@ -1160,7 +1277,7 @@ class ImageCube(SourcesObtainable):
 
     def save(self, filename, annotations=False, format: str = None,
              name: str = None, description: str = "", append: bool = False,
-             pixelWidth=None,gamma=1.0):
+             pixelWidth=None,gamma=1.0, compression: str = None, level: int = None):
         """Write the image to a file, with or without annotations. If format is provided, it will be used
         otherwise the format will be inferred from the filename extension. Note that this will always clobber -
         determining if the file already exists must be handled by the caller.
@@ -1171,6 +1288,7 @@ class ImageCube(SourcesObtainable):
         * description - a text description of the image (used in the PARC format)
         * append - if True, append to an existing PARC file, otherwise create a new PARC.
         * pixelWidth - if there are annotations, resize to this (default 1000) before saving.
+        * compression, level - the compression method and level for PARC (None to use the configuration)
         """
 
         from pcot import imageexport
@@ -1213,7 +1331,8 @@ class ImageCube(SourcesObtainable):
             if annotations:
                 raise ValueError("PARC format does not support annotations")
             else:
-                with FileArchive(filename, "a" if append else "w", type=ArchiveType.IMAGECUBE) as a:
+                with FileArchive(filename, "a" if append else "w", type=ArchiveType.IMAGECUBE,
+                                 compression=compression, level=level) as a:
                     from pcot.datum import Datum  # late import otherwise cyclic fun
                     ds = DatumStore(a)
                     ds.writeDatum(name, Datum(Datum.IMG, self), description)
@@ -60,10 +60,6 @@ class MultifileInputMethod(InputMethod):
         self.filterre = None
         self.rawLoader = RawLoader(offset=0, bigendian=False)
 
-        # this is a cache used by the loader to avoid reloading files. It's a dictionary of filename
-        # to data and file date.
-        self.cachedFiles = {}
-
         self.mapping = ChannelMapping()
 
     def compileRegex(self):
@@ -79,11 +75,6 @@ class MultifileInputMethod(InputMethod):
         if loader:
             self.rawLoader = loader
 
-    def invalidate(self):
-        """Invalidates the internal cache for this method as well as clearing the output"""
-        self.cachedFiles = {}
-        super().invalidate()
-
     def readData(self):
         # we force the mapping to have to be "reguessed"
         self.mapping.red = -1
@@ -93,7 +84,6 @@ class MultifileInputMethod(InputMethod):
                              bitdepth=self.bitdepth,
                              inpidx=self.input.idx,
                              mapping=self.mapping,
-                             cache=self.cachedFiles,
                              rawloader=self.rawLoader,
                              camera=self.camera)
         logger.debug(f"------------ Image loaded: {img} from {len(self.files)} files, mapping is {self.mapping}")
@@ -130,9 +120,6 @@ class MultifileInputMethod(InputMethod):
             'camera': self.camera,
             'rawloader': self.rawLoader.serialise(),
         }
-        if internal:
-            x['cache'] = self.cachedFiles
-
         Canvas.serialise(self, x)
         return x
 
@@ -150,9 +137,6 @@ class MultifileInputMethod(InputMethod):
             self.camera = data['filterset']
         else:
             self.camera = data['camera']
-        if internal:
-            self.cachedFiles = data['cache']
-
         Canvas.deserialise(self, data)
 
     def modifyWithParameterDict(self, d: TaggedDict) -> bool:
@@ -298,7 +282,7 @@ class MultifileMethodWidget(MethodWidget, PresetOwner):
 
     def loaderSettings(self):
         self.method.rawLoader.edit(self)
-        # clear the cache, we'll need to reload those files!
+        # the files must be reloaded with the new settings (the file cache is keyed on them)
         self.method.invalidate()
         self.loaderSettingsText.setText(str(self.method.rawLoader))
 
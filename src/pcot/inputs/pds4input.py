@@ -9,12 +9,12 @@ from PySide2 import QtWidgets
 from PySide2.QtCore import Qt
 from PySide2.QtGui import QPen
 from PySide2.QtWidgets import QMessageBox, QTableWidgetItem
-from proctools.products import ProductDepot, DataProduct
+from proctools.products import DataProduct
 
 import pcot
 import pcot.dq
 import pcot.ui as ui
-from pcot.dataformats.pds4 import PDS4ImageProduct, ProductList
+from pcot.dataformats.pds4 import PDS4ImageProduct, ProductList, scanDirectory
 from pcot.datum import Datum
 from pcot.imagecube import ChannelMapping
 from pcot.inputs.inputmethod import InputMethod
@@ -81,32 +81,11 @@ class PDS4InputMethod(InputMethod):
         logger.debug("loadLabelsFromDirectory")
         if self.dir is not None:
             # Exceptions might get thrown; the caller must handle them.
-            depot = ProductDepot()
-            # this is actually loading 'labels' in *my* terminology
+            # This is actually loading 'labels' in *my* terminology, using the label index to avoid reading
+            # those we have seen before.
             logger.debug("Loading products...")
-
-            for x in Path(self.dir).expanduser().rglob("*.xml"):
-                print(x)
-
-            depot.load(Path(self.dir), recursive=self.recurse)
+            self.products = scanDirectory(Path(self.dir), recursive=self.recurse)
             logger.debug("...products loaded")
-            # Retrieve labels for all loaded PAN-PP-220/spec-rad products as instances of
-            # proctools.products.pancam:SpecRad; sub in the mnemonic of the product you're after
-
-            # OLD way of doing it, might still be useful - concatenate a bunch of calls to retrieve for each product
-            # type we are interested in.
-
-            # products = depot.retrieve("spec-rad")
-
-            # NEW way of doing it, just retrieve everything and deal with the fact that we get a defaultdict back.
-            products = []
-            pdict = depot.retrieve(None)
-            for k, v in pdict.items():
-                if isinstance(v, list):
-                    products.extend(v)
-
-            # generate a list of PDS4Product objects
-            self.products = ProductList(products)
             pcot.config.setDefaultDir('images', Path(self.dir))
             pcot.config.save()
 
@@ -5,7 +5,7 @@ from typing import List, OrderedDict, Optional
 
 from PySide2.QtWidgets import QVBoxLayout
 
-import pcot.ui.mainwindow
+import pcot.ui
 import pcot.xform as xform
 from pcot import datum
 from pcot.datum import Datum
@@ -350,9 +350,10 @@ class XFormMacro(XFormType):
 
         # and we're also going to have to rebuild the palette, so inform all main
         # windows
-        pcot.ui.mainwindow.MainUI.rebuildPalettes()
-        # and rebuild absolutely everything IF the graph has a scene.
-        pcot.ui.mainwindow.MainUI.rebuildAll()
+        if pcot.ui.mainWindows():
+            pcot.ui.mainwindow.MainUI.rebuildPalettes()
+            # and rebuild absolutely everything IF the graph has a scene.
+            pcot.ui.mainwindow.MainUI.rebuildAll()
 
     def renameType(self, newname):
         """renaming a macro - we have to update more things than default XFormType rename"""
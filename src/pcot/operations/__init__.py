@@ -44,16 +44,19 @@ def performOp(node: XForm,
     if img is not None:
         # otherwise the SubImageCube object from the image - this is the image clipped to
         # a BB around the ROI, with a mask for which pixels are in the ROI.
-        subimage = img.copy().subimage()  # make a copy (need to do this to avoid overwriting the source).
+        # The operation functions don't modify the subimage; they return new arrays for the
+        # subimage's bounding box. So we don't need to copy the image here.
+        subimage = img.subimage()
 
         # perform our function, returning a Value which is a modified clipped image, uncertainty and dq.
         # We also pass the kwargs, expanding them first - optional
         # data goes here (e.g. norm() has a "mode" setting).
         result_nom, result_unc, result_dq = fn(subimage, **kwargs)
 
-        # splice the returned clipped image into the main image, producing a new image, and
-        # store it in the node
-        img = img.modifyWithSub(subimage, result_nom, uncertainty=result_unc, dqv=result_dq)
+        # splice the returned clipped image into a copy of the main image, producing a new image, and
+        # store it in the node. The copy shares the uncertainty and DQ until the splice changes them.
+        img = img.copyOnWrite().modifyWithSub(subimage, result_nom, uncertainty=result_unc, dqv=result_dq,
+                                              inPlace=True)
         img.setMapping(node.mapping)
         img = Datum(Datum.IMG, img)
 
@@ -35,10 +35,10 @@ def doCurve(m, c, subimage: SubImageCube, lut):
         np.putmask(newunc, mask, n)
         newdqs = dq
     else:
-        newunc = subimage.uncertainty.copy()
+        newunc = subimage.peekUncertainty().copy()
         mask = subimage.fullmask()
         newunc[mask] = 0
-        newdqs = subimage.dq.copy()
+        newdqs = subimage.peekDQ().copy()
         newdqs[mask] |= dq.NOUNCERTAINTY
     return newimg, newunc, newdqs
 
@@ -40,14 +40,14 @@ def norm(subimg: SubImageCube, clamp: int, splitchans=False) -> Tuple[np.array,
     if clamp == 0:  # normalize mode
         if splitchans == 0:
             res, scale = _norm(masked)
-            unccopy = subimg.uncertainty.copy()
+            unccopy = subimg.peekUncertainty().copy()
             unc = np.ma.masked_array(unccopy, mask=~mask)
             unc *= scale
         else:
             # split into separate channels - we're going to be using min and max functions,
             # so we need to pass in the masked parts of the image (we want to ignore outside the mask)
             chans = image.imgsplit(masked)
-            uncs = image.imgsplit(subimg.uncertainty)
+            uncs = image.imgsplit(subimg.peekUncertainty())
 
             # this returns a tuple of normalised image and scale factor used to normalise for each channel.
             resAndScales = [_norm(x) for x in chans]
@@ -59,7 +59,7 @@ def norm(subimg: SubImageCube, clamp: int, splitchans=False) -> Tuple[np.array,
             uncs = [u * s for u, s in zip(uncs, scales)]
             # and merge back into an uncertainty image
             uncs = image.imgmerge(uncs)
-            unccopy = subimg.uncertainty.copy()
+            unccopy = subimg.peekUncertainty().copy()
             # and then write that back into the masked part of the uncertainty image copy
             unccopy[mask] = uncs[mask]
 
@@ -75,11 +75,11 @@ def norm(subimg: SubImageCube, clamp: int, splitchans=False) -> Tuple[np.array,
 
         # we need to clear uncertainty and set NOUNC on clipped data.
 
-        unccopy = subimg.uncertainty.copy()
+        unccopy = subimg.peekUncertainty().copy()
         unc = np.ma.masked_array(unccopy, mask=~mask)
         unc[top | bottom] = 0
 
-        dqcopy = subimg.dq.copy()
+        dqcopy = subimg.peekDQ().copy()
         dq = np.ma.masked_array(dqcopy, mask=~mask)
         dq[top | bottom] |= pcot.dq.NOUNCERTAINTY
 
@@ -2,6 +2,7 @@
 nodes on the right hand side."""
 
 import logging
+from typing import TYPE_CHECKING
 
 from PySide2 import QtWidgets, QtCore, QtGui
 from PySide2.QtCore import Qt
@@ -13,7 +14,10 @@ import pcot.macros as macros
 import pcot.ui as ui
 from pcot.ui.collapser import Collapser
 from pcot.xform import XFormType, XFormException
-from pcot.xforms.favourite import Favourite
+
+if TYPE_CHECKING:
+    # favourite imports pcot.xform, which imports the GUI modules (including this one)
+    from pcot.xforms.favourite import Favourite
 
 logger = logging.getLogger(__name__)
 
@@ -126,7 +130,7 @@ class PaletteButtonFavourite(PaletteButtonBase):
 
     removeAct = QAction("Remove from favourites")
 
-    def __init__(self, name, fav: Favourite, palette, view, parent=None):
+    def __init__(self, name, fav: 'Favourite', palette, view, parent=None):
         """constructor, taking button name, xformtype, and view into which they should be inserted."""
         super().__init__(name, view, parent=parent)
         self.setStyleSheet("background-color:rgb(220,220,140)")
@@ -221,7 +225,7 @@ class Palette:
 
         self.hideMacrosAndFavouritesIfNone()
 
-    def addFavourite(self, name, fav:Favourite):
+    def addFavourite(self, name, fav: 'Favourite'):
         """add a favourite to the palette"""
         name = f"{fav.typename}:{name}"
         if name in self.widgetsByName:
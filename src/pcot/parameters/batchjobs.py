@@ -0,0 +1,139 @@
+"""
+Running many batch (parameter file) jobs on the same document, optionally spread over a pool of processes.
+
+Each job is a parameter file and a list of variables for the templating engine (available as {{vars[0]}} and
+so on). Each worker process loads the document once into its own Runner and runs all the jobs it is given
+with it. When there is more than one process, outputs are written while holding a lock on the output file,
+so jobs can safely append to the same PARC or text file - although the order in which they do so is not
+defined.
+"""
+
+import dataclasses
+import logging
+import multiprocessing
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from pathlib import Path
+from typing import List, Optional
+
+logger = logging.getLogger(__name__)
+
+
+@dataclasses.dataclass
+class BatchJob:
+    """A single run of a parameter file"""
+    paramFile: Path
+    vars: List[str]
+
+    def __str__(self):
+        return " ".join([str(self.paramFile)] + self.vars)
+
+
+@dataclasses.dataclass
+class BatchResult:
+    """The result of running a BatchJob"""
+    job: BatchJob
+    time: float  # time taken in seconds
+    error: Optional[str] = None  # None if the job succeeded
+
+    @property
+    def ok(self):
+        return self.error is None
+
+
+# the runner for this process, created by _initWorker, or the error which stopped it being created
+_runner = None
+_initError: Optional[str] = None
+
+
+def _loadRunner(docPath: Path, threads: int, lockOutputs: bool):
+    """Set up PCOT in this process and load the document into its runner"""
+    global _runner
+    import jinja2
+    import pcot
+    from pcot.parameters.runner import Runner
+    from pcot.xform import XFormGraph
+
+    pcot.setup()
+    XFormGraph.threads = threads
+    _runner = Runner(docPath, jinja2.Environment())
+    _runner.lockOutputs = lockOutputs
+
+
+def _initWorker(docPath: Path, threads: int, lockOutputs: bool):
+    """Set up a worker process. If that fails the error is kept and reported as the result of each job the
+    worker is given, because an exception here would just break the pool without saying why."""
+    global _initError
+    try:
+        _loadRunner(docPath, threads, lockOutputs)
+    except Exception as e:
+        logger.exception(f"Cannot set up batch worker for {docPath}")
+        _initError = f"{type(e).__name__}: {e}"
+
+
+def _checkDocument(docPath: Path):
+    """Check that a document can be opened, without loading it, so that a missing or unreadable document
+    is reported before any worker processes are started."""
+    import pcot
+    from pcot.utils.archive import FileArchive
+
+    with FileArchive(docPath) as arc:
+        if "JSON" not in arc.zip.namelist():
+            raise ValueError(f"{docPath} is not a PCOT document")
+        if not pcot.compatible_version_check(arc.metadata.pcotversion):
+            raise ValueError(f"Cannot load document from {docPath} - it is version {arc.metadata.pcotversion}, "
+                             f"this PCOT can only load >{pcot.oldest_valid_version}")
+
+
+def _runJob(job: BatchJob) -> BatchResult:
+    """Run a single job in the current process, catching any exception"""
+    if _initError is not None:
+        return BatchResult(job, 0.0, _initError)
+    st = time.perf_counter()
+    try:
+        _runner.jinja_env.globals['vars'] = job.vars
+        _runner.run(job.paramFile)
+        error = None
+    except Exception as e:
+        logger.exception(f"Batch job {job} failed")
+        error = f"{type(e).__name__}: {e}"
+    return BatchResult(job, time.perf_counter() - st, error)
+
+
+def runJobs(docPath: Path, jobs: List[BatchJob], processes: int = 1, threads: int = 1) -> List[BatchResult]:
+    """Run a list of jobs on a document, returning the results in the same order as the jobs. If processes
+    is more than one, the jobs are distributed over a pool of that many processes. Threads is the number
+    of threads each process uses to run the graph (see XFormGraph.threads). If the document can't be opened
+    the exception is raised here, before any jobs are run; if a worker can't load it, its jobs fail with
+    the error."""
+    global _runner
+    from pcot.xform import XFormGraph
+
+    processes = min(processes, len(jobs))
+    if processes <= 1:
+        oldThreads, oldRunner = XFormGraph.threads, _runner
+        try:
+            _loadRunner(docPath, threads, False)
+            return [_runJob(job) for job in jobs]
+        finally:
+            XFormGraph.threads, _runner = oldThreads, oldRunner
+
+    # check the document can be opened before starting the workers, so that a bad path is reported
+    # here rather than by every worker.
+    _checkDocument(docPath)
+
+    # use spawn rather than fork, so that workers don't inherit Qt state from this process
+    ctx = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(processes, mp_context=ctx, initializer=_initWorker,
+                             initargs=(docPath, threads, True)) as pool:
+        futures = [pool.submit(_runJob, job) for job in jobs]
+        results = []
+        for job, f in zip(jobs, futures):
+            try:
+                results.append(f.result())
+            except BrokenProcessPool as e:
+                # a worker died; this affects all the jobs it hadn't finished
+                logger.error(f"Batch job {job} failed: worker process terminated ({e})")
+                results.append(BatchResult(job, 0.0, f"BrokenProcessPool: {e}"))
+        return results
@@ -121,8 +121,8 @@ def processParameterFileForInputsTest(doc: Document, p: ParameterFile):
         modifyInput(ii, inp)
 
 
-def modifyInput(inputDict, inp: Input):
-    """Modifies an input object based on a dict."""
+def modifyInput(inputDict, inp: Input) -> bool:
+    """Modifies an input object based on a dict. Returns true if the input was modified."""
 
     # we have to modify all the methods in the input object,
     # because we don't know which one is active. In fact, it's
@@ -141,5 +141,6 @@ def modifyInput(inputDict, inp: Input):
                 # if there was an exception, we need to stop
                 raise Exception(f"Error in input {inp.idx}: {inp.exception}")
             # skip the rest of the methods
-            break
+            return True
+    return False
 
@@ -12,7 +12,8 @@ Sequence of actions:
             apply parameter file to paramdict (which will mod. node params) and modify inputs
             run the document
             save output
-            restore the document to its original state and rebuild paramdict
+            restore the node parameters and inputs which were changed to their original state,
+            and rebuild the input and output parts of the paramdict
 
 OR we can do this, modifying the parameters directly
 
@@ -21,9 +22,14 @@ OR we can do this, modifying the parameters directly
         call run with no parameter file
             run the document
             save output
-            restore the document to its original state and rebuild paramdict
+            restore the changed node parameters and inputs, and rebuild paramdict
+
+Restoring only what was changed (rather than reloading the whole document) means that inputs
+which the parameter files don't touch keep their loaded data, and nodes whose parameters and inputs
+haven't changed can reuse their outputs from the previous run.
 
 """
+import contextlib
 import datetime
 import logging
 import os
@@ -37,6 +43,8 @@ from pcot.inputs.inp import NUMINPUTS
 from pcot.parameters.inputs import inputsDictType, modifyInput
 from pcot.parameters.parameterfile import ParameterFile
 from pcot.parameters.taggedaggregates import TaggedDictType, Maybe, TaggedListType, TaggedAggregate
+from pcot.utils.filelock import FileLock
+from pcot.utils.archive import COMPRESSION_TYPES
 
 logger = logging.getLogger(__name__)
 
@@ -68,6 +76,9 @@ outputDictType = TaggedDictType(
 
     name=("name of the datum (if a PARC is being written) - 'main' if not given", Maybe(str), None),
     description=("description of the data (if a PARC is being written)", Maybe(str), None),
+    compression=("compression method for a PARC - deflate, lzma, bzip2 or stored (uses the configuration if not given)",
+                 Maybe(str), None, list(COMPRESSION_TYPES)),
+    level=("compression level for a PARC (uses the configuration if not given)", Maybe(int), None),
     width=(
     "width of output image when exporting to raster formats (in pixels) if annotations is true. If annotations is false or width is negative, no resizing is done.",
     int, 1000),
@@ -98,7 +109,15 @@ class Runner:
         self.doc = Document(document_path)
         self.document_path = document_path
         self.count = 0
-        self.archive = self.doc.saveToMemoryArchive()
+        # set this if other processes may be writing to the same output files (see batchjobs.py); each
+        # output will then be written while holding a lock on the file.
+        self.lockOutputs = False
+        # serialised parameters of each node as they were when the document was loaded, so we can tell
+        # which have been changed and restore them.
+        self.savedParams = {node: node.params.serialise() for node in self.doc.graph.nodes
+                            if isinstance(node.params, TaggedAggregate)}
+        # the state of each input changed in the current run, saved before the change (see _modify_inputs)
+        self.savedInputs = {}
         self._build_param_dict()
 
         if jinja_env is None:
@@ -137,11 +156,44 @@ class Runner:
             self.paramdict[node.getDisplayName()] = node.params
 
         # create the 'originals' which will be used to reset the parameters with
-        # the "reset" commands
+        # the "reset" commands. The node parameters keep their originals between runs.
         for p in self.paramdict.values():
-            if isinstance(p, TaggedAggregate):
+            if isinstance(p, TaggedAggregate) and p.original is None:
                 p.generate_original()
 
+    def _modify_inputs(self):
+        """Apply the input parameters to the inputs, first saving the state of any input
+        we haven't already changed in this run so it can be restored afterwards."""
+        for i in range(NUMINPUTS):
+            # note that we are using the string representation of the input numbers as keys
+            ii = self.paramdict['inputs'][str(i)]
+            inp = self.doc.inputMgr.getInput(i)
+            # an internal serialisation just keeps references to any loaded data, so it's cheap
+            saved = inp.serialise(internal=True) if i not in self.savedInputs else None
+            modified = True     # assume the input was changed if modifyInput() throws
+            try:
+                modified = modifyInput(ii, inp)
+            finally:
+                if modified and saved is not None:
+                    self.savedInputs[i] = saved
+
+    def _restore(self):
+        """Restore the node parameters and inputs which have been changed (by a parameter file or
+        directly through the paramdict) to their original state, leaving everything else alone."""
+        for node, saved in self.savedParams.items():
+            if node.params.serialise() != saved:
+                logger.debug(f"Restoring parameters of {node.getDisplayName()}")
+                node.params.original = node.params.type.deserialise(saved)
+                node.params.restore_to_original()
+                node.params.generate_original()
+                # serialise again; the restored version may differ in trivial ways (e.g. tuples becoming lists)
+                self.savedParams[node] = node.params.serialise()
+                node.type.nodeDataFromParams(node)
+        for i, saved in self.savedInputs.items():
+            logger.debug(f"Restoring input {i}")
+            self.doc.inputMgr.getInput(i).deserialise(saved, internal=True)
+        self.savedInputs = {}
+
     def run(self, param_file: Optional[Path], param_file_text: Optional[str] = None,
             data_for_template: Optional[Dict[str, Any]] = None):
         """Run the document with the parameters set from the given file. The param_file_text
@@ -189,11 +241,7 @@ class Runner:
                 # directly. We need to apply these to the inputs. No need to worry about the nodes
                 # as they are already modified. Ditto the output parameters, which are handled in
                 # writeOutputs.
-                for i in range(NUMINPUTS):
-                    # note that we are using the string representation of the input numbers as keys
-                    ii = self.paramdict['inputs'][str(i)]
-                    inp = self.doc.inputMgr.getInput(i)
-                    modifyInput(ii, inp)
+                self._modify_inputs()
 
                 # run the document
                 self.doc.run()
@@ -233,7 +281,7 @@ class Runner:
             # for the next run. This is in a finally block in case any of the above code
             # throws an exception - we definitely want to restore!
             logger.debug("Restoring document to original state")
-            self.doc.loadFromMemoryArchive(self.archive)
+            self._restore()
             logger.debug("rebuilding param dict")
             self._build_param_dict()
             logger.debug("rebuild done")
@@ -280,4 +328,5 @@ class Runner:
                 # bit of unnecessary information for some cases, but at least the method signature is simple
                 # and the data well-organised (as it's a TaggedDict).
                 logger.info(f"writing output to {v.file}")
-                output.writeBatchOutputFile(v)
+                with FileLock(v.file) if self.lockOutputs else contextlib.nullcontext():
+                    output.writeBatchOutputFile(v)
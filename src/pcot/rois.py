@@ -1,17 +1,17 @@
 import copy
+import threading
+from collections import OrderedDict
+from functools import lru_cache
 from numbers import Number
-from typing import Tuple, Optional
+from typing import Tuple, Optional, TYPE_CHECKING
 
 import cv2 as cv
 import numpy as np
-from PySide2.QtCore import Qt, QPointF
-from PySide2.QtGui import QPainter, QImage, QPen
 from numpy import ndarray
 from scipy import ndimage
 
 import pcot.sources
 from pcot.sources import SourcesObtainable, nullSourceSet
-from pcot.ui.roiedit import RectEditor, CircleEditor, PaintedEditor, PolyEditor
 from pcot.utils.annotations import Annotation, annotDrawText
 from pcot.utils.colour import rgb2qcol
 from pcot.utils.flood import FastFloodFiller, FloodFillParams
@@ -19,9 +19,41 @@ from pcot.utils.geom import Rect
 from pcot.parameters.taggedaggregates import TaggedDictType, taggedColourType, TaggedDict, taggedRectType, \
     Maybe, TaggedListType
 
+if TYPE_CHECKING:
+    # Qt is only needed (and only imported) when ROIs are drawn or edited
+    from PySide2.QtGui import QPainter
+
 # used as the basic default rectangle for ROIs
 rectType = taggedRectType(0, 0, 0, 0)
 
+# The results of recent unions and intersections of ROIs (see ROI._combined()), most recently used last.
+# The cache is limited by the total size of the masks its entries keep alive.
+COMBINED_CACHE_BYTES = 64 * 1024 * 1024
+_combinedCache = OrderedDict()
+_combinedCacheBytes = 0
+_combinedLock = threading.Lock()
+
+
+@lru_cache(maxsize=64)
+def _rectMask(w, h):
+    """Rect masks are all True, so any two rects of the same size can share one"""
+    m = np.full((h, w), True)
+    m.flags.writeable = False
+    return m
+
+
+@lru_cache(maxsize=64)
+def _circleMask(r):
+    """Circle masks only depend on the radius, and multidot ROIs usually all have the same one"""
+    # there are a few ways we can generate a circular
+    # mask bounded by the BB. This is one of them, which
+    # leverages cv's drawing code.
+    m = np.zeros((r * 2 + 1, r * 2 + 1), dtype=np.uint8)
+    cv.circle(m, (r, r), r, 255, -1)
+    m = m > 0
+    m.flags.writeable = False
+    return m
+
 
 class BadOpException(Exception):
     def __init__(self):
@@ -85,6 +117,7 @@ class ROI(SourcesObtainable, Annotation):
 
         self.bbrect = bbrect
         self.maskimg = maskimg
+        self._maskCache = None  # see _cachedMask()
         self.internalIdx = ROI.count  # debugging
         ROI.count += 1
 
@@ -140,9 +173,23 @@ class ROI(SourcesObtainable, Annotation):
         else:
             return self.mask().sum()
 
+    def _cachedMask(self, key, make):
+        """Masks can be expensive to make and are asked for over and over again (every subimage() does it), so
+        subclasses keep the last one they made along with a key describing what it was made from: either a tuple
+        of the parameters the mask depends on, or an array it was made from (compared by identity). If the
+        key has changed we call make() to make a new mask. The masks are read-only, because they are shared."""
+        c = self._maskCache
+        if c is not None and (c[0] is key or (isinstance(key, tuple) and isinstance(c[0], tuple) and c[0] == key)):
+            return c[1]
+        m = make()
+        if m is not None:
+            m.flags.writeable = False
+        self._maskCache = (key, m)
+        return m
+
     def changed(self):
         """Called from roiexpr when ROI is changed"""
-        pass
+        self._maskCache = None
 
     def details(self):
         """Information string on this ROI. This default shows the extent."""
@@ -154,20 +201,22 @@ class ROI(SourcesObtainable, Annotation):
         else:
             return "No ROI"
 
-    def setPen(self, p: QPainter, alpha):
+    def setPen(self, p: 'QPainter', alpha):
+        from PySide2.QtGui import QPen
         pen = QPen(rgb2qcol(self.colour, alpha=alpha))
         pen.setWidth(self.thickness)
         p.setPen(pen)
 
-    def annotateBB(self, p: QPainter, alpha):
+    def annotateBB(self, p: 'QPainter', alpha):
         """Draw the BB onto a QPainter"""
+        from PySide2.QtCore import Qt
         if (bb := self.bb()) is not None:
             x, y, w, h = bb.astuple()
             p.setBrush(Qt.NoBrush)
             self.setPen(p, alpha)
             p.drawRect(x, y, w, h)
 
-    def annotateMask(self, p: QPainter, alpha):
+    def annotateMask(self, p: 'QPainter', alpha):
         """This is the 'default' annotate, which draws the ROI onto the painter by
         using its actual mask. It takes the mask, edge detects (if drawEdge), converts into
         an image."""
@@ -193,14 +242,15 @@ class ROI(SourcesObtainable, Annotation):
             x = (x * 255 * alpha).astype(np.ubyte)
             # resize to canvas/painter scale
             # to qimage, stashing the data into a field to avoid the problem
-            # discussed in canvas.img2qimage where memory is freed by accident in Qt
+            # discussed in canvasrender.img2qimage where memory is freed by accident in Qt
             # (https://bugreports.qt.io/browse/PYSIDE-1563)
             self.workaround = x
+            from PySide2.QtGui import QImage
             q = QImage(x.data, ww, hh, ww * 4, QImage.Format_RGBA8888)
             # now we have a QImage we can draw it onto the painter.
             p.drawImage(bb.x, bb.y, q)
 
-    def annotateText(self, p: QPainter, alpha):
+    def annotateText(self, p: 'QPainter', alpha):
         """Draw the text for the ROI onto the painter"""
         if (bb := self.bb()) is not None and self.fontsize > 0 and self.label is not None and self.label != '':
             x, y, x2, y2 = bb.corners()
@@ -221,7 +271,7 @@ class ROI(SourcesObtainable, Annotation):
                           bgcol=bgcol if self.drawbg else None,
                           fontsize=self.fontsize)
 
-    def annotate(self, p: QPainter, img, alpha):
+    def annotate(self, p: 'QPainter', img, alpha):
         """This is the default annotation method drawing the ROI onto a QPainter as part of the annotations system.
         It should be replaced with a more specialised method if possible."""
         if self.drawBox:
@@ -309,15 +359,53 @@ class ROI(SourcesObtainable, Annotation):
         td = self.TAGGEDDICT.deserialise(d)
         self.from_tagged_dict(td)
 
+    @staticmethod
+    def _combined(op, rois, make):
+        """Return the bounding box, mask and containing image dimensions of a union or intersection of ROIs, made
+        by calling make() or taken from a cache of recent results. The cache is keyed on the op and the bounding box,
+        mask and containing image dimensions of each ROI. Masks are compared by identity, so this only works
+        with the read-only masks cached by the ROIs (see _cachedMask()) or shared between them (rects and circles
+        of the same size share masks, so they don't even have to be the same ROI objects). The cache entry keeps
+        the masks alive, so their ids can't be reused - so the cache is limited by the size of those masks
+        (COMBINED_CACHE_BYTES)."""
+        global _combinedCacheBytes
+        masks = [r.mask() for r in rois]
+        if any(m is None or m.flags.writeable for m in masks):
+            return make()
+        key = (op,) + tuple((r.bb().astuple(), id(m), r.containingImageDimensions) for r, m in zip(rois, masks))
+        with _combinedLock:
+            if (entry := _combinedCache.get(key)) is not None:
+                _combinedCache.move_to_end(key)
+                bb, mask, dims = entry[1]
+                return bb.copy(), mask, dims
+        bb, mask, dims = make()
+        mask.flags.writeable = False
+        size = mask.nbytes + sum(m.nbytes for m in {id(m): m for m in masks}.values())  # shared masks count once
+        if size > COMBINED_CACHE_BYTES:
+            return bb, mask, dims
+        with _combinedLock:
+            if key not in _combinedCache:
+                _combinedCache[key] = (masks, (bb.copy(), mask, dims), size)
+                _combinedCacheBytes += size
+            while _combinedCacheBytes > COMBINED_CACHE_BYTES:
+                _, (_, _, oldSize) = _combinedCache.popitem(last=False)
+                _combinedCacheBytes -= oldSize
+        return bb, mask, dims
+
     @staticmethod
     def roiUnion(rois):
-        bbs = [r.bb() for r in rois]  # get bbs
-        bbs = [b for b in bbs if b is not None]
-        # we set the image dimensions to the last one we got - if they aren't
-        # all the same we probably have bigger problems.
-        dims = None
-        dimsOK = True  # flag to indicate that containing dimensions agree. Attach to result.
-        if len(bbs) > 0:
+        valid = [r for r in rois if r.bb() is not None]  # ignore undefined ROIs
+        if len(valid) == 0:
+            # return a null ROI
+            return None
+            # return ROI(Rect(0, 0, 10, 10), np.full((10, 10), False))
+
+        def make():
+            bbs = [r.bb() for r in valid]  # get bbs
+            # we set the image dimensions to the last one we got - if they aren't
+            # all the same we probably have bigger problems.
+            dims = None
+            dimsOK = True  # flag to indicate that containing dimensions agree. Attach to result.
             x1 = min([b.x for b in bbs])
             y1 = min([b.y for b in bbs])
             x2 = max([b.x + b.w for b in bbs])
@@ -326,70 +414,72 @@ class ROI(SourcesObtainable, Annotation):
             # now construct the mask, initially all False
             mask = np.full((y2 - y1, x2 - x1), False)
             # and OR the ROIs into it
-            for r in rois:
-                if (bb2 := r.bb()) is not None:  # ignore undefined ROIs
-                    # here we make sure that the containing image dimensions agree and are propagated
-                    # to the result. If they don't agree we zero them.
-                    if r.containingImageDimensions is not None:
-                        if dims is None:
-                            dims = r.containingImageDimensions
-                        elif dims != r.containingImageDimensions:
-                            dimsOK = False
-
-                    rx, ry, rw, rh = bb2
-                    # calculate ROI's position inside subimage
-                    x = rx - x1
-                    y = ry - y1
-                    # get ROI's mask
-                    roimask = r.mask()
-                    # add it at that position
-                    mask[y:y + rh, x:x + rw] |= roimask
-            # should not be saved
-            roi = ROI(bb, mask, isTemp=True, containingImageDimensions=dims if dimsOK else None)
-            roi.sources = pcot.sources.SourceSet(rois)  # can pass list of SourcesObtainable to ctor
-            return roi
-        else:
-            # return a null ROI
-            return None
-            # return ROI(Rect(0, 0, 10, 10), np.full((10, 10), False))
+            for r, bb2 in zip(valid, bbs):
+                # here we make sure that the containing image dimensions agree and are propagated
+                # to the result. If they don't agree we zero them.
+                if r.containingImageDimensions is not None:
+                    if dims is None:
+                        dims = r.containingImageDimensions
+                    elif dims != r.containingImageDimensions:
+                        dimsOK = False
+
+                rx, ry, rw, rh = bb2
+                # calculate ROI's position inside subimage
+                x = rx - x1
+                y = ry - y1
+                # get ROI's mask
+                roimask = r.mask()
+                # add it at that position
+                mask[y:y + rh, x:x + rw] |= roimask
+            return bb, mask, dims if dimsOK else None
+
+        bb, mask, dims = ROI._combined('union', valid, make)
+        # should not be saved
+        roi = ROI(bb, mask, isTemp=True, containingImageDimensions=dims)
+        roi.sources = pcot.sources.SourceSet(rois)  # can pass list of SourcesObtainable to ctor
+        return roi
 
     @staticmethod
     def roiIntersection(rois):
-        bbs = [r.bb() for r in rois]  # get bbs
-        x1 = min([b.x for b in bbs])
-        y1 = min([b.y for b in bbs])
-        x2 = max([b.x + b.w for b in bbs])
-        y2 = max([b.y + b.h for b in bbs])
-        bb = Rect(x1, y1, x2 - x1, y2 - y1)
-        # now construct the mask, initially all True
-        mask = np.full((y2 - y1, x2 - x1), True)
-        # we set the image dimensions to the last one we got - if they aren't
-        # all the same we probably have bigger problems.
-        dims = None
-        dimsOK = True
-        # and AND the ROIs into it
-        for r in rois:
-            # here we make sure that the containing image dimensions agree and are propagated
-            # to the result. If they don't agree we zero them.
-            if r.containingImageDimensions is not None:
-                if dims is None:
-                    dims = r.containingImageDimensions
-                elif dims != r.containingImageDimensions:
-                    dimsOK = False
-            rx, ry, rw, rh = r.bb()
-            # calculate ROI's position inside subimage
-            x = rx - x1
-            y = ry - y1
-            # get ROI's mask
-            roimask = r.mask()
-            # construct a working mask, same size as our final mask. We need to do this so that
-            # the AND operation goes over the entire result mask.
-            workMask = np.full((y2 - y1, x2 - x1), False)
-            # add the ROI to the working mask at that position
-            workMask[y:y + rh, x:x + rw] = roimask
-            # and AND the mask by the work mask.
-            mask &= workMask
-        return ROI(bb, mask, isTemp=True, containingImageDimensions=dims if dimsOK else None)
+        def make():
+            bbs = [r.bb() for r in rois]  # get bbs
+            x1 = min([b.x for b in bbs])
+            y1 = min([b.y for b in bbs])
+            x2 = max([b.x + b.w for b in bbs])
+            y2 = max([b.y + b.h for b in bbs])
+            bb = Rect(x1, y1, x2 - x1, y2 - y1)
+            # now construct the mask, initially all True
+            mask = np.full((y2 - y1, x2 - x1), True)
+            # we set the image dimensions to the last one we got - if they aren't
+            # all the same we probably have bigger problems.
+            dims = None
+            dimsOK = True
+            # and AND the ROIs into it
+            for r in rois:
+                # here we make sure that the containing image dimensions agree and are propagated
+                # to the result. If they don't agree we zero them.
+                if r.containingImageDimensions is not None:
+                    if dims is None:
+                        dims = r.containingImageDimensions
+                    elif dims != r.containingImageDimensions:
+                        dimsOK = False
+                rx, ry, rw, rh = r.bb()
+                # calculate ROI's position inside subimage
+                x = rx - x1
+                y = ry - y1
+                # get ROI's mask
+                roimask = r.mask()
+                # construct a working mask, same size as our final mask. We need to do this so that
+                # the AND operation goes over the entire result mask.
+                workMask = np.full((y2 - y1, x2 - x1), False)
+                # add the ROI to the working mask at that position
+                workMask[y:y + rh, x:x + rw] = roimask
+                # and AND the mask by the work mask.
+                mask &= workMask
+            return bb, mask, dims if dimsOK else None
+
+        bb, mask, dims = ROI._combined('intersection', rois, make)
+        return ROI(bb, mask, isTemp=True, containingImageDimensions=dims)
 
     def clipToImage(self, img: ndarray):
         # clip the ROI to the image. If it doesn't require clipping, just returns the ROI. If it does,
@@ -591,14 +681,14 @@ class ROIRect(ROI):
             return "{} pixels\n{},{}\n{}x{}".format(self.pixels(),
                                                     self.x, self.y, self.w, self.h)
 
-    def annotate(self, p: QPainter, img, alpha):
+    def annotate(self, p: 'QPainter', img, alpha):
         """Simpler version of annotate for rects; doesn't draw the mask"""
         self.annotateBB(p, alpha)
         self.annotateText(p, alpha)
 
     def mask(self):
         # return a boolean array of True, same size as BB
-        return np.full((self.h, self.w), True)
+        return _rectMask(self.w, self.h)
 
     def set(self, x, y, w, h):
         self.x = x
@@ -642,6 +732,7 @@ class ROIRect(ROI):
         return self._str(True)
 
     def createEditor(self, tab):
+        from pcot.ui.roiedit import RectEditor
         return RectEditor(tab)
 
 
@@ -677,7 +768,8 @@ class ROICircle(ROI):
         self.y = int(y)
         self.r = int(r)
 
-    def annotate(self, p: QPainter, img, alpha):
+    def annotate(self, p: 'QPainter', img, alpha):
+        from PySide2.QtCore import Qt
         if (bb := self.bb()) is not None:
             self.annotateBB(p, alpha)
             self.annotateText(p, alpha)
@@ -699,12 +791,7 @@ class ROICircle(ROI):
             return None
 
     def mask(self):
-        # there are a few ways we can generate a circular
-        # mask bounded by the BB. This is one of them, which
-        # leverages cv's drawing code.
-        m = np.zeros((self.r * 2 + 1, self.r * 2 + 1), dtype=np.uint8)
-        cv.circle(m, (self.r, self.r), self.r, 255, -1)
-        return m > 0
+        return _circleMask(self.r)
 
     def to_tagged_dict(self):
         td = self.TAGGEDDICT.create()
@@ -732,6 +819,7 @@ class ROICircle(ROI):
         return r
 
     def createEditor(self, tab):
+        from pcot.ui.roiedit import CircleEditor
         return CircleEditor(tab)
 
     def __str__(self):
@@ -764,6 +852,9 @@ class ROIPainted(ROI):
 
     TAGGEDDICT = TaggedDictType(*TAGGEDDICTDEFINITION)
 
+    # Maps with at least this many pixels are stored bit-packed, taking an eighth of the memory; None to never pack.
+    PACK_THRESHOLD: Optional[int] = 1 << 20
+
     # we can create this ab initio or from a subimage mask of an image.
     def __init__(self, mask=None, label=None, sourceROI=None, containingImageDimensions=None):
         super().__init__(sourceROI=sourceROI, label=label,
@@ -775,13 +866,32 @@ class ROIPainted(ROI):
             else:
                 h, w = mask.shape[:2]
                 self.bbrect = Rect(0, 0, w, h)
-                self.map = np.zeros((h, w), dtype=np.uint8)
-                self.map[mask] = 255
+                m = np.zeros((h, w), dtype=np.uint8)
+                m[mask] = 255
+                self.map = m
         else:
             self.map = sourceROI.mask()  # not a copy?
             self.bbrect = Rect.copy(sourceROI.bb())
         self.r = 10  # default "circle size" for painting; used in multidot editor
 
+    @property
+    def map(self) -> Optional[np.ndarray]:
+        """The mask as a uint8 array (nonzero where the pixel is in the ROI), the same size as the BB.
+        This is unpacked if the map is stored packed, so don't modify it in place - set a new one."""
+        if self._packed is None:
+            return self._map
+        packed, shape = self._packed
+        return np.unpackbits(packed, count=shape[0] * shape[1]).reshape(shape) * np.uint8(255)
+
+    @map.setter
+    def map(self, m: Optional[np.ndarray]):
+        if m is not None and self.PACK_THRESHOLD is not None and m.size >= self.PACK_THRESHOLD:
+            self._packed = (np.packbits(m > 0, axis=None), m.shape)
+            self._map = None
+        else:
+            self._packed = None
+            self._map = m
+
     def clear(self):
         self.map = None
         self.bbrect = None
@@ -811,10 +921,15 @@ class ROIPainted(ROI):
 
     def mask(self):
         """return a boolean array, same size as BB"""
-        return self.map > 0
+        src = self._map if self._packed is None else self._packed[0]
+        return self._cachedMask(src, lambda: self.map > 0)
 
     def getSize(self):
-        return 0 if self.map is None else self.map.nbytes
+        # the size of the map as it is serialised, which is always unpacked
+        if self._packed is not None:
+            h, w = self._packed[1]
+            return h * w
+        return 0 if self._map is None else self._map.nbytes
 
     def fullsize(self):
         """return the full size mask"""
@@ -925,6 +1040,7 @@ class ROIPainted(ROI):
         return r
 
     def createEditor(self, tab):
+        from pcot.ui.roiedit import PaintedEditor
         return PaintedEditor(tab)
 
     def _str(self, use_id):
@@ -1003,11 +1119,13 @@ class ROIPoly(ROI):
         self.drawPoints = td.drawPoints
 
     def mask(self):
-        # return a boolean array, same size as BB. We use opencv here to build a uint8 image
-        # which we convert into a boolean array.
-
         if not self.hasPoly():
             return
+        return self._cachedMask(tuple(self.points), self._makeMask)
+
+    def _makeMask(self):
+        # return a boolean array, same size as BB. We use opencv here to build a uint8 image
+        # which we convert into a boolean array.
 
         # First, we need to build a polygon relative to the bounding box
         xmin, ymin, w, h = self.bb()
@@ -1022,8 +1140,9 @@ class ROIPoly(ROI):
         # convert to boolean
         return polyimg > 0
 
-    def annotatePoly(self, p: QPainter, alpha):
+    def annotatePoly(self, p: 'QPainter', alpha):
         """draw the polygon as annotation onto a painter"""
+        from PySide2.QtCore import Qt, QPointF
 
         if len(self.points) > 0:
             p.setBrush(Qt.NoBrush)
@@ -1048,7 +1167,7 @@ class ROIPoly(ROI):
             points.append(points[0])  # close the loop
             p.drawPolyline([QPointF(x, y) for (x, y) in points])
 
-    def annotate(self, p: QPainter, img, alpha):
+    def annotate(self, p: 'QPainter', img, alpha):
         self.annotatePoly(p, alpha)
         if self.drawBox:
             self.annotateBB(p, alpha)
@@ -1094,6 +1213,7 @@ class ROIPoly(ROI):
         return r
 
     def createEditor(self, tab):
+        from pcot.ui.roiedit import PolyEditor
         return PolyEditor(tab)
 
     def _str(self, use_id):
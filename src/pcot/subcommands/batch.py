@@ -2,23 +2,74 @@ from pcot.subcommands import subcommand,argument
 
 @subcommand(
     [argument("doc", metavar="DOC", help="The document containing the graph"),
-     argument("file", metavar="FILE", help="The batch file to run"),
-     argument('vars', nargs='*', help='variables to set in the batch file (vars[0], vars[1], ...)')],
+     argument("file", metavar="FILE",
+              help="The batch file to run, or a quoted glob pattern (e.g. 'sol*.param') to run several"),
+     argument('vars', nargs='*', help='variables to set in the batch file (vars[0], vars[1], ...)'),
+     argument("--threads", "-t", type=int, default=1,
+              help="Number of worker threads used to run independent nodes in the graph (default 1)"),
+     argument("--jobs", "-j", type=int, default=1,
+              help="Number of processes to run batch files in (default 1)"),
+     argument("--foreach", action="store_true",
+              help="Run the batch file(s) once for each variable, setting vars[0] to that variable")],
     shortdesc="Run a graph using a PCOT batch (parameter) file"
 )
 def batch(args):
     """
-    Run a PCOT batch (parameter) file.
+    Run a PCOT batch (parameter) file, or several of them. If more than one batch file
+    is run, they can be spread over several processes with --jobs, and a summary of the
+    results is printed at the end.
     """
-    import jinja2
+    import glob
+    import sys
+    import time
     from pathlib import Path
 
-    import pcot
-    from pcot.parameters.runner import Runner
+    from pcot.parameters.batchjobs import BatchJob, runJobs
+    from pcot.utils.table import Table
 
-    pcot.setup()
-    jinja_env = jinja2.Environment()
-    jinja_env.globals['vars'] = args.vars
+    files = sorted(glob.glob(args.file)) if glob.has_magic(args.file) else [args.file]
+    if len(files) == 0:
+        print(f"No batch files match {args.file}")
+        sys.exit(1)
 
-    runner = Runner(Path(args.doc), jinja_env)
-    runner.run(Path(args.file))
+    if args.foreach:
+        if len(args.vars) == 0:
+            print("--foreach needs some variables")
+            sys.exit(1)
+        jobs = [BatchJob(Path(f), [v]) for f in files for v in args.vars]
+    else:
+        jobs = [BatchJob(Path(f), args.vars) for f in files]
+
+    if len(jobs) == 1:
+        # just run the single job here, letting any exception through
+        import jinja2
+        import pcot
+        from pcot.parameters.runner import Runner
+        from pcot.xform import XFormGraph
+
+        pcot.setup()
+        XFormGraph.threads = args.threads
+        jinja_env = jinja2.Environment()
+        jinja_env.globals['vars'] = jobs[0].vars
+
+        runner = Runner(Path(args.doc), jinja_env)
+        runner.run(jobs[0].paramFile)
+        return
+
+    st = time.perf_counter()
+    results = runJobs(Path(args.doc), jobs, processes=args.jobs, threads=args.threads)
+    elapsed = time.perf_counter() - st
+
+    t = Table()
+    for r in results:
+        t.newRow()
+        t.add('job', str(r.job))
+        t.add('time', f"{r.time:.2f}")
+        t.add('result', "OK" if r.ok else r.error)
+    print(t.text("BATCH JOBS"))
+
+    failed = [r for r in results if not r.ok]
+    print(f"{len(results)} jobs, {len(failed)} failed, {elapsed:.2f}s elapsed, "
+          f"{sum(r.time for r in results):.2f}s total job time")
+    if failed:
+        sys.exit(1)
@@ -1,10 +1,7 @@
 import sys
 
-from PySide2 import QtWidgets
-
 from pcot.parameters.taggedaggregates import TaggedDict, TaggedList
 from pcot.subcommands import subcommand,argument
-from pcot.ui.taggedaggregates import AggregateEditorDialog
 
 
 @subcommand([
@@ -110,6 +107,9 @@ def setconfig(args):
     shortdesc="Run the configuration UI")
 def config(args):
     import pcot.config
+    from PySide2 import QtWidgets
+    from pcot.ui.taggedaggregates import AggregateEditorDialog
+
     app = QtWidgets.QApplication(sys.argv)
 
     dialog = AggregateEditorDialog(pcot.config.data)
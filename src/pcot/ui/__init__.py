@@ -1,15 +1,28 @@
+import importlib
 import logging
+import sys
 import traceback
 from datetime import datetime
+from typing import TYPE_CHECKING, List
 
-import pcot.ui.mainwindow as mainwindow
-from PySide2 import QtWidgets
-from PySide2.QtCore import Qt
-from PySide2.QtWidgets import QMessageBox
-from pcot.ui.help import markdownWrapper
+if TYPE_CHECKING:
+    from PySide2 import QtWidgets
+    from pcot.ui.mainwindow import MainUI
 
 logger = logging.getLogger(__name__)
 
+
+def __getattr__(name):
+    """The modules in this package (mainwindow, canvas and so on) all need Qt's widgets, so they are only
+    imported when they are first used. That way, using PCOT without a GUI doesn't load them."""
+    try:
+        return importlib.import_module(f"{__name__}.{name}")
+    except ModuleNotFoundError as e:
+        if e.name != f"{__name__}.{name}":
+            raise
+        raise AttributeError(f"module {__name__} has no attribute {name}") from None
+
+
 # Stores the QApplication if we have one. But it *only* does this for when there really is a UI.
 
 application = None
@@ -29,9 +42,20 @@ def app():
     return application
 
 
+def mainWindows(doc=None) -> List['MainUI']:
+    """Get all the open main windows, or those showing a document. If the main window module hasn't been
+    imported there can't be any, so this doesn't import it - graphs and documents call this when they
+    change, and without a GUI that shouldn't load Qt's widgets."""
+    mainwindow = sys.modules.get(f"{__name__}.mainwindow")
+    if mainwindow is None:
+        return []
+    return mainwindow.MainUI.windows if doc is None else mainwindow.MainUI.getWindowsForDocument(doc)
+
+
 ## show a message on the status bar
 def msg(t):
     if application is not None:
+        from pcot.ui import mainwindow
         for x in mainwindow.MainUI.windows:
             x.statusBar.showMessage(t)
             x.statusBar.repaint()  # make sure the message appears!
@@ -47,6 +71,7 @@ def log(s, toStdout=True, timestamp=True, loglevel=logging.INFO):
         s = f"{datetime.now().strftime('%H:%M:%S')} {s}"
 
     if application is not None:
+        from pcot.ui import mainwindow
         for x in mainwindow.MainUI.windows:
             x.logText.append(s)
     if toStdout:
@@ -58,6 +83,7 @@ def snark(s):
     (Carroll, L. & Holiday, H. (1902) The Hunting of the Snark, an Agony, in Eight Fits . New York, The Macmillan company."""
     if application is not None:
         s = f"{datetime.now().strftime('%H:%M:%S')} {s}"
+        from pcot.ui import mainwindow
         for x in mainwindow.MainUI.windows:
             x.logText.append(f'<font color="purple">{s}</font>')
     logger.debug(f"LOG snark {s}")
@@ -67,6 +93,7 @@ def error(s, tb=True):
     """show error on status bar, and log in red; will dump traceback to stdout if requested."""
     if application is not None:
         m = f'<font color="red">Error: </font> {s}'
+        from pcot.ui import mainwindow
         for x in mainwindow.MainUI.windows:
             x.logText.append(m)
         application.beep()
@@ -79,6 +106,7 @@ def warn(s):
     """show a warning dialog"""
     if app() is not None:
         application.beep()
+        from PySide2 import QtWidgets
         QtWidgets.QMessageBox.warning(None, 'WARNING', s)
     else:
         logger.warning(f"LOG WARN {s}")
@@ -118,11 +146,14 @@ def versionWarn(n):
         log('MD5 hash in file: {}'.format(n.savedmd5), loglevel=logging.WARN)
 
 
-def decorateSplitter(splitter: QtWidgets.QSplitter, index: int):
+def decorateSplitter(splitter: 'QtWidgets.QSplitter', index: int):
     """Often splitters in Qt are really hard to see - especially true for those on the Canvas. This code makes
     them more visible, creating a double-bar handle that goes the whole width/height.
     Adapted from https://stackoverflow.com/questions/2545577/qsplitter-becoming-undistinguishable-between-qwidget-and-qtabwidget/13513631#13513631
     """
+    from PySide2 import QtWidgets
+    from PySide2.QtCore import Qt
+
     gripLength = 1200
     gripWidth = 2
     grips = 2
@@ -157,6 +188,8 @@ def decorateSplitter(splitter: QtWidgets.QSplitter, index: int):
 
 def pyperclipErrorDialog():
     """sometimes we need to actually pop up a dialog to make sure the error is noticed"""
+    from PySide2.QtWidgets import QMessageBox
+    from pcot.ui.help import markdownWrapper
 
     errortxt = """*Assuming your error was "Pyperclip could not find a copy/paste mechanism for your system":*
     
@@ -3,13 +3,12 @@ import logging
 import math
 import os
 import platform
-from typing import TYPE_CHECKING, Optional, Union, List, Tuple, Dict
+from typing import TYPE_CHECKING, Optional, Union, List, Dict
 
-import cv2 as cv
 import numpy as np
 from PySide2 import QtWidgets, QtCore, QtGui
 from PySide2.QtCore import Qt, QTimer, QPoint
-from PySide2.QtGui import QImage, QPainter, QBitmap, QCursor, QPen, QKeyEvent, QFont, QResizeEvent
+from PySide2.QtGui import QPainter, QBitmap, QCursor, QPen, QKeyEvent, QFont, QResizeEvent
 from PySide2.QtWidgets import QCheckBox, QMessageBox, QMenu, QLabel
 
 import pcot
@@ -18,12 +17,14 @@ import pcot.ui as ui
 from pcot import canvasnormalise, dq
 from pcot.assets import getAssetAsFile
 from pcot.datum import Datum
-from pcot.ui import canvasdq
+from pcot.ui import canvasdq, canvasrender
 from pcot.ui.canvasdq import CanvasDQSpec
 from pcot.ui.collapser import Collapser, CollapserSection
 from pcot.ui.spectrumwidget import SpectrumWidget
 from pcot.utils.deb import Timer
 from pcot.utils.maths import pooled_sd
+from pcot.utils.pyramid import Pyramid, halveOr
+from pcot.utils.tilestats import TileStats
 
 if TYPE_CHECKING:
     from pcot.xform import XFormGraph, XForm
@@ -141,7 +142,21 @@ class InnerCanvas(QtWidgets.QWidget):
         super().__init__(parent)
         self.rgb = None
         self.imgCube = None
+        # lazily built reduced-size copies of the RGB, uncertainty and DQ for zoomed-out views
+        self.rgbPyramid = None
+        self.uncPyramid = None
+        self.dqPyramid = None
+        # cached range statistics of the RGB and the image for normalisation
+        self.rgbStats = None
+        self.imgStats = None
         self.desc = ""
+        # the image is rendered by a Renderer, possibly in a background thread. Each call to display() increments
+        # displayCount, which distinguishes requests for different images; frame is the last image rendered.
+        self.displayCount = 0
+        self.frame = None
+        self.renderer = canvasrender.Renderer(self)
+        self.renderer.ready.connect(self.frameReady)
+        self.renderer.failed.connect(lambda s: ui.error(f"Cannot draw image: {s}", tb=False))
         self.zoomscale = 1
         self.scale = 1
         self.cursorX = 0  # coords of cursor in image space
@@ -175,24 +190,6 @@ class InnerCanvas(QtWidgets.QWidget):
         self.setCursor(InnerCanvas.getCursor())
         self.reset()
 
-    def img2qimage(self, img):
-        """convert a cv/numpy image to a Qt image. input must be 3 channels, 0-1 floats.
-        Ugly attempt at a hack - there appears to be a bug in Pyside whereby the underlying
-        image is a temporary but Qt thinks it's permanent. This bug will be fixed in Pyside 5.15.4 -
-        I think it's this: https://bugreports.qt.io/browse/PYSIDE-1563
-
-        Workaround - stash the original image in a field so it sticks around.
-
-        Repro: set an input. Set a rect on the input. Set an expr on the rect (I use a*0.5).
-        Click around, opening and closing tabs in various ways.
-        """
-        self.origimg = (img * 256).clip(max=255).astype(np.ubyte)
-        height, width, channel = self.origimg.shape
-        assert channel == 3
-        bytesPerLine = 3 * width
-        return QImage(self.origimg.data, width, height,
-                      bytesPerLine, QImage.Format_RGB888)
-
     @classmethod
     def getCursor(cls):
         """Get the custom cursor"""
@@ -255,6 +252,12 @@ class InnerCanvas(QtWidgets.QWidget):
                 self.flashCycle = 1 - self.flashCycle
                 self.update()
 
+    def frameReady(self, frame: 'canvasrender.Frame'):
+        """Called in the main thread when the renderer has an image for us"""
+        if frame.key[0] == self.displayCount:
+            self.frame = frame
+            self.update()
+
     ## returns the graph this canvas is part of
     def getGraph(self):
         return self.canv.graph
@@ -263,6 +266,7 @@ class InnerCanvas(QtWidgets.QWidget):
         """display an image next time paintEvent happens, and update to cause that.
         Will also handle None (by doing nothing)"""
         self.imgCube = img
+        self.displayCount += 1
         if img is not None:
             self.desc = img.getDesc(self.getGraph())
 
@@ -281,30 +285,22 @@ class InnerCanvas(QtWidgets.QWidget):
             #            if self.img is None or self.img.shape[:2] != img.shape[:2]:
             #                self.reset()
             self.rgb = rgb
+            self.rgbPyramid = Pyramid(rgb) if rgb is not None else None
+            self.uncPyramid = Pyramid(img.peekUncertainty())
+            self.dqPyramid = Pyramid(img.peekDQ(), halveOr)
+            # the image or its mapping may have changed, so the normalisation ranges must be found again
+            self.rgbStats = TileStats(rgb) if rgb is not None else None
+            self.imgStats = TileStats(img.img)
         else:
             self.rgb = None
+            self.rgbPyramid = self.uncPyramid = self.dqPyramid = None
+            self.rgbStats = self.imgStats = None
+            self.frame = None
+            self.renderer.cancel()
             self.reset()
         self.setOverlayRadius()
         self.update()
 
-    def drawCursor(self, img, cutx, cuty):
-        """"highlight the pixel under the cursor, but only if the cut canvas area is
-        small enough that there's any point (it's a slow operation!)
-        img: the "cut" region in the image; i.e. the part of the image being displayed.
-        cutx,cuty: the top left of the 'cut' region in the image"""
-
-        if min(self.cutw, self.cuth) < 200:
-            curx, cury = self.cursorX - cutx, self.cursorY - cuty
-            if 0 <= curx < self.cutw and 0 <= cury < self.cuth:
-                img = img.copy()  # copy for drawing (to avoid trails)
-                r, g, b = img[cury, curx, :]
-                # we normally negate the point - but if it's too close to grey, do something else
-                diff = max(abs(r - 0.5), abs(g - 0.5), abs(b - 0.5))
-                if diff > 0.3:
-                    img[cury, curx, :] = (1 - r, 1 - g, 1 - b)
-                else:
-                    img[cury, curx, :] = (1, 1, 1)  # too grey; replace with white
-
     ## the paint event
     def paintEvent(self, event):
         p = QPainter(self)
@@ -332,42 +328,50 @@ class InnerCanvas(QtWidgets.QWidget):
             # get the top-left coordinate and cut the area.            
             cutx = int(self.x)
             cuty = int(self.y)
-            # get the viewable section of the RGB
-            rgbcropped = self.rgb[cuty:cuty + cuth, cutx:cutx + cutw]
-            tt.mark("rgb crop")
-
-            # now get the size of the image that was actually cut (some areas may be out of range)
-            self.cuth, self.cutw = rgbcropped.shape[:2]
-
-            # This is where we normalise according to the current normalisation
-            # scheme. We need to pass in the crop rectangle for finding the normalisation range in NormToImg mode.
-
-            #            print(f"Norm Mode: {self.canv.canvaspersist.normMode} / {self.canv.canvaspersist.normToCropped}")
-            rgbcropped = canvasnormalise.canvasNormalise(self.imgCube.img,
-                                                         rgbcropped,
-                                                         self.rgb,
-                                                         self.canv.canvaspersist.normMode,
-                                                         self.canv.canvaspersist.normToCropped,
-                                                         (cutx, cuty, self.cutw, self.cuth))
-
-            # we now apply the canvas gamma, before we apply any kind of overlay or annotation
-            gamma = self.canv.canvaspersist.gamma
-            rgbcropped = rgbcropped ** gamma if abs(gamma - 1.0) > 0.01 else rgbcropped
-
-            tt.mark("norm")
-            # Here we draw the overlays and get any extra text required
-            rgbcropped, dqtext = self.drawDQOverlays(rgbcropped, cutx, cuty, cutw, cuth)
-            tt.mark("overlay")
-
-            # draw the cursor crosshair into the image for accuracy
-            self.drawCursor(rgbcropped, cutx, cuty)
-            tt.mark("cursor")
-            # now resize the cut area up to fit the widget and draw it. Using area interpolation here:
-            # cubic produced odd artifacts on float images.
-            rgbcropped = cv.resize(rgbcropped, dsize=(int(self.cutw / scale), int(self.cuth / scale)),
-                                   interpolation=cv.INTER_AREA)
-            tt.mark("resize")
-            p.drawImage(0, 0, self.img2qimage(rgbcropped))
+            # get the size of the image that will actually be cut (some areas may be out of range)
+            self.cutw = len(range(imgw)[cutx:cutx + cutw])
+            self.cuth = len(range(imgh)[cuty:cuty + cuth])
+
+            # When zoomed out, work on the level of the image pyramid with the fewest pixels which still has
+            # at least one pixel per screen pixel, rather than on the full-resolution image.
+            level = Pyramid.levelForScale(scale, self.rgb.shape)
+            if self.imgStats is None or self.imgStats.source is not self.imgCube.img:
+                # the image's data has been replaced since it was displayed
+                self.imgStats = TileStats(self.imgCube.img)
+
+            # Everything needed to prepare the image (cut out the area in view, normalise it, apply the gamma and
+            # draw the DQ overlays, then resize it to fit the widget) - see canvasrender.py
+            persist = self.canv.canvaspersist
+            req = canvasrender.RenderRequest(self.displayCount, self.rgb, self.imgCube.img, self.imgCube.channels,
+                                             self.rgbPyramid, self.uncPyramid, self.dqPyramid,
+                                             self.rgbStats, self.imgStats,
+                                             level, (cutx, cuty, self.cutw, self.cuth),
+                                             (int(self.cutw / scale), int(self.cuth / scale)),
+                                             persist.normMode, persist.normToCropped, persist.gamma,
+                                             persist.dqs, self.canv.isDQHidden, self.flashCycle,
+                                             (self.cursorX, self.cursorY))
+            if pcot.config.data.canvas.backgroundrender:
+                # Start rendering it in the background unless we have it already (or are rendering it already).
+                # Until it's ready we show the last image we rendered, which may be a preview or of a different view.
+                if (self.frame is None or self.frame.key != req.key or not self.frame.final) and \
+                        self.renderer.pendingKey != req.key:
+                    self.renderer.request(req)
+            else:
+                self.frame = canvasrender.render(req)
+            tt.mark("render")
+
+            if self.frame is not None:
+                if self.frame.key == req.key:
+                    p.drawImage(0, 0, self.frame.qimage)
+                else:
+                    # draw an out of date image where the area it shows is in the current view
+                    fx, fy, fw, fh = self.frame.rect
+                    p.drawImage(QtCore.QRectF((fx - cutx) / scale, (fy - cuty) / scale, fw / scale, fh / scale),
+                                self.frame.qimage)
+                dqtext = self.frame.dqtext
+                self.redrawOnTick = self.frame.redrawOnTick
+            else:
+                dqtext = ""
             tt.mark("draw image")
 
             # draw annotations (and ROIs, which are annotations too)
@@ -409,127 +413,6 @@ class InnerCanvas(QtWidgets.QWidget):
             self.scale = 1
         p.end()
 
-    def drawDQOverlays(self, img, cutx, cuty, cutw, cuth) -> Tuple[np.ndarray, str]:
-        """Draw the DQ overlays onto the RGB image img, which has already been cropped down to
-        cutx,cuty,cutw,cuth. That cropping will need to be done on other data.
-
-        It may be necessary to add code to handle missing / NA data. I'd rather not do that here
-        for speed; we should just set the uncertainty to zero elsewhere for no data.
-
-        We return the modified image and any extra text that gets tacked onto the descriptor"""
-
-        txt = ""
-        self.redrawOnTick = False
-
-        if self.canv.isDQHidden:  # are DQs temporarily disabled?
-            return img, txt
-
-        t = Timer("DQ", enabled=False)
-        for d in self.canv.canvaspersist.dqs:
-            if d.isActive():
-                if d.data == canvasdq.DTypeUnc or d.data == canvasdq.DTypeUncGtThresh or \
-                        d.data == canvasdq.DTypeUncLtThresh:
-                    # we're viewing uncertainty data, so cut out the relevant area
-                    data = self.imgCube.uncertainty[cuty:cuty + cuth, cutx:cutx + cutw]
-                    # and process it
-                    if d.stype == canvasdq.STypeMaxAll:
-                        # single-channel vs multichannel images.
-                        if self.imgCube.channels > 1:
-                            data = np.amax(data, axis=2)  # a bit slow
-                    elif d.stype == canvasdq.STypeSumAll:
-                        if self.imgCube.channels > 1:
-                            data = np.sum(data, axis=2)  # a bit slot
-                    else:
-                        if self.imgCube.channels > 1:
-                            data = data[:, :, d.channel]
-                    # now we have the uncertainty data, threshold if that's what's wanted.
-                    if d.data == canvasdq.DTypeUncGtThresh:
-                        data = (data > d.thresh).astype(np.float32)
-                    elif d.data == canvasdq.DTypeUncLtThresh:
-                        data = (data < d.thresh).astype(np.float32)
-                    else:
-                        # otherwise normalize
-                        mn = np.min(data)
-                        rng = np.max(data) - mn
-                        txt = f": RANGE {mn:0.3f}, {np.max(data):0.3f}"
-                        if rng > 0.0000001:
-                            data = (data - mn) / rng
-                        else:
-                            data = np.zeros(data.shape, dtype=float)
-                    mask = data > 0  # we'll need to mask the bits where there's a value present for later.
-                elif d.data > 0:
-                    # otherwise it's a DQ bit (or BAD dq bits), so cut that out
-                    data = self.imgCube.dq[cuty:cuty + cuth, cutx:cutx + cutw]
-                    t.mark("cut")
-                    if self.imgCube.channels > 1:
-                        # we can leave single channel images alone
-                        if d.stype == canvasdq.STypeMaxAll or d.stype == canvasdq.STypeSumAll:
-                            # union all channels
-                            data = np.bitwise_or.reduce(data, axis=2)
-                        else:
-                            # or extract relevant channel
-                            data = data[:, :, d.channel]
-                    t.mark("or/extract")
-                    # extract the relevant bit(s). This should work with BAD too, which would
-                    # give a selection of bits. Remember that 'data' is a slice; we musn't
-                    # modify it!
-                    data = np.bitwise_and(data, d.data)
-                    mask = data > 0  # which pixels have the bit set
-                    t.mark("and")
-                    # now convert that to float, setting nonzero to 1 and zero to 0.
-                    data = mask.astype(np.float32)
-                    t.mark("tofloat")
-                else:
-                    data = None
-                    mask = None
-
-                # expand the data to RGB, but in different ways depending on the colour!
-                r, g, b, flash = canvasdq.colours[d.col]
-                if flash:
-                    self.redrawOnTick = True
-                # avoiding the creating of new arrays where we can.
-
-                if (not flash or self.flashCycle) and data is not None:
-                    zeroes = np.zeros(data.shape, dtype=float)
-                    data = data ** 2 * d.contrast
-                    t.mark("contrast")
-                    # set the data opacity
-                    data *= 1 - d.trans
-                    t.mark("mult")
-                    # here we 'tint' the data
-                    r = data if r > 0.5 else zeroes
-                    g = data if g > 0.5 else zeroes
-                    b = data if b > 0.5 else zeroes
-                    data = np.dstack((r, g, b))  # data is now RGB
-                    # combine with image, avoiding copies.
-                    t.mark("stack")
-                    # additive or "normal" blending
-                    if d.additive:
-                        # if additive:
-                        #   if showing uncertainty we add the colour to the image value
-                        #   if showing DQ we add the colour to the image value when DQ bit is set
-                        np.add(data, img, out=data)
-                        t.mark("add")
-                    else:
-                        # if we're not additive:
-                        #   if showing uncertainty we replace the image value when unc>0
-                        #   if showing DQ we replace the image value when DQ bit is set
-                        mask = np.dstack([mask, mask, mask]).astype(np.bool8)
-                        # img is the original image. Mask so only the bits we want to set get changed.
-                        img = np.ma.masked_array(img, ~mask)
-                        img *= d.trans
-                        img += data
-                        data = img.data  # remove mask
-                        t.mark("blend")
-                    # clip the data (mainly because of additive, but just in case other
-                    # stuff has happened)
-                    # The line below is faster than the standard np.clip(data, 0, 1, out=data)
-                    # https://janhendrikewers.uk/exploring_faster_np_clip.html
-                    np.core.umath.maximum(np.core.umath.minimum(data, 1), 0, out=data)
-                    t.mark("clip")
-                    img = data
-        return img, txt
-
     def setOverlayRadius(self):
         rad = (self.canv.canvaspersist.specCursorSize+0.5) / self.getScale()
         self.specOverlay.set_radius(rad)
@@ -0,0 +1,398 @@
+"""
+Preparing the image shown in a canvas.
+
+The part of the image in view is cut from the appropriate level of the image pyramids (see utils.pyramid),
+normalised, gamma-corrected, has the DQ overlays drawn onto it and is resized to fit the widget. A
+RenderRequest holds everything needed to do this, so it can be done away from the canvas - and in particular
+in a background thread by a Renderer, so that the UI doesn't block while a large image is prepared.
+The annotations are drawn by the canvas itself on top of the resulting QImage.
+"""
+
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional, Tuple, List, Callable
+
+import cv2 as cv
+import numpy as np
+from PySide2.QtCore import QObject, Signal
+from PySide2.QtGui import QImage
+
+from pcot import canvasnormalise
+from pcot.ui import canvasdq
+from pcot.ui.canvasdq import CanvasDQSpec
+from pcot.utils.deb import Timer
+from pcot.utils.pyramid import Pyramid
+from pcot.utils.tilestats import TileStats
+
+logger = logging.getLogger(__name__)
+
+# how many levels coarser than the final image a preview is drawn from
+PREVIEW_LEVELS = 2
+
+
+class RenderRequest:
+    """Everything needed to prepare the canvas image for a particular view of an image. The DQ specs are
+    copied, so the request isn't affected if they are changed in the UI while it is being rendered."""
+
+    def __init__(self, displayCount: int, rgb: np.ndarray, img: np.ndarray, channels: int,
+                 rgbPyramid: Pyramid, uncPyramid: Pyramid, dqPyramid: Pyramid,
+                 rgbStats: TileStats, imgStats: TileStats,
+                 level: int, rect: Tuple[int, int, int, int], dsize: Tuple[int, int],
+                 normMode: int, normToCropped: bool, gamma: float,
+                 dqs: List[CanvasDQSpec], dqHidden: bool, flashCycle: bool,
+                 cursor: Optional[Tuple[int, int]]):
+        self.displayCount = displayCount  # changes whenever a new image is displayed
+        self.rgb = rgb
+        self.img = img
+        self.channels = channels
+        self.rgbPyramid = rgbPyramid
+        self.uncPyramid = uncPyramid
+        self.dqPyramid = dqPyramid
+        self.rgbStats = rgbStats
+        self.imgStats = imgStats
+        self.level = level  # the pyramid level we draw from
+        self.rect = rect  # the region in view, in full size image coordinates (clipped to the image)
+        self.dsize = dsize  # the size of the final image in widget pixels
+        self.normMode = normMode
+        self.normToCropped = normToCropped
+        self.gamma = gamma
+        self.dqs = [CanvasDQSpec(d.serialise()) for d in dqs]
+        self.dqHidden = dqHidden
+        self.flashCycle = flashCycle
+        # the cursor position, but only if the view is small enough for drawCursor to use it
+        self.cursor = cursor if min(rect[2], rect[3]) < 200 else None
+        self.preview = False
+        self.key = (displayCount, level, rect, dsize, normMode, normToCropped, gamma,
+                    tuple(tuple(d.serialise().values()) for d in self.dqs), dqHidden, flashCycle, self.cursor)
+
+    def stats(self) -> Optional[TileStats]:
+        """The statistics the normalisation mode uses, if any"""
+        if self.normMode == canvasnormalise.NormToImg:
+            return self.imgStats
+        elif self.normMode in (canvasnormalise.NormToRGB, canvasnormalise.NormSeparately):
+            return self.rgbStats
+        return None
+
+    def statsNeedBuilding(self) -> bool:
+        """True if normalising means building the statistics first, which is a scan of the whole image"""
+        stats = self.stats()
+        return stats is not None and stats.needsBuild(self.rect if self.normToCropped else None)
+
+    def previewRequest(self) -> Optional['RenderRequest']:
+        """Return a copy of this request which draws a quick low-resolution preview, or None if there's
+        no point because the data this request needs has already been calculated."""
+        if self.rgbPyramid.hasLevel(self.level) and not self.statsNeedBuilding():
+            return None
+        maxLevel = Pyramid.maxLevel(self.rgb.shape)
+        if self.level >= maxLevel:
+            return None
+        r = RenderRequest.__new__(RenderRequest)
+        r.__dict__.update(self.__dict__)
+        r.level = min(maxLevel, self.level + PREVIEW_LEVELS)
+        r.cursor = None
+        r.preview = True
+        return r
+
+    def levelOf(self, pyramid: Pyramid, level: int) -> np.ndarray:
+        """Get a level of a pyramid - or for a preview, just take every nth pixel of the full size
+        image, which is much quicker than building the level if it isn't there already."""
+        if self.preview:
+            f = 1 << level
+            return pyramid.base[::f, ::f]
+        return pyramid.level(level)
+
+    def crop(self, pyramid: Pyramid, level: int) -> np.ndarray:
+        """Cut the region in view out of a pyramid level"""
+        return Pyramid.crop(self.levelOf(pyramid, level), level, *self.rect)
+
+
+class Frame:
+    """A rendered canvas image"""
+
+    def __init__(self, key, rect: Tuple[int, int, int, int], qimage: QImage, arr: np.ndarray, dqtext: str,
+                 redrawOnTick: bool, final: bool):
+        self.key = key  # the key of the request it was made for
+        self.rect = rect  # the area of the image it shows
+        self.qimage = qimage
+        self.arr = arr  # the array the QImage uses, which must be kept alive
+        self.dqtext = dqtext  # extra text for the descriptor
+        self.redrawOnTick = redrawOnTick  # true if there are flashing DQ overlays
+        self.final = final  # false if this is a preview
+
+
+def img2qimage(img: np.ndarray) -> Tuple[QImage, np.ndarray]:
+    """convert a cv/numpy image to a Qt image. input must be 3 channels, 0-1 floats.
+    The QImage doesn't own its data, so we return the array it uses too; this must be kept for as long as
+    the QImage is (see PYSIDE-1563)."""
+    arr = (img * 256).clip(max=255).astype(np.ubyte)
+    height, width, channel = arr.shape
+    assert channel == 3
+    bytesPerLine = 3 * width
+    return QImage(arr.data, width, height, bytesPerLine, QImage.Format_RGB888), arr
+
+
+def drawCursor(img, cutx, cuty, cutw, cuth, cursor) -> np.ndarray:
+    """"highlight the pixel under the cursor, but only if the cut canvas area is
+    small enough that there's any point (it's a slow operation!)
+    img: the "cut" region in the image; i.e. the part of the image being displayed.
+    cutx,cuty: the top left of the 'cut' region in the image
+    Returns the image with the cursor drawn, which is a copy if anything was drawn."""
+
+    if min(cutw, cuth) < 200:
+        curx, cury = cursor[0] - cutx, cursor[1] - cuty
+        if 0 <= curx < cutw and 0 <= cury < cuth:
+            img = img.copy()  # copy for drawing (to avoid trails)
+            r, g, b = img[cury, curx, :]
+            # we normally negate the point - but if it's too close to grey, do something else
+            diff = max(abs(r - 0.5), abs(g - 0.5), abs(b - 0.5))
+            if diff > 0.3:
+                img[cury, curx, :] = (1 - r, 1 - g, 1 - b)
+            else:
+                img[cury, curx, :] = (1, 1, 1)  # too grey; replace with white
+    return img
+
+
+def drawDQOverlays(img, req: RenderRequest, level: int) -> Tuple[np.ndarray, str, bool]:
+    """Draw the DQ overlays onto the RGB image img, which has already been cropped down to
+    the request's rectangle in the given pyramid level. That cropping will need to be done on other data.
+
+    It may be necessary to add code to handle missing / NA data. I'd rather not do that here
+    for speed; we should just set the uncertainty to zero elsewhere for no data.
+
+    We return the modified image, any extra text that gets tacked onto the descriptor and whether
+    there are flashing overlays (so the canvas should redraw regularly)"""
+
+    txt = ""
+    redrawOnTick = False
+
+    if req.dqHidden:  # are DQs temporarily disabled?
+        return img, txt, redrawOnTick
+
+    t = Timer("DQ", enabled=False)
+    for d in req.dqs:
+        if d.isActive():
+            if d.data == canvasdq.DTypeUnc or d.data == canvasdq.DTypeUncGtThresh or \
+                    d.data == canvasdq.DTypeUncLtThresh:
+                # we're viewing uncertainty data, so cut out the relevant area
+                data = req.crop(req.uncPyramid, level)
+                # and process it
+                if d.stype == canvasdq.STypeMaxAll:
+                    # single-channel vs multichannel images.
+                    if req.channels > 1:
+                        data = np.amax(data, axis=2)  # a bit slow
+                elif d.stype == canvasdq.STypeSumAll:
+                    if req.channels > 1:
+                        data = np.sum(data, axis=2)  # a bit slot
+                else:
+                    if req.channels > 1:
+                        data = data[:, :, d.channel]
+                # now we have the uncertainty data, threshold if that's what's wanted.
+                if d.data == canvasdq.DTypeUncGtThresh:
+                    data = (data > d.thresh).astype(np.float32)
+                elif d.data == canvasdq.DTypeUncLtThresh:
+                    data = (data < d.thresh).astype(np.float32)
+                else:
+                    # otherwise normalize
+                    mn = np.min(data)
+                    rng = np.max(data) - mn
+                    txt = f": RANGE {mn:0.3f}, {np.max(data):0.3f}"
+                    if rng > 0.0000001:
+                        data = (data - mn) / rng
+                    else:
+                        data = np.zeros(data.shape, dtype=float)
+                mask = data > 0  # we'll need to mask the bits where there's a value present for later.
+            elif d.data > 0:
+                # otherwise it's a DQ bit (or BAD dq bits), so cut that out
+                data = req.crop(req.dqPyramid, level)
+                t.mark("cut")
+                if req.channels > 1:
+                    # we can leave single channel images alone
+                    if d.stype == canvasdq.STypeMaxAll or d.stype == canvasdq.STypeSumAll:
+                        # union all channels
+                        data = np.bitwise_or.reduce(data, axis=2)
+                    else:
+                        # or extract relevant channel
+                        data = data[:, :, d.channel]
+                t.mark("or/extract")
+                # extract the relevant bit(s). This should work with BAD too, which would
+                # give a selection of bits. Remember that 'data' is a slice; we musn't
+                # modify it!
+                data = np.bitwise_and(data, d.data)
+                mask = data > 0  # which pixels have the bit set
+                t.mark("and")
+                # now convert that to float, setting nonzero to 1 and zero to 0.
+                data = mask.astype(np.float32)
+                t.mark("tofloat")
+            else:
+                data = None
+                mask = None
+
+            # expand the data to RGB, but in different ways depending on the colour!
+            r, g, b, flash = canvasdq.colours[d.col]
+            if flash:
+                redrawOnTick = True
+            # avoiding the creating of new arrays where we can.
+
+            if (not flash or req.flashCycle) and data is not None:
+                zeroes = np.zeros(data.shape, dtype=float)
+                data = data ** 2 * d.contrast
+                t.mark("contrast")
+                # set the data opacity
+                data *= 1 - d.trans
+                t.mark("mult")
+                # here we 'tint' the data
+                r = data if r > 0.5 else zeroes
+                g = data if g > 0.5 else zeroes
+                b = data if b > 0.5 else zeroes
+                data = np.dstack((r, g, b))  # data is now RGB
+                # combine with image, avoiding copies.
+                t.mark("stack")
+                # additive or "normal" blending
+                if d.additive:
+                    # if additive:
+                    #   if showing uncertainty we add the colour to the image value
+                    #   if showing DQ we add the colour to the image value when DQ bit is set
+                    np.add(data, img, out=data)
+                    t.mark("add")
+                else:
+                    # if we're not additive:
+                    #   if showing uncertainty we replace the image value when unc>0
+                    #   if showing DQ we replace the image value when DQ bit is set
+                    mask = np.dstack([mask, mask, mask]).astype(bool)
+                    # img is the original image. Mask so only the bits we want to set get changed.
+                    img = np.ma.masked_array(img, ~mask)
+                    img *= d.trans
+                    img += data
+                    data = img.data  # remove mask
+                    t.mark("blend")
+                # clip the data (mainly because of additive, but just in case other
+                # stuff has happened)
+                # The line below is faster than the standard np.clip(data, 0, 1, out=data)
+                # https://janhendrikewers.uk/exploring_faster_np_clip.html
+                np.core.umath.maximum(np.core.umath.minimum(data, 1), 0, out=data)
+                t.mark("clip")
+                img = data
+    return img, txt, redrawOnTick
+
+
+def render(req: RenderRequest, stale: Optional[Callable[[], bool]] = None) -> Optional[Frame]:
+    """Prepare the image for a request. If stale is given, it is called between the stages of the work and
+    if it returns true the request is abandoned and None is returned."""
+    tt = Timer("render", enabled=False)
+    cutx, cuty, cutw, cuth = req.rect
+    level = req.level
+    # get the viewable section of the RGB
+    rgbcropped = req.crop(req.rgbPyramid, level)
+    tt.mark("rgb crop")
+    if stale is not None and stale():
+        return None
+
+    # This is where we normalise according to the current normalisation
+    # scheme. We need to pass in the crop rectangle for finding the normalisation range in NormToImg mode.
+    if req.preview and req.statsNeedBuilding():
+        # find the range from every nth pixel of the images, rather than building the statistics
+        f = 1 << level
+        rect = (cutx // f, cuty // f, -(-(cutx + cutw) // f) - cutx // f, -(-(cuty + cuth) // f) - cuty // f)
+        rgbcropped = canvasnormalise.canvasNormalise(req.img[::f, ::f], rgbcropped, req.rgb[::f, ::f],
+                                                     req.normMode, req.normToCropped, rect)
+    else:
+        rgbcropped = canvasnormalise.canvasNormalise(req.img, rgbcropped, req.rgb,
+                                                     req.normMode, req.normToCropped, req.rect,
+                                                     req.rgbStats, req.imgStats)
+
+    # we now apply the canvas gamma, before we apply any kind of overlay or annotation
+    gamma = req.gamma
+    rgbcropped = rgbcropped ** gamma if abs(gamma - 1.0) > 0.01 else rgbcropped
+
+    tt.mark("norm")
+    if stale is not None and stale():
+        return None
+    # Here we draw the overlays and get any extra text required
+    rgbcropped, dqtext, redrawOnTick = drawDQOverlays(rgbcropped, req, level)
+    tt.mark("overlay")
+    if stale is not None and stale():
+        return None
+
+    # draw the cursor crosshair into the image for accuracy (only if we're showing every pixel)
+    if level == 0 and req.cursor is not None:
+        rgbcropped = drawCursor(rgbcropped, cutx, cuty, cutw, cuth, req.cursor)
+    tt.mark("cursor")
+    # now resize the cut area up to fit the widget. Using area interpolation here:
+    # cubic produced odd artifacts on float images.
+    rgbcropped = cv.resize(rgbcropped, dsize=req.dsize, interpolation=cv.INTER_AREA)
+    tt.mark("resize")
+    if stale is not None and stale():
+        return None
+    qimage, arr = img2qimage(rgbcropped)
+    return Frame(req.key, req.rect, qimage, arr, dqtext, redrawOnTick, not req.preview)
+
+
+# the thread in which all canvases render their images, created when first needed
+_executor: Optional[ThreadPoolExecutor] = None
+
+
+class Renderer(QObject):
+    """Renders a canvas's images in a background thread. Each new request makes any earlier requests
+    stale: they are abandoned as soon as possible, and their results are never delivered. For a request
+    which needs data which hasn't been calculated yet (a new pyramid level, or normalisation statistics),
+    a low resolution preview is delivered first. Results are delivered to the main thread by the ready
+    signal, and errors by the failed signal. pendingKey is the key of the request being rendered, if any."""
+
+    ready = Signal(object)
+    failed = Signal(str)
+
+    # sent from the worker thread, with the generation of the request; received in the main thread
+    _rendered = Signal(int, object)
+    _error = Signal(int, str)
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.generation = 0
+        self.pendingKey = None
+        self._rendered.connect(self._deliver)
+        self._error.connect(self._fail)
+
+    def request(self, req: RenderRequest):
+        """Start rendering a request, cancelling any previous requests"""
+        global _executor
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="pcot-render")
+        self.generation += 1
+        self.pendingKey = req.key
+        _executor.submit(self._run, self.generation, req)
+
+    def cancel(self):
+        """Cancel any requests in progress"""
+        self.generation += 1
+        self.pendingKey = None
+
+    def _run(self, generation: int, req: RenderRequest):
+        """Runs in the worker thread"""
+        def stale():
+            return generation != self.generation  # a newer request has been made
+
+        try:
+            for r in (req.previewRequest(), req):
+                if stale():
+                    return
+                if r is not None:
+                    frame = render(r, stale)
+                    if frame is not None:
+                        self._rendered.emit(generation, frame)
+        except Exception as e:
+            logger.exception("Error rendering canvas image")
+            self._error.emit(generation, str(e))
+
+    def _deliver(self, generation: int, frame: Frame):
+        """Runs in the main thread when a frame has been rendered. Checking the generation here, rather than
+        in the worker, means a request can't be made between the check and the delivery."""
+        if generation == self.generation:
+            if frame.final:
+                self.pendingKey = None
+            self.ready.emit(frame)
+
+    def _fail(self, generation: int, msg: str):
+        """Runs in the main thread when rendering has failed"""
+        if generation == self.generation:
+            self.pendingKey = None
+            self.failed.emit(msg)
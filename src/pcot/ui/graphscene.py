@@ -3,7 +3,7 @@ which represents the objects in an XFormGraph.
 """
 import logging
 import math
-from typing import List, Optional
+from typing import List, Optional, TYPE_CHECKING
 
 from PySide2 import QtWidgets, QtGui
 from PySide2.QtCore import Qt, QPointF
@@ -14,9 +14,12 @@ import pcot.datum as datum
 import pcot.ui as ui
 import pcot.ui.namedialog
 import pcot.utils.deb
-from pcot.xform import XForm, XFormGraph
 import pcot.xform
 
+if TYPE_CHECKING:
+    # not imported at run time, because pcot.xform imports this module and may not be initialised yet
+    from pcot.xform import XForm, XFormGraph
+
 # do we have the Grandalf package for automatic graph layout?
 from pcot import connbrushes
 
@@ -134,7 +137,7 @@ class GMainRect(QtWidgets.QGraphicsRectItem):
     offsetx: int
     offsety: int
     helprect: GHelpRect  # help rectangle (top-right corner)
-    node: XForm  # node to which I refer
+    node: 'XForm'  # node to which I refer
     text: GText  # text field
     aboutToMove: bool  # true when the item is clicked; the first move after this will cause a mark and clear this flag
     resizing: bool  # we are resizing; mutually exclusive with aboutToMove
@@ -211,7 +214,7 @@ class GMainRect(QtWidgets.QGraphicsRectItem):
         if event.modifiers() & Qt.ControlModifier:
             # running the performNodes will actually _delete_ this object, so we don't call
             # the superclass handler in this case.
-            ui.log(f"Running node {self.node}, autorun={XFormGraph.autoRun}")
+            ui.log(f"Running node {self.node}, autorun={pcot.xform.XFormGraph.autoRun}")
             self.node.graph.performNodes(self.node)
             self.aboutToMove = True
         else:
@@ -329,7 +332,7 @@ class GMainRect(QtWidgets.QGraphicsRectItem):
 class GConnectRect(QtWidgets.QGraphicsRectItem):
     """connection rectangles at top and bottom of node"""
     isInput: bool  # true if this is an input
-    node: XForm  # the node I'm on
+    node: 'XForm'  # the node I'm on
     index: int  # the index of the input/output
     name: str  # the name shown next to the rect (could be "")
 
@@ -406,9 +409,9 @@ class GConnectRect(QtWidgets.QGraphicsRectItem):
 class GArrow(QtWidgets.QGraphicsLineItem):
     """a line with an arrow on the end, connecting two nodes"""
     # "from" xform node
-    n1: XForm
+    n1: 'XForm'
     # "to" xform node
-    n2: XForm
+    n2: 'XForm'
     # index of output in n1
     output: int
     # index of input in n2
@@ -553,9 +556,9 @@ def makeNodeGraphics(n):
 class XFormGraphScene(QtWidgets.QGraphicsScene):
     """The custom scene. Note that when serializing the nodes, the geometry fields should be dealt with."""
     # the graph I represent
-    graph: XFormGraph
+    graph: 'XFormGraph'
     # selected nodes
-    selection: List[XForm]
+    selection: List['XForm']
     # check selected nodes if the selection changes
     checkSelChange: bool
     # list of arrows
@@ -565,7 +568,7 @@ class XFormGraphScene(QtWidgets.QGraphicsScene):
     # delete keys are ignored and passed down to Items because we're editing text in a node
     lockDeleteKeys: bool
     # performing this node right now
-    performing_node: Optional[XForm]
+    performing_node: Optional['XForm']
 
     def __init__(self, graph, doPlace):
         """initialise to a graph, and do autolayout if doPlace is true"""
@@ -584,13 +587,13 @@ class XFormGraphScene(QtWidgets.QGraphicsScene):
         # and make all the graphics
         self.rebuild()
 
-    def performing(self, n: Optional[XForm]):
+    def performing(self, n: Optional['XForm']):
         """Used in XForm.perform, this marks the performing node (or none) and changes the rectangle
         for that node. It then forces an immediate graphics update by processing events."""
 
         self.performing_node = n
         # we also mark all child nodes (and us) as outdated.
-        def mark_outdated(nn: XForm):
+        def mark_outdated(nn: 'XForm'):
             nn.outdated = True
             for child in nn.children:
                 mark_outdated(child)
@@ -26,8 +26,8 @@ import pcot.ui.namedialog as namedialog
 import pcot.ui.tabs as tabs
 import pcot.xform as xform
 import pcot.assets
-from pcot.ui.help import HelpWindow
-from pcot.ui.importdialog import ImportDialog
+import pcot.ui.help
+import pcot.ui.importdialog
 from pcot.utils import SignalBlocker
 from pcot.utils.table import Table
 
@@ -75,7 +75,7 @@ class MainUI(ui.tabs.DockableTabWindow):
 
     ## @var palette
     # the node palette on the right
-    palette: palette.Palette
+    palette: 'palette.Palette'
 
     # (most UI elements omitted)
 
@@ -547,7 +547,7 @@ class MainUI(ui.tabs.DockableTabWindow):
             doc = document.Document()
             doc.load(res[0], add_to_recents=False)
             # open the dialog
-            dlg = ImportDialog(doc)
+            dlg = pcot.ui.importdialog.ImportDialog(doc)
             dlg.exec_()
             self.doc.importFrom(doc, dlg.macstoimport, dlg.favstoimport)
 
@@ -664,7 +664,7 @@ class MainUI(ui.tabs.DockableTabWindow):
     def openHelp(self, tp, node=None):
         if tp.helpwin is not None:
             tp.helpwin.close()  # close existing window you may have left open :)
-        win = HelpWindow(self, tp=tp, node=node)
+        win = pcot.ui.help.HelpWindow(self, tp=tp, node=node)
 
     ## add a macro connector, only should be used on macro prototypes   
     def addMacroConnector(self, tp, displayName=None):
@@ -1,27 +1,46 @@
 import logging
 
-from PySide2.QtCore import Qt, QRect, QPoint, QPointF
-from PySide2.QtGui import QPainter, QFont, QFontMetrics, QPen, QColor
-from typing import Callable, Tuple, Optional
+from typing import Callable, Tuple, Optional, TYPE_CHECKING
 
-# use this font for annotations
 from pcot import ui
 from pcot.utils.colour import rgb2qcol
 
+if TYPE_CHECKING:
+    # Qt is only imported when annotations are actually drawn
+    from PySide2.QtGui import QPainter, QFont
+
 logger = logging.getLogger(__name__)
 
-annotFont = QFont()
-annotFont.setFamily('Sans Serif')
+# use this font for annotations - it's created by annotationFont() when it's first needed.
+_annotFont = None
+
+
+def annotationFont() -> 'QFont':
+    """Get the font used for annotations"""
+    global _annotFont
+    if _annotFont is None:
+        from PySide2.QtGui import QFont
+        _annotFont = QFont()
+        _annotFont.setFamily('Sans Serif')
+    return _annotFont
+
+
+def __getattr__(name):
+    # annotFont is the same font, for code which imports it by name
+    if name == 'annotFont':
+        return annotationFont()
+    raise AttributeError(f"module {__name__} has no attribute {name}")
+
 
 # I'm pretty sure this is now unecessary.
-def UNUSED_pixels2painter(v, p: QPainter):
+def UNUSED_pixels2painter(v, p: 'QPainter'):
     """Given a size value in pixels, get what the painter size should be (i.e. take account of scaling)"""
     sc = p.worldTransform().m11()
     logger.info(f"Scale factor {sc}")
     return v/sc
 
 
-def annotDrawText(p: QPainter,
+def annotDrawText(p: 'QPainter',
                   x, y, s,
                   col: Tuple[float] = (1, 1, 0),
                   alpha: float = 1.0,
@@ -29,6 +48,10 @@ def annotDrawText(p: QPainter,
                   bgcol: Optional[Tuple] = None,
                   fontsize=15):
     """Draw text for annotation. Coords must be in painter space."""
+    from PySide2.QtCore import QRect, QPoint
+    from PySide2.QtGui import QFontMetrics, QPen
+
+    annotFont = annotationFont()
     pen = QPen(rgb2qcol(col, alpha=alpha))
     pen.setWidth(0)
     p.setPen(pen)
@@ -66,7 +89,7 @@ class Annotation:
         a tuple (top, right, bottom, left) of minimum margin sizes in inches."""
         return 0, 0, 0, 0
 
-    def annotate(self, p: QPainter, img, alpha):
+    def annotate(self, p: 'QPainter', img, alpha):
         """
         Draw the annotation
         Parameters:
@@ -75,7 +98,7 @@ class Annotation:
         """
         pass
 
-    def annotatePDF(self, p: QPainter, img):
+    def annotatePDF(self, p: 'QPainter', img):
         """This method is called when we're annotating a PDF or PDF preview. It will be
         called IN ADDITION to annotate() but in a different coordinate system.
         It has the same parameters as annotate().
@@ -99,7 +122,11 @@ class IndexedPointAnnotation(Annotation):
         self.issel = issel
         self.idx = idx
 
-    def annotate(self, p: QPainter, img, alpha):
+    def annotate(self, p: 'QPainter', img, alpha):
+        from PySide2.QtCore import QPointF
+        from PySide2.QtGui import QColor, QPen
+
+        annotFont = annotationFont()
         # modify the qcol by the alpha
         col = QColor(self.col)
         col.setAlpha(alpha*255)
@@ -2,8 +2,15 @@ import json
 import datetime
 import dataclasses
 import getpass
+import os
+import struct
+import sys
+import threading
+import time
+import zlib
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-from typing import Callable, Union
+from typing import Callable, Dict, List, Optional, Tuple, Union
 from dataclasses import dataclass
 from enum import Enum
 
@@ -35,6 +42,45 @@ def _getdate():
     return datetime.datetime.now().isoformat()
 
 
+def _archiveConfig():
+    # import here for the same reason as above
+    import pcot.config
+    return pcot.config.data.archives
+
+
+# Arrays stored uncompressed start at a multiple of this many bytes in the file. np.save pads its header
+# to a multiple of 64 bytes too, so the array data itself is aligned and can be memory-mapped efficiently.
+ARRAY_ALIGNMENT = 64
+# the ID of the zip "extra field" we use to pad the local header - it's the one used by Android's zipalign.
+_PADDING_EXTRA_ID = 0xD935
+# how much of an array we write to an uncompressed member at a time
+_WRITE_CHUNK = 16 * 1024 * 1024
+
+# Writing arrays which have been compressed in other threads, and aligning the start of stored arrays, both need
+# private parts of zipfile: there's no public way to add an already-compressed member or to find where the next
+# member will start. These are the Python versions whose zipfile we have checked; on others, arrays are
+# compressed and written one at a time and stored arrays aren't aligned (they can still be memory-mapped,
+# because FileArchive.mapArray() reads the data offset from the member's local header).
+_ZIPFILE_CHECKED_VERSIONS = ((3, 8), (3, 13))
+
+
+def _zipInternalsOK(zf: zipfile.ZipFile) -> bool:
+    """True if we can use the private parts of a ZipFile described above"""
+    lo, hi = _ZIPFILE_CHECKED_VERSIONS
+    return (lo <= sys.version_info[:2] <= hi and hasattr(zipfile, '_get_compressor')
+            and all(hasattr(zf, x) for x in ('fp', 'start_dir', '_lock', '_writecheck', '_seekable', '_didModify')))
+
+
+# The compression methods which can be used for archives, by the names used in the configuration and in
+# batch file outputs. LZMA gives the smallest files but is slow; "stored" is no compression at all.
+COMPRESSION_TYPES = {
+    'deflate': zipfile.ZIP_DEFLATED,
+    'lzma': zipfile.ZIP_LZMA,
+    'bzip2': zipfile.ZIP_BZIP2,
+    'stored': zipfile.ZIP_STORED,
+}
+
+
 @dataclasses.dataclass
 class Metadata:
     """
@@ -230,13 +276,32 @@ class Archive:
             print(xx)
 
     This is useful for serialisation/deserialisation in cut/paste operations.
+
+    The compression method and level are taken from the "archives" section of the configuration unless they
+    are given to the constructor. Arrays are compressed and decompressed in several threads, because the
+    compression libraries release the GIL; this is done when a whole structure is written or read by
+    writeJson() and readJson().
+
+    Normally arrays are compressed like everything else. If storeArrays is set (or is None and "storearrays" is
+    set in the "archives" section of the configuration) they are stored uncompressed and aligned, and a
+    FileArchive will then return them from readArray() as memory-mapped views onto the file. These are
+    copy-on-write: they can be modified, but the changes are never written back. Data is only read from the
+    file when it is used, so opening a large archive to look at one band of an image is quick.
     """
 
-    def __init__(self, mode='r', progressCallback=None):
+    def __init__(self, mode='r', progressCallback=None, storeArrays: Optional[bool] = None,
+                 compression: Optional[str] = None, level: Optional[int] = None):
         self.mode = mode
         self.arrayct = 0
         self.zip = None
         self.progressCallback = progressCallback
+        self.storeArrays = storeArrays
+        if compression is not None and compression not in COMPRESSION_TYPES:
+            raise ValueError(f"Unknown compression type {compression}")
+        self.compression = compression
+        self.level = level
+        # zipfile doesn't protect its count of open members when several threads read at once
+        self.readLock = threading.Lock()
         self.path = "(memory?)"
         # no metadata to start with - when we open, one will either be created or loaded if this
         # is a FileArchive - otherwise there may never be one.
@@ -260,6 +325,29 @@ class Archive:
     def is_writable(self):
         return self.mode in ['w', 'a']
 
+    def compressType(self) -> int:
+        """The zipfile compression type used for new members"""
+        return COMPRESSION_TYPES[self.compression or _archiveConfig().compression]
+
+    def compressLevel(self) -> Optional[int]:
+        """The compression level used for new members (or None where it doesn't apply)"""
+        tp = self.compressType()
+        level = self.level if self.level is not None else _archiveConfig().level
+        if tp == zipfile.ZIP_DEFLATED:
+            return level
+        elif tp == zipfile.ZIP_BZIP2:
+            return max(1, level)     # bzip2 levels start at 1
+        return None
+
+    @staticmethod
+    def pool(count: int) -> Optional[ThreadPoolExecutor]:
+        """Return a thread pool for compressing or decompressing a number of arrays, or None if
+        we should just do it in this thread."""
+        threads = _archiveConfig().threads or os.cpu_count() or 1
+        if count < 2 or threads < 2:
+            return None
+        return ThreadPoolExecutor(max_workers=min(threads, count), thread_name_prefix="archive")
+
     def is_open(self):
         return self.zip is not None
 
@@ -285,10 +373,108 @@ class Archive:
         if self.zip is None:
             raise Exception("Archive is not open")
         self.assert_write()
+        self.assert_unique_name(name)
+        if self.storesArray(a):
+            self.writeStoredArray(name, a)
+        else:
+            b = BytesIO()
+            np.save(b, a)
+            self.zip.writestr(name, b.getvalue())
+
+    def storesArray(self, a: np.ndarray) -> bool:
+        """True if an array will be written uncompressed by writeStoredArray"""
+        if a.dtype.hasobject:
+            return False
+        if self.compressType() == zipfile.ZIP_STORED:
+            return True
+        return self.storeArrays if self.storeArrays is not None else _archiveConfig().storearrays
+
+    def writeArrays(self, arrays: List[Tuple[str, np.ndarray]]):
+        """Write several arrays. Those which are to be compressed are compressed in parallel, and then
+        written in order (if we can - see _zipInternalsOK())."""
+        compressed = [(name, a) for name, a in arrays if not self.storesArray(a)]
+        pool = self.pool(len(compressed))
+        if pool is None or not _zipInternalsOK(self.zip) or not self.zip._seekable:
+            if pool is not None:
+                pool.shutdown()
+            for name, a in arrays:
+                self.writeArray(name, a)
+            return
+
+        self.assert_write()
+        for name, a in arrays:
+            self.assert_unique_name(name)
+            if self.storesArray(a):
+                self.writeStoredArray(name, a)
+        with pool:
+            for (name, _), data in zip(compressed, pool.map(self.compressArray, [a for _, a in compressed])):
+                self.writeCompressed(name, *data)
+
+    def compressArray(self, a: np.ndarray) -> Tuple[bytes, int, int]:
+        """Convert an array to .npy format and compress it as zipfile would, returning the compressed
+        data, the CRC and the uncompressed size. This can run in any thread."""
         b = BytesIO()
         np.save(b, a)
-        self.assert_unique_name(name)
-        self.zip.writestr(name, b.getvalue())
+        data = b.getbuffer()
+        comp = zipfile._get_compressor(self.compressType(), self.compressLevel())
+        return comp.compress(data) + comp.flush(), zlib.crc32(data), len(data)
+
+    def writeCompressed(self, name: str, data: bytes, crc: int, size: int):
+        """Add a member whose data has already been compressed by compressArray(). This does what
+        ZipFile.writestr() does, except for the compression - zipfile has no way to do that. Only call this
+        if _zipInternalsOK()."""
+        zf = self.zip
+        zinfo = zipfile.ZipInfo(name, date_time=time.localtime(time.time())[:6])
+        zinfo.compress_type = self.compressType()
+        zinfo.external_attr = 0o600 << 16
+        if zinfo.compress_type == zipfile.ZIP_LZMA:
+            zinfo.flag_bits |= 0x02     # the data has an end-of-stream marker
+        zinfo.file_size = size
+        zinfo.compress_size = len(data)
+        zinfo.CRC = crc
+        zip64 = size > zipfile.ZIP64_LIMIT or len(data) > zipfile.ZIP64_LIMIT
+        with zf._lock:
+            zf.fp.seek(zf.start_dir)
+            zinfo.header_offset = zf.fp.tell()
+            zf._writecheck(zinfo)
+            zf._didModify = True
+            zf.fp.write(zinfo.FileHeader(zip64))
+            zf.fp.write(data)
+            zf.start_dir = zf.fp.tell()
+            zf.filelist.append(zinfo)
+            zf.NameToInfo[name] = zinfo
+
+    def writeStoredArray(self, name: str, a: np.ndarray):
+        """Write an array in .npy format as an uncompressed member whose data starts at a multiple of
+        ARRAY_ALIGNMENT bytes into the file, so it can be memory-mapped. The array is written in chunks
+        rather than being converted to a single block of bytes first."""
+        header = {'descr': np.lib.format.dtype_to_descr(a.dtype), 'fortran_order': False, 'shape': a.shape}
+        zinfo = zipfile.ZipInfo(name, date_time=time.localtime(time.time())[:6])
+        zinfo.compress_type = zipfile.ZIP_STORED
+        # this is an estimate (the .npy header is small) which zipfile uses to decide whether it needs
+        # to add a ZIP64 extra field to the local header. We need to know that to work out the padding.
+        zinfo.file_size = a.nbytes + 4096
+        zip64 = zinfo.file_size * 1.05 > zipfile.ZIP64_LIMIT
+        if _zipInternalsOK(self.zip):
+            # The local header will start where the central directory currently starts; FileHeader() gives
+            # us the header zipfile will write, to which we add a padding extra field. The CRC and compressed
+            # size don't affect its length, and zipfile will zero them in open() anyway.
+            zinfo.CRC = zinfo.compress_size = 0
+            offset = self.zip.start_dir + len(zinfo.FileHeader(zip64)) + 4
+            pad = -offset % ARRAY_ALIGNMENT
+            zinfo.extra = struct.pack('<HH', _PADDING_EXTRA_ID, pad) + bytes(pad)
+
+        with self.zip.open(zinfo, 'w', force_zip64=zip64) as f:
+            try:
+                np.lib.format.write_array_header_1_0(f, header)
+            except ValueError:
+                np.lib.format.write_array_header_2_0(f, header)
+            if a.ndim == 0:
+                f.write(a.tobytes())
+            else:
+                rows = max(1, _WRITE_CHUNK // max(1, a[:1].nbytes))
+                for y in range(0, a.shape[0], rows):
+                    f.write(np.ascontiguousarray(a[y:y + rows]).data)
 
     def writeArrayAndGenerateName(self, a: np.ndarray):
         logger.debug(f"Writing array to archive {str(self)}, size {a.shape}")
@@ -308,15 +494,39 @@ class Archive:
         # I'm aware it'll do the encoding anyway, but I wanted to make it explicit
         self.zip.writestr(name, string.encode('utf-8'))
 
+    def mapArray(self, name: str) -> Optional[np.ndarray]:
+        """Return a memory-mapped view of an array stored uncompressed in the archive, or None if we can't
+        do that (in which case it is read in the normal way)."""
+        return None
+
     def readArray(self, name: str) -> np.ndarray:
         if self.zip is None:
             raise Exception("Archive is not open")
         self.assert_read()
-        b = self.zip.read(name)
+        if (a := self.mapArray(name)) is not None:
+            return a
+        with self.readLock:
+            f = self.zip.open(name)
+        try:
+            b = f.read()
+        finally:
+            with self.readLock:
+                f.close()
         bio = BytesIO(b)
         a = np.load(bio)
         return a
 
+    def readArrays(self, names: List[str]) -> Dict[str, np.ndarray]:
+        """Read several arrays, decompressing them in parallel. Returns a dict of name to array."""
+        names = list(dict.fromkeys(names))  # remove duplicates, keeping the order
+        for name in names:
+            self.progress(f"Extracting data array {name} from archive...")
+        pool = self.pool(len(names))
+        if pool is None:
+            return {name: self.readArray(name) for name in names}
+        with pool:
+            return dict(zip(names, pool.map(self.readArray, names)))
+
     def readStr(self, name: str) -> str:
         if self.zip is None:
             raise Exception("Archive is not open")
@@ -326,34 +536,63 @@ class Archive:
 
     # will take a nested structure of lists and dicts to any depth, consisting of primitive types -
     # the sort of thing that can be turned into JSON. But it will also accept numpy arrays, which it
-    # will save to the archive given and replace with string tags.
+    # will save to the archive given and replace with string tags. The arrays are written together
+    # at the end, so that they can be compressed in parallel.
 
     def convertArraysToTags(self, d):
-        if isinstance(d, list):
-            return [self.convertArraysToTags(x) for x in d]
-        elif isinstance(d, dict):
-            return {k: self.convertArraysToTags(v) for k, v in d.items()}
-        elif isinstance(d, tuple):
-            return tuple([self.convertArraysToTags(x) for x in d])
-        elif isinstance(d, np.ndarray):
-            return self.writeArrayAndGenerateName(d)
-        else:
-            return d
+        arrays = []
+
+        def convert(d):
+            if isinstance(d, list):
+                return [convert(x) for x in d]
+            elif isinstance(d, dict):
+                return {k: convert(v) for k, v in d.items()}
+            elif isinstance(d, tuple):
+                return tuple([convert(x) for x in d])
+            elif isinstance(d, np.ndarray):
+                name = "ARAE-{}".format(self.arrayct)
+                self.arrayct += 1
+                arrays.append((name, d))
+                return name
+            else:
+                return d
+
+        d = convert(d)
+        self.writeArrays(arrays)
+        return d
 
     # does the inverse of the above, turning the string tags back into their numpy arrays from the archive
+    # (again, reading them all together so they can be decompressed in parallel)
 
     def convertTagsToArrays(self, d):
-        if isinstance(d, list):
-            return [self.convertTagsToArrays(x) for x in d]
-        elif isinstance(d, dict):
-            return {k: self.convertTagsToArrays(v) for k, v in d.items()}
-        elif isinstance(d, tuple):
-            return tuple([self.convertTagsToArrays(x) for x in d])
-        elif isinstance(d, str) and d.startswith("ARAE-"):
-            self.progress(f"Extracting data array {d} from archive...")
-            return self.readArray(d)
-        else:
-            return d
+        def isTag(d):
+            return isinstance(d, str) and d.startswith("ARAE-")
+
+        def findTags(d, tags):
+            if isinstance(d, (list, tuple)):
+                for x in d:
+                    findTags(x, tags)
+            elif isinstance(d, dict):
+                for x in d.values():
+                    findTags(x, tags)
+            elif isTag(d):
+                tags.append(d)
+            return tags
+
+        def convert(d):
+            if isinstance(d, list):
+                return [convert(x) for x in d]
+            elif isinstance(d, dict):
+                return {k: convert(v) for k, v in d.items()}
+            elif isinstance(d, tuple):
+                return tuple([convert(x) for x in d])
+            elif isTag(d):
+                return arrays[d]
+            else:
+                return d
+
+        arrays = self.readArrays(findTags(d, []))
+        return convert(d)
 
     def writeJson(self, name, d, permit_replace=False):
         """Write a JSON-serisalisable object. If permit_replace is true, we can replace
@@ -394,7 +633,10 @@ class FileArchive(Archive):
 
     def __init__(self, path: Union[Path,str], mode='r', progressCallback: Callable[[str], None] = None,
             metadata:Metadata=None,                     # if supplied, type will not be used
-            type:ArchiveType=ArchiveType.UNSPECIFIED     # ignored if metadata is supplied (is used to build a metadata)
+            type:ArchiveType=ArchiveType.UNSPECIFIED,    # ignored if metadata is supplied (is used to build a metadata)
+            storeArrays: Optional[bool] = None,         # store arrays uncompressed (None to use the configuration)
+            compression: Optional[str] = None,          # compression method (see COMPRESSION_TYPES), None for config
+            level: Optional[int] = None                 # compression level, None for config
         ):
 
         """Open a Zip archive on disk.
@@ -402,11 +644,15 @@ class FileArchive(Archive):
         If "type" is set, add the type of the archive to the metadata for writing.
         This is just a string; some are defined in ArchiveTypes. The default is "unspecified".
         Metadata is only written when the archive is opened in write mode.
+        In write mode the archive is written to a temporary file which replaces the target when it is
+        closed, so arrays memory-mapped from an existing file at the same path remain valid.
         """
         assert mode in ['r', 'w', 'a']
-        super().__init__(mode, progressCallback=progressCallback)
+        super().__init__(mode, progressCallback=progressCallback, storeArrays=storeArrays,
+                         compression=compression, level=level)
         path = path if isinstance(path, Path) else Path(path)  # sometimes they are strings
         self.path = path
+        self.tmpPath = None     # the file we are actually writing in 'w' mode
 
         # either create a new metadata item, or use the one passed in.
         if metadata is None:
@@ -441,9 +687,12 @@ class FileArchive(Archive):
 
 
     def open(self):
-        self.zip = zipfile.ZipFile(self.path, self.mode.lower(), compression=zipfile.ZIP_DEFLATED)
-        
         mode = self.mode.lower()
+        if mode == 'w':
+            # don't truncate the target: arrays from it may still be mapped (see mapArray())
+            self.tmpPath = self.path.with_name(f".{self.path.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+        self.zip = zipfile.ZipFile(self.tmpPath or self.path, mode, compression=self.compressType(),
+                                   compresslevel=self.compressLevel())
 
         if mode == 'a':
             # if we're doing append, now the file is open we should try to work out
@@ -475,6 +724,50 @@ class FileArchive(Archive):
         if self.zip is not None:
             self.zip.close()
             self.zip = None
+        if self.tmpPath is not None:
+            os.replace(self.tmpPath, self.path)
+            self.tmpPath = None
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if exc_type is not None and self.tmpPath is not None:
+            # the write failed, so leave any existing file alone
+            if self.zip is not None:
+                self.zip.close()
+                self.zip = None
+            self.tmpPath.unlink(missing_ok=True)
+            self.tmpPath = None
+        self.close()
+
+    def mapArray(self, name: str) -> Optional[np.ndarray]:
+        if not _archiveConfig().mmaparrays:
+            return None
+        info = self.zip.getinfo(name)
+        if info.compress_type != zipfile.ZIP_STORED:
+            return None
+        with open(self.path, 'rb') as f:
+            # the data follows the local header, which may not have the same extra fields as the central
+            # directory entry, so we have to read it.
+            f.seek(info.header_offset)
+            header = f.read(zipfile.sizeFileHeader)
+            if len(header) != zipfile.sizeFileHeader or header[:4] != zipfile.stringFileHeader:
+                return None
+            namelen, extralen = struct.unpack('<HH', header[26:30])
+            f.seek(info.header_offset + zipfile.sizeFileHeader + namelen + extralen)
+            try:
+                version = np.lib.format.read_magic(f)
+            except ValueError:
+                return None
+            if version == (1, 0):
+                shape, fortran, dtype = np.lib.format.read_array_header_1_0(f)
+            elif version == (2, 0):
+                shape, fortran, dtype = np.lib.format.read_array_header_2_0(f)
+            else:
+                return None
+            offset = f.tell()
+        if dtype.hasobject or 0 in shape:
+            return None
+        return np.memmap(self.path, dtype=dtype, mode='c', offset=offset, shape=shape,
+                         order='F' if fortran else 'C')
 
     def __str__(self):
         return f"FileArchive({self.path, self.mode})"
@@ -482,7 +775,9 @@ class FileArchive(Archive):
 
 class MemoryArchive(Archive):
     """
-    Used for ZIP archives in memory
+    Used for ZIP archives in memory. These hold undo snapshots and document copies, so they don't use
+    the configured compression settings (which are for files on disk, where a slower codec may be
+    worth it): they always use deflate at zlib's default level, and compress arrays.
     """
 
     mode: bool      # 'r' or 'w', set by subclass
@@ -495,13 +790,15 @@ class MemoryArchive(Archive):
         else:
             data = data
             mode = 'r'
-        super().__init__(mode, progressCallback=progressCallback)
+        super().__init__(mode, progressCallback=progressCallback, storeArrays=False,
+                         compression='deflate', level=zlib.Z_DEFAULT_COMPRESSION)
         self.data = data
         self.id = MemoryArchive.id
         MemoryArchive.id += 1
 
     def open(self):
-        self.zip = zipfile.ZipFile(self.data, self.mode, compression=zipfile.ZIP_DEFLATED)
+        self.zip = zipfile.ZipFile(self.data, self.mode, compression=self.compressType(),
+                                   compresslevel=self.compressLevel())
         logger.debug(f"Opened {self}")
 
     def close(self):
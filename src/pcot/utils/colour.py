@@ -1,5 +1,3 @@
-from PySide2 import QtWidgets
-from PySide2.QtGui import QColor
 import numpy as np
 
 # functions for colour manipulation: converting from (r,g,b) range 0-1 triples to QColor
@@ -8,6 +6,7 @@ import numpy as np
 # takes a float colour triple, returns the same or None if cancelled
 
 def colDialog(init):
+    from PySide2 import QtWidgets
     col = rgb2qcol(init)
     col = QtWidgets.QColorDialog.getColor(col, None)
     if col.isValid():
@@ -24,6 +23,7 @@ def qcol2rgb(qcol):
 
 
 def rgb2qcol(rgb, alpha=1.0):
+    from PySide2.QtGui import QColor
     r, g, b = rgb
     a = np.clip(alpha*256, 0, 255)
     r = np.clip(r*256, 0, 255)
@@ -1,7 +1,9 @@
 import dataclasses
 import sys
-import time
 import logging
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
 from datetime import datetime
 from typing import Dict, Optional
 
@@ -53,6 +55,10 @@ class DatumStore:
 
     By default the cache is infinitely large, so objects will sit around until the store goes away!!!
 
+    The cache is an OrderedDict kept in order of use (least recent first) with a running total of its size,
+    so lookups and evictions don't have to scan it. Access is protected by a lock, so a store can be shared
+    between threads. The hits, misses and evictions attributes count what the cache has been doing.
+
     Usage example for writing:
             with FileArchive("foo.parc", "w") as a:
                 da = DatumStore(a)
@@ -66,7 +72,9 @@ class DatumStore:
     Note the difference - when writing, the archive is open for writing either using open() or inside a context manager.
 
     The Zip archive is only open while data is being written or read (PCOT archive objects - which this class uses -
-    are context managers).
+    are context managers). If keepOpen is set when reading, the archive is opened on the first read and kept
+    open until close() is called, which saves reopening the file (and reading its directory) on every miss.
+    To keep it open for just a few reads, do them inside readBatch().
 
     Be VERY SURE that you don't keep any references to the Datum objects, or the LRU deletion won't work!
     
@@ -85,29 +93,41 @@ class DatumStore:
         This is a simple class to hold the information we need to cache an item in the archive.
         """
         size: int  # size in bytes
-        time: float  # timestamp when accessed
         datum: Datum  # the Datum object
 
     archive: Archive
-    cache: Dict[str, CachedItem]
+    cache: 'OrderedDict[str, CachedItem]'  # in order of access, least recently used first
     max_size: int
     write_mode: bool
+    keepOpen: bool  # keep the archive open between reads
+
+    # statistics for monitoring the cache
+    hits: int
+    misses: int
+    evictions: int
 
     # this is a manifest of the items in the archive.
     # It's a dictionary of name -> Metadata
     manifest: Dict[str, Metadata]
 
-    def __init__(self, archive: Archive, max_size: int = sys.maxsize):
+    def __init__(self, archive: Archive, max_size: int = sys.maxsize, keepOpen: bool = False):
         """
         Create a new DatumStore object. The size parameter is the maximum total size of the cached items
-        in bytes.
+        in bytes. If keepOpen is true, an archive being read is kept open between reads until close() is called.
         """
 
         self.archive = archive
-        self.cache = {}
+        self.cache = OrderedDict()
+        self.cachedSize = 0
         self.manifest = {}
         self.size = max_size
+        self.keepOpen = keepOpen
+        self.heldOpen = False   # true if we have opened the archive for reading and are keeping it open
+        self.lock = threading.RLock()
         self.read_count = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
 
         if not self.archive.is_open():
             # assume we are reading. When reading, we create the archive outside a context manager which
@@ -121,7 +141,23 @@ class DatumStore:
             self.write_mode = True
             
     def close(self):
-        self.archive.close()
+        with self.lock:
+            self.archive.close()
+            self.heldOpen = False
+
+    @contextmanager
+    def readBatch(self):
+        """Context manager which keeps the archive open for the reads done inside it (as if keepOpen were set),
+        and then closes it again unless keepOpen really is set. Other threads' reads wait until it's done."""
+        with self.lock:
+            keepOpen = self.keepOpen
+            self.keepOpen = True
+            try:
+                yield self
+            finally:
+                self.keepOpen = keepOpen
+                if not keepOpen and self.heldOpen:
+                    self.close()
 
     def readManifest(self, archive):
         names = archive.getNames()
@@ -173,7 +209,8 @@ class DatumStore:
         self.archive.writeJson(name+".meta", meta.serialise())
 
     def total_size(self):
-        return sum([item.size for item in self.cache.values()])
+        """The total size of the cached items in bytes"""
+        return self.cachedSize
 
     def getMetadata(self, name: str) -> Metadata:
         """Get the metadata item for a given name, or None if it doesn't exist."""
@@ -190,50 +227,68 @@ class DatumStore:
         sources can be reconstructed for images.
 
         This MUST NOT be inside an Archive context manager; it will open/close the archive with a context
-        manager itself.
+        manager itself (or open it and keep it open if keepOpen is set).
         """
 
         # Note that we don't bother to check the manifest.
 
-        if self.archive.is_open():
-            raise Exception("archive must not be 'pre-opened' to read")
+        with self.lock:
+            if (item := self.cache.get(name)) is not None:
+                logger.debug(f"Cache hit for {name}")
+                self.hits += 1
+                self.cache.move_to_end(name)  # it's now the most recently used
+                return item.datum
 
-        if name not in self.cache:
+            self.misses += 1
             # read the item first - we need to know how big it is.
+            if (datum := self._read(name)) is None:
+                return None
+            size = datum.getSize()
+            self._makeRoom(size)
+            self.cache[name] = DatumStore.CachedItem(size, datum)
+            self.cachedSize += size
+            self.read_count += 1
+            return datum
+
+    def _read(self, name) -> Optional[Datum]:
+        """Read and deserialise an item from the archive, opening it if required. Returns None if the
+        item isn't there."""
+        if self.keepOpen:
+            if not self.heldOpen:
+                if self.archive.is_open():
+                    raise Exception("archive must not be 'pre-opened' to read")
+                self.archive.open()
+                self.heldOpen = True
+            logger.info(f"Reading {name} from archive {self.archive.path}")
+            item = self.archive.readJson(name)
+        else:
+            if self.archive.is_open():
+                raise Exception("archive must not be 'pre-opened' to read")
             with self.archive as a:
                 logger.info(f"Reading {name} from archive {self.archive.path}")
-                if (item := a.readJson(name)) is None:
-                    return None
-                # and deserialise it
-                datum = Datum.deserialise(item)
-                size = datum.getSize()
-                # we may need to make room in the cache. Total the size to find out.
-                while self.total_size() + size > self.size:
-                    # find the least-recently-used item with non-zero size
-                    found = None
-                    oldest = time.perf_counter()
-                    for k, v in self.cache.items():
-                        if v.size > 0 and v.time < oldest:
-                            oldest = v.time
-                            found = k
-                    if found is not None:
-                        del self.cache[found]  # delete it. This may not work if we have stale references!!!
-                    else:
-                        raise Exception("internal error: cache must be lying about size or cache is too small")
-
-                # construct a CachedItem - it's OK for the time to be zero here, it will be overwritten very
-                # soon so there's no point calling time().
-                self.cache[name] = DatumStore.CachedItem(datum.getSize(), 0, datum)
-                self.read_count += 1
-        else:
-            logger.debug(f"Cache hit for {name}")
-
-        self.cache[name].time = time.perf_counter()  # set timestamp of access
-        return self.cache[name].datum  # and return
+                item = a.readJson(name)
+        return None if item is None else Datum.deserialise(item)
+
+    def _makeRoom(self, size):
+        """Remove least-recently-used items of non-zero size from the cache until an item of the given size
+        will fit."""
+        while self.cachedSize + size > self.size:
+            if self.cachedSize == 0:
+                raise Exception("internal error: cache must be lying about size or cache is too small")
+            name, item = next(iter(self.cache.items()))
+            if item.size == 0:
+                # zero size items are never removed, so just move them out of the way
+                self.cache.move_to_end(name)
+                continue
+            del self.cache[name]  # delete it. This may not work if we have stale references!!!
+            self.cachedSize -= item.size
+            self.evictions += 1
 
     def clearCache(self):
         """Clear the cache of all items. This is useful if you want to free up memory."""
-        self.cache = {}
+        with self.lock:
+            self.cache = OrderedDict()
+            self.cachedSize = 0
 
 
 def readParc(fname: str, itemname: str = 'main', inpidx: int = None) -> Optional[Datum]:
@@ -0,0 +1,111 @@
+"""
+A process-wide cache of the data loaded from image files, so that (for example) a multifile input which is
+changed to use a different subset of a directory of files doesn't have to reload the ones it already has.
+It is shared by all the inputs in all open documents, and by gencam.
+
+The total size of the cached arrays is limited by the "cachesize" setting in the "loading" section of the
+configuration; when something new is added the least recently used arrays are removed until it fits.
+Entries are keyed by the file's path, modification time and size, and by a key describing how the
+data was decoded (bit depth, raw loader settings and so on), so a file is reloaded if it changes or
+is loaded in a different way.
+
+The cached arrays are made read-only, because they are shared.
+"""
+
+import logging
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Any, Hashable, Optional, Callable, Union
+
+import numpy as np
+
+import pcot.config
+
+logger = logging.getLogger(__name__)
+
+
+def _conf():
+    return pcot.config.data.loading
+
+
+def enabled() -> bool:
+    """True if the cache is enabled (i.e. the cache size is not zero)"""
+    return _conf().cachesize > 0
+
+
+def pool(count: int, prefix="load") -> Optional[ThreadPoolExecutor]:
+    """Return a thread pool for loading a number of files, or None if they should be loaded in this
+    thread. If the "threads" setting is 0 we let ThreadPoolExecutor choose, which gives us more threads
+    than CPUs; that's what we want for files on slow or network storage."""
+    threads = _conf().threads or None
+    if count < 2 or threads == 1:
+        return None
+    return ThreadPoolExecutor(max_workers=threads, thread_name_prefix=prefix)
+
+
+class FileCache:
+    """An LRU cache of arrays with a limit on their total size in bytes (see the module docstring).
+    All the methods are thread-safe."""
+
+    def __init__(self):
+        self.cache = OrderedDict()     # key -> array, least recently used first
+        self.size = 0
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def key(path: Union[str, Path], loaderKey: Hashable) -> tuple:
+        """Make a key for a file and the way it is loaded"""
+        st = os.stat(path)
+        return os.path.abspath(path), st.st_mtime_ns, st.st_size, loaderKey
+
+    def get(self, key) -> Optional[np.ndarray]:
+        with self.lock:
+            if (a := self.cache.get(key)) is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.cache.move_to_end(key)
+            return a
+
+    def put(self, key, a: np.ndarray):
+        """Add an array to the cache (if it will fit), making it read-only"""
+        maxsize = _conf().cachesize * 1024 * 1024
+        if a.nbytes > maxsize:
+            return
+        a.flags.writeable = False
+        with self.lock:
+            if (old := self.cache.pop(key, None)) is not None:
+                self.size -= old.nbytes
+            while self.size + a.nbytes > maxsize:
+                _, old = self.cache.popitem(last=False)
+                self.size -= old.nbytes
+                self.evictions += 1
+            self.cache[key] = a
+            self.size += a.nbytes
+
+    def load(self, path: Union[str, Path], loaderKey: Hashable, loader: Callable[[Any], np.ndarray]) -> np.ndarray:
+        """Get the data for a file from the cache, or load it with the loader function (which takes the path)
+        and cache it. This can be called from any thread."""
+        key = self.key(path, loaderKey)
+        if (a := self.get(key)) is not None:
+            logger.debug(f"Using cached data for {path}")
+            return a
+        logger.debug(f"Loading {path} into cache")
+        a = loader(path)
+        self.put(key, a)
+        return a
+
+    def clear(self):
+        with self.lock:
+            self.cache = OrderedDict()
+            self.size = 0
+
+
+# the cache itself
+cache = FileCache()
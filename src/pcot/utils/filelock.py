@@ -0,0 +1,53 @@
+"""
+A simple exclusive lock shared between processes, used when several processes may write to the same file
+(e.g. batch jobs appending to the same PARC or text file).
+"""
+
+import hashlib
+import os
+import tempfile
+import time
+from pathlib import Path
+
+
+class FileLock:
+    """An exclusive lock on a file, held inside a with-block. The lock is taken on a separate lock file so
+    that the protected file can be created, replaced or appended to while the lock is held. Lock files are
+    kept in a directory of their own in the system's temporary directory, named after a hash of the protected
+    file's absolute path, so they don't clutter the directories being written to. They are left in place
+    afterwards, because deleting a lock file another process is waiting on would let two processes hold the
+    lock at once."""
+
+    def __init__(self, path):
+        lockdir = Path(tempfile.gettempdir()) / "pcot-locks"
+        lockdir.mkdir(exist_ok=True)
+        name = hashlib.sha1(str(Path(path).resolve()).encode()).hexdigest()
+        self.path = str(lockdir / f"{name}.lock")
+        self.fd = None
+
+    def __enter__(self):
+        self.fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o666)
+        if os.name == 'nt':
+            import msvcrt
+            while True:
+                try:
+                    # this gives up after about 10 seconds, so keep trying.
+                    msvcrt.locking(self.fd, msvcrt.LK_LOCK, 1)
+                    break
+                except OSError:
+                    time.sleep(0.1)
+        else:
+            import fcntl
+            fcntl.flock(self.fd, fcntl.LOCK_EX)
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if os.name == 'nt':
+            import msvcrt
+            os.lseek(self.fd, 0, os.SEEK_SET)
+            msvcrt.locking(self.fd, msvcrt.LK_UNLCK, 1)
+        else:
+            import fcntl
+            fcntl.flock(self.fd, fcntl.LOCK_UN)
+        os.close(self.fd)
+        self.fd = None
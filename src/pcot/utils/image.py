@@ -17,6 +17,24 @@ def imgmerge(img):
     return np.dstack(img)
 
 
+def constantPlane(shape, dtype, value):
+    """Create a read-only array in which every element is the same value. This takes no memory beyond
+    that value, because all its strides are zero. It's used for the uncertainty and DQ of images which don't
+    have them (see ImageCube). To change the data, replace the array with a real one (e.g. a copy of it)."""
+    return np.broadcast_to(np.array(value, dtype=dtype), shape)
+
+
+def isConstantPlane(a):
+    """True if an array (or the data in a masked array) was created by constantPlane, or is a view of one."""
+    a = np.ma.getdata(a)
+    return isinstance(a, np.ndarray) and a.ndim > 0 and not any(a.strides)
+
+
+def isZeroPlane(a):
+    """True if an array is a constant plane of zeroes"""
+    return isConstantPlane(a) and a.size > 0 and np.ma.getdata(a).flat[0] == 0
+
+
 def generate_gradient(w, h, is_horizontal, steps=0, start=0, stop=1):
     """Generates a gradient image of size (w, h) with values ranging from start to stop. If is_horizontal is True,
     the gradient will be horizontal, otherwise vertical. If steps is > 0, the gradient will be quantized to that
@@ -125,3 +125,60 @@ def trilinear_interpolation(x_volume: Union[list, np.ndarray],
     # interpolation along z
     volume_needed = c1[0] * (1 - xd[2]) + c1[1] * xd[2]
     return volume_needed
+
+
+def _axis_weights(needed: np.ndarray, size: int):
+    """For coordinates along a pixel axis of the given size, return the index of the pixel before each
+    coordinate, the index of the pixel after it, and how far the coordinate is between them (0-1). Coordinates
+    are clipped to the axis."""
+    needed = np.clip(np.asarray(needed, dtype=np.float64), 0, size - 1)
+    i0 = np.floor(needed).astype(np.intp)
+    i1 = np.minimum(i0 + 1, size - 1)
+    return i0, i1, (needed - i0).astype(np.float32)
+
+
+def trilinear_interpolation_bands(volume: np.ndarray,
+                                  z_volume: Union[list, np.ndarray],
+                                  x_needed: np.ndarray, y_needed: np.ndarray,
+                                  z_needed: Union[list, np.ndarray]) -> np.ndarray:
+    """
+    Vectorised trilinear interpolation of an image volume, generating whole bands at once rather than a point at
+    a time. The x and y points of the volume are the pixel coordinates, the z points (usually wavelengths) are
+    given and must be in increasing order. All the coordinates are clipped to the limits of the volume.
+
+    :param volume:   volume, indexed [y, x, z] (i.e. an image with bands)
+    :param z_volume: z points of the volume grid
+    :param x_needed: x coordinates of the columns of the bands to generate
+    :param y_needed: y coordinates of the rows of the bands to generate
+    :param z_needed: z coordinates of the bands to generate
+
+    :return: an array of shape (len(y_needed), len(x_needed), len(z_needed))
+    """
+    z_volume = np.asarray(z_volume, dtype=np.float64)
+    if len(z_volume) < 2:
+        raise ValueError('need at least two points in z_volume')
+    h, w = volume.shape[:2]
+
+    # find the bracketing bands for all the z points at once
+    z_needed = np.clip(np.atleast_1d(np.asarray(z_needed, dtype=np.float64)), z_volume[0], z_volume[-1])
+    k = np.clip(np.searchsorted(z_volume, z_needed), 1, len(z_volume) - 1)
+    tz = ((z_needed - z_volume[k - 1]) / (z_volume[k] - z_volume[k - 1])).astype(np.float32)
+
+    x0, x1, tx = _axis_weights(x_needed, w)
+    y0, y1, ty = _axis_weights(y_needed, h)
+    ty = ty[:, np.newaxis]
+
+    # bilinearly resample each of the bands we need (once each, even if several z points share them)
+    resampled = {}
+    for band in np.unique(np.concatenate([k - 1, k])):
+        b = volume[:, :, band]
+        top, bottom = b[y0], b[y1]
+        top = top[:, x0] * (1 - tx) + top[:, x1] * tx
+        bottom = bottom[:, x0] * (1 - tx) + bottom[:, x1] * tx
+        resampled[band] = top * (1 - ty) + bottom * ty
+
+    # and interpolate between them
+    out = np.empty((len(y0), len(x0), len(z_needed)), dtype=np.float32)
+    for i, (kk, t) in enumerate(zip(k, tz)):
+        out[:, :, i] = resampled[kk - 1] * (1 - t) + resampled[kk] * t
+    return out
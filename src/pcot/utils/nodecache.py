@@ -0,0 +1,221 @@
+"""
+An optional on-disk cache of node outputs, so that nodes don't have to be recomputed between sessions
+or between batch runs when nothing they depend on has changed.
+
+Each entry is keyed by a content hash of the node: its type (name, version and source MD5), its parameters
+and the hashes of the nodes feeding its inputs. At the top of the graph, input nodes hash the actual data
+they read (see hashDatum()). So if a node's hash matches an entry in the cache, the outputs in that entry
+are what the node would produce.
+
+Each entry is a PARC-style archive (written with DatumStore) in the cache directory, named after the hash.
+The cache is limited in size: when it grows too big, the least recently used entries (by file modification
+time, which is updated whenever an entry is read) are deleted.
+
+The cache is turned on and configured in the "nodecache" section of the configuration.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import tempfile
+from pathlib import Path
+from typing import List, Optional, Tuple
+
+import numpy as np
+
+import pcot.config
+from pcot.datum import Datum
+from pcot.rois import ROI
+from pcot.utils.archive import FileArchive
+from pcot.utils.datumstore import DatumStore
+
+logger = logging.getLogger(__name__)
+
+SUFFIX = ".parc"
+
+
+def _hashSerialised(h, d):
+    """Feed a structure from Datum.serialise() into a hash object, including any numpy arrays in it"""
+    if isinstance(d, np.ndarray):
+        h.update(f"array{d.shape}{d.dtype}".encode())
+        h.update(np.ascontiguousarray(d).data)
+    elif isinstance(d, dict):
+        for k in sorted(d.keys()):
+            h.update(f"key{k}".encode())
+            _hashSerialised(h, d[k])
+    elif isinstance(d, (list, tuple)):
+        h.update(f"seq{len(d)}".encode())
+        for x in d:
+            _hashSerialised(h, x)
+    else:
+        h.update(json.dumps(d, default=str).encode())
+
+
+def _hashROI(h, r) -> bool:
+    """Feed an ROI into a hash object, returning false if it can't be hashed (e.g. a non-ROI annotation)."""
+    if not isinstance(r, ROI):
+        return False
+    h.update(json.dumps([r.tpname, r.label, r.containingImageDimensions], default=str).encode())
+    bb = r.bb()
+    h.update(json.dumps(None if bb is None else bb.astuple()).encode())
+    mask = r.mask()
+    _hashSerialised(h, None if mask is None else np.asarray(mask))
+    td = r.to_tagged_dict()
+    if td is not None:
+        _hashSerialised(h, td.serialise())
+    return True
+
+
+def hashDatum(d: Optional[Datum]) -> Optional[str]:
+    """Return a hash of the contents of a Datum, used for the data coming into a graph through an input.
+    Image serialisation doesn't include ROIs and annotations, so these are hashed separately. Returns None
+    if the datum carries something we can't hash (an annotation which isn't an ROI), in which case nothing
+    downstream of it will be cached."""
+    h = hashlib.sha256()
+    if d is None:
+        h.update(b"none")
+    else:
+        h.update(d.tp.name.encode())
+        _hashSerialised(h, d.serialise())
+        if d.isImage() and d.val is not None:
+            for name, lst in (("rois", d.val.rois), ("annotations", d.val.annotations)):
+                h.update(f"{name}{len(lst)}".encode())
+                for r in lst:
+                    if not _hashROI(h, r):
+                        return None
+    return h.hexdigest()
+
+
+def canStore(d: Optional[Datum]) -> bool:
+    """Can this output be stored in the cache and read back without losing anything? Image serialisation
+    doesn't store ROIs or annotations, so images with those can't be stored."""
+    if d is None:
+        return True
+    if d.isImage() and d.val is not None:
+        return len(d.val.rois) == 0 and len(d.val.annotations) == 0
+    return True
+
+
+class NodeCache:
+    """A directory of node output archives with a size limit"""
+
+    path: Path
+    maxSize: int  # maximum total size in bytes
+    _size: Optional[int]  # current total size, or None if we haven't scanned the directory yet
+
+    def __init__(self, path: Path, maxSize: int):
+        self.path = Path(path)
+        self.maxSize = maxSize
+        self._size = None
+        self.path.mkdir(parents=True, exist_ok=True)
+
+    def _entryPath(self, key: str) -> Path:
+        return self.path / (key + SUFFIX)
+
+    def _entries(self):
+        """return a list of (path, size, mtime) for all entries"""
+        out = []
+        with os.scandir(self.path) as it:
+            for e in it:
+                if e.is_file() and e.name.endswith(SUFFIX):
+                    st = e.stat()
+                    out.append((Path(e.path), st.st_size, st.st_mtime))
+        return out
+
+    def totalSize(self) -> int:
+        """The total size of the entries in the cache in bytes"""
+        if self._size is None:
+            self._size = sum([size for _, size, _ in self._entries()])
+        return self._size
+
+    def get(self, key: str) -> Optional[Tuple[List[Optional[Datum]], Optional[str]]]:
+        """Return the outputs and rect text stored for a node hash, or None if there's no such entry."""
+        p = self._entryPath(key)
+        if not p.is_file():
+            return None
+        try:
+            ds = DatumStore(FileArchive(p))
+            with ds.archive as a:
+                info = a.readJson("info")
+            outputs = [None if name is None else ds.get(name) for name in info['outputs']]
+            # mark the entry as recently used
+            os.utime(p)
+            logger.debug(f"Node cache hit for {key}")
+            return outputs, info['rectText']
+        except Exception as e:
+            # another process may be replacing or evicting this entry
+            logger.warning(f"Cannot read node cache entry {p}: {e}")
+            return None
+
+    def put(self, key: str, outputs: List[Optional[Datum]], rectText: Optional[str]):
+        """Store the outputs and rect text for a node hash, and then delete old entries if the cache is too big.
+        The entry is written to a temporary file and then moved into place, so that other processes never
+        see a partially written entry."""
+        p = self._entryPath(key)
+        if p.is_file():
+            return
+        # get a unique name for the temporary file, but let the archive create it
+        fd, tmp = tempfile.mkstemp(suffix=".tmp", dir=self.path)
+        os.close(fd)
+        os.remove(tmp)
+        total = self.totalSize()     # make sure we have the size before the new entry appears
+        try:
+            with FileArchive(tmp, 'w') as a:
+                ds = DatumStore(a)
+                names = []
+                for i, d in enumerate(outputs):
+                    if d is None:
+                        names.append(None)
+                    else:
+                        names.append(f"out{i}")
+                        ds.writeDatum(f"out{i}", d)
+                a.writeJson("info", {'outputs': names, 'rectText': rectText})
+            size = os.path.getsize(tmp)
+            os.replace(tmp, p)
+        except Exception as e:
+            logger.warning(f"Cannot write node cache entry {p}: {e}")
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            return
+        self._size = total + size
+        self.evict()
+
+    def evict(self):
+        """Delete least recently used entries until the cache is within its size limit"""
+        if self.totalSize() <= self.maxSize:
+            return
+        entries = sorted(self._entries(), key=lambda e: e[2])
+        total = sum([size for _, size, _ in entries])
+        for path, size, _ in entries:
+            if total <= self.maxSize:
+                break
+            try:
+                path.unlink()
+                logger.debug(f"Evicted {path} from node cache")
+            except FileNotFoundError:
+                pass    # another process got there first
+            total -= size
+        self._size = total
+
+    def clear(self):
+        """Delete all entries"""
+        for path, _, _ in self._entries():
+            path.unlink(missing_ok=True)
+        self._size = 0
+
+
+_cache: Optional[NodeCache] = None
+
+
+def getCache() -> Optional[NodeCache]:
+    """Return the node cache if it is enabled in the configuration, otherwise None."""
+    global _cache
+    conf = pcot.config.data.nodecache
+    if not conf.enabled:
+        return None
+    path = Path(conf.location).expanduser()
+    maxSize = conf.maxsize * 1024 * 1024
+    if _cache is None or _cache.path != path or _cache.maxSize != maxSize:
+        _cache = NodeCache(path, maxSize)
+    return _cache
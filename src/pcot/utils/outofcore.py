@@ -0,0 +1,94 @@
+"""
+Out-of-core storage for large image arrays.
+
+Image cubes hold three full-size arrays (the image, uncertainty and DQ - 10 bytes per pixel per band), so a big
+mosaic or a long stack of images can exhaust memory. When this is turned on in the "outofcore" section of the
+configuration, arrays bigger than a threshold are allocated in memory-mapped temporary files instead of RAM.
+These behave exactly like ordinary numpy arrays, but the operating system can page them out to disk.
+
+Code which processes such an array should do so a strip of rows at a time (see strips()), so that its
+temporary arrays are bounded by the strip size rather than the image size. ImageCube.copy() and
+ImageCube.modifyWithSub() do this.
+"""
+
+import logging
+import mmap
+import tempfile
+from pathlib import Path
+from typing import Iterator, Optional
+
+import numpy as np
+
+import pcot.config
+
+logger = logging.getLogger(__name__)
+
+
+def _conf():
+    return pcot.config.data.outofcore
+
+
+def threshold() -> Optional[int]:
+    """The size in bytes above which arrays are memory-mapped, or None if out-of-core storage is off"""
+    conf = _conf()
+    return conf.threshold * 1024 * 1024 if conf.enabled else None
+
+
+def allocate(shape, dtype, fill=None) -> np.ndarray:
+    """Create an uninitialised array (or one filled with a value), memory-mapping it if it is big enough."""
+    dtype = np.dtype(dtype)
+    limit = threshold()
+    nbytes = int(np.prod(shape)) * dtype.itemsize
+    if limit is None or nbytes <= limit or nbytes == 0:
+        return np.empty(shape, dtype=dtype) if fill is None else np.full(shape, fill, dtype=dtype)
+
+    location = Path(_conf().location).expanduser()
+    location.mkdir(parents=True, exist_ok=True)
+    logger.debug(f"Allocating {nbytes} byte array in {location}")
+    # The file is deleted as soon as it is closed, but the mapping keeps the data alive until the array
+    # is garbage collected. A new file is all zeros, so we only need to fill for other values.
+    with tempfile.TemporaryFile(dir=location, prefix="pcot") as f:
+        f.truncate(nbytes)
+        arr = np.memmap(f, dtype=dtype, mode='r+', shape=tuple(shape))
+    if fill is not None and fill != 0:
+        for sl in strips(arr):
+            arr[sl] = fill
+    return arr
+
+
+def zeros(shape, dtype) -> np.ndarray:
+    """Create an array of zeros, memory-mapping it if it is big enough"""
+    return allocate(shape, dtype, 0)
+
+
+def isOutOfCore(arr: np.ndarray) -> bool:
+    """True if an array (or the array it is a view of) is memory-mapped - i.e. its data ultimately
+    belongs to an mmap object"""
+    while isinstance(arr, np.ndarray):
+        arr = arr.base
+    return isinstance(arr, mmap.mmap)
+
+
+def strips(arr: np.ndarray) -> Iterator[slice]:
+    """Yield slices which divide an array into strips of rows no bigger than the configured tile size
+    (and at least one row). An array which is not memory-mapped is returned as a single strip, because
+    there's nothing to gain by splitting it up."""
+    h = arr.shape[0]
+    if not isOutOfCore(arr):
+        yield slice(0, h)
+        return
+    rowBytes = max(1, arr.nbytes // max(1, h))
+    rows = max(1, _conf().tilesize * 1024 * 1024 // rowBytes)
+    for y in range(0, h, rows):
+        yield slice(y, min(h, y + rows))
+
+
+def copy(arr: np.ndarray) -> np.ndarray:
+    """Copy an array, strip by strip if it is large enough to be memory-mapped"""
+    out = allocate(arr.shape, arr.dtype)
+    if not isOutOfCore(out):
+        out[...] = arr
+        return out
+    for sl in strips(out):
+        out[sl] = arr[sl]
+    return out
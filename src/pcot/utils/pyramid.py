@@ -0,0 +1,95 @@
+"""
+Multi-resolution image pyramids (mip-maps) for display.
+
+When a large image is shown zoomed out, most of its pixels end up averaged into a few screen pixels. Rather
+than processing the whole full-resolution image and then shrinking it, the canvas keeps a pyramid of
+copies, each half the size of the one before, and works on the smallest level which still has at least
+one image pixel per screen pixel. Levels are built lazily, the first time they are asked for.
+"""
+
+import math
+import threading
+from typing import Callable, List
+
+import numpy as np
+
+from pcot.utils.image import isConstantPlane
+
+
+def _blocks(arr: np.ndarray) -> np.ndarray:
+    """Return a view of an array (padded by repeating its last row and column if its width or height is odd)
+    in which axes 1 and 3 run over each 2x2 block of pixels"""
+    h, w = arr.shape[:2]
+    if h % 2 or w % 2:
+        pad = [(0, h % 2), (0, w % 2)] + [(0, 0)] * (arr.ndim - 2)
+        arr = np.pad(arr, pad, mode='edge')
+        h, w = arr.shape[:2]
+    return arr.reshape((h // 2, 2, w // 2, 2) + arr.shape[2:])
+
+
+def halveMean(arr: np.ndarray) -> np.ndarray:
+    """Halve the size of an image by averaging each 2x2 block of pixels (rounding odd sizes up)"""
+    return _blocks(arr).mean(axis=(1, 3), dtype=np.float32).astype(arr.dtype, copy=False)
+
+
+def halveOr(arr: np.ndarray) -> np.ndarray:
+    """Halve the size of a DQ plane by ORing together the bits in each 2x2 block, so that a bit
+    set in any pixel is still set in the smaller image"""
+    b = _blocks(arr)
+    return np.bitwise_or.reduce(np.bitwise_or.reduce(b, axis=3), axis=1)
+
+
+class Pyramid:
+    """A lazily built pyramid of an image. Level 0 is the image itself, and level k is 1/2^k of its size,
+    made from level k-1 with the given halving function. A constant plane (see utils.image.constantPlane)
+    stays a constant plane at every level."""
+
+    levels: List[np.ndarray]
+
+    def __init__(self, base: np.ndarray, halve: Callable[[np.ndarray], np.ndarray] = halveMean):
+        self.halve = halve
+        self.levels = [base]
+        self.lock = threading.Lock()
+
+    @property
+    def base(self) -> np.ndarray:
+        return self.levels[0]
+
+    @staticmethod
+    def levelForScale(scale: float, shape) -> int:
+        """Given the number of image pixels per screen pixel, return the level to draw from - the smallest
+        image which still has at least one pixel per screen pixel (and is at least a pixel across)."""
+        if scale < 2:
+            return 0
+        return min(int(math.floor(math.log2(scale))), Pyramid.maxLevel(shape))
+
+    @staticmethod
+    def maxLevel(shape) -> int:
+        """The smallest level of an image of the given shape which is still at least a pixel across"""
+        return max(1, min(shape[0], shape[1])).bit_length() - 1
+
+    def hasLevel(self, k: int) -> bool:
+        """True if level k has already been built"""
+        return k < len(self.levels)
+
+    def level(self, k: int) -> np.ndarray:
+        """Get level k of the pyramid, building it (and any levels above it) if required"""
+        with self.lock:
+            while len(self.levels) <= k:
+                prev = self.levels[-1]
+                if isConstantPlane(prev):
+                    h, w = prev.shape[:2]
+                    shape = ((h + 1) // 2, (w + 1) // 2) + prev.shape[2:]
+                    self.levels.append(np.broadcast_to(prev.flat[0], shape))
+                else:
+                    self.levels.append(self.halve(prev))
+            return self.levels[k]
+
+    @staticmethod
+    def crop(arr: np.ndarray, k: int, x: int, y: int, w: int, h: int) -> np.ndarray:
+        """Cut the region of level k corresponding to the rectangle x,y,w,h in level 0 coordinates, rounding
+        outwards to whole pixels of the level"""
+        f = 1 << k
+        x0, y0 = x // f, y // f
+        x1, y1 = -(-(x + w) // f), -(-(y + h) // f)
+        return arr[y0:y1, x0:x1]
@@ -12,60 +12,100 @@ from pcot.cameras.filters import Filter
 from pcot.imagecube import ImageCube
 from pcot.rois import ROI
 from pcot.sources import SourceSet, SourcesObtainable
-from pcot.utils.maths import pooled_sd
+from pcot.utils.image import isConstantPlane, isZeroPlane
 from pcot.utils.table import Table
 from pcot.value import Value
 from pcot.xform import XFormException
 
 
-def getMeanValue(chanImg, chanUnc, chanDQ, mask, ignorePixSD=False):
-    """find the mean/sd of all the masked values in a single channel for a subimage
-    (ie. part of an image cut out by an ROI). If ignorePixSD is true, the SD of the
-    result is the SD of the nominal values. Otherwise the SD is pooled (mean of the variances
-    of the pixels plus the variance of the means of the pixels).
+def _gather(a: np.ndarray, channels: int, indices: Optional[np.ndarray]) -> np.ndarray:
+    """Get the pixels at some flat indices from an (h,w) or (h,w,c) array as a (pixels, channels) array.
+    If indices is None, get all the pixels (as a view if possible)."""
+    a = a.reshape(-1, channels)
+    if indices is None:
+        return a
+    if isConstantPlane(a):
+        # no need to copy a constant plane; it's the same value everywhere
+        return np.broadcast_to(a[:1], (len(indices), channels))
+    return a[indices]
 
-    If all the pixels are masked out, return None for both mean and SD, and a third value (normally zero)
-    which is the OR of all the bad bits in the DQ.
-    """
 
-    # if the size is bad, throw an exception
-    if mask.size == 0:
-        raise XFormException('DATA',"subimage has no pixels (size zero)")
+def extractValues(img: ImageCube, rois: List[Optional[ROI]], chans: List[int],
+                  ignorePixSD=False) -> List[Dict[int, 'SpectrumValue']]:
+    """Find the mean and SD of the pixels in each of a list of ROIs (None meaning the whole image) for
+    each of a list of channels. Pixels with BAD bits in a channel are not used for that channel.
+    If ignorePixSD is true, the SD of the result is the SD of the nominal values. Otherwise the SD is
+    pooled (mean of the variances of the pixels plus the variance of the means of the pixels).
 
-    # note that "mask" is a positive mask - values are True if we are using them.
-    if mask is None:
-        mask = np.full(chanImg.shape, True)  # no bits masked out
-    else:
-        mask = np.copy(mask)  # need a copy or we'll change the mask in the subimage.
-    # we also have to mask out the bad bits. This will give us a mask which is True
-    # for the bits we want to hide.
-    badmask = (chanDQ & BAD).astype(bool)
-    mask &= ~badmask  # REMOVE those pixels
-
-    # if ALL the values are bad, return None for both mean and SD, and a third
-    # value which is all the bad pixels' bits ORed together.
-    if not np.any(mask):
-        badBits = np.bitwise_or.reduce(chanDQ, axis=None) & BAD  # OR all the bad bits together
-        return None, None, badBits
-
-    # otherwise we can proceed
-    a = np.ma.masked_array(data=chanImg, mask=~mask)
-    mean = a.mean()  # get the mean of the nominal values
-
-    if not ignorePixSD:
-        # we're going to try to take account of the uncertainties of each pixel:
-        # "Thus the variance of the pooled set is the mean of the variances plus the variance of the means."
-        # by https://arxiv.org/ftp/arxiv/papers/1007/1007.1012.pdf
-        # So we'll calculate the variance of the means added to the mean of the variances.
-        # The calculation assumes that the number of samples that went into each point is the same.
-        # And then we'll need to root that variance to get back to SD.
-
-        std = pooled_sd(a, np.ma.masked_array(data=chanUnc, mask=~mask))
-    else:
-        std = a.std()  # otherwise get the SD of the nominal values
+    Returns a list of dictionaries, one per ROI, of channel index to SpectrumValue. The DQ of each value is
+    all the BAD bits in the ROI in that channel ORed together, and the pixel count is the number of pixels
+    which were used. Channels in which all the pixels in an ROI are bad are left out of its dictionary.
+
+    All the ROIs are done at once: we gather the pixels of each ROI into one array, in which each ROI's
+    pixels are a contiguous run of rows, and do the sums for every ROI and channel with np.add.reduceat().
+    """
+    channels = img.channels
 
-    # return the mean, SD, and a zero value for the DQ (because there were good pixels)
-    return mean, std, 0
+    # get the flat indices of the pixels in each ROI. We don't use a label image, because ROIs can overlap.
+    indices = []
+    sizes = []
+    for roi in rois:
+        subimg = img.subimage(roi=roi)
+        if subimg.mask.size == 0:
+            raise XFormException('DATA', "subimage has no pixels (size zero)")
+        x, y, _, _ = subimg.bb
+        ys, xs = np.nonzero(subimg.mask)
+        indices.append((ys + y) * img.w + (xs + x))
+        sizes.append(len(ys))
+
+    sizes = np.array(sizes)
+    out = [{} for _ in rois]
+    used = np.flatnonzero(sizes)  # ROIs with no pixels have no values
+    if len(used) == 0:
+        return out
+    sizes = sizes[used]
+    starts = np.concatenate(([0], np.cumsum(sizes)[:-1]))
+    if len(used) == 1 and sizes[0] == img.w * img.h:
+        indices = None  # just the whole image, no need to copy it
+    else:
+        indices = np.concatenate([indices[i] for i in used])
+
+    n = _gather(img.img, channels, indices)
+    u = _gather(img.peekUncertainty(), channels, indices)
+    bad = _gather(img.peekDQ(), channels, indices) & BAD
+    good = bad == 0
+
+    counts = np.add.reduceat(good, starts, axis=0, dtype=np.int64)
+    dqs = np.bitwise_or.reduceat(bad, starts, axis=0)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        means = np.add.reduceat(np.where(good, n, 0), starts, axis=0, dtype=np.float64) / counts
+        # the variance of the nominal values, from the deviation of each pixel from the mean of its ROI
+        dev = np.where(good, n - np.repeat(means, sizes, axis=0), 0)
+        var = np.add.reduceat(dev * dev, starts, axis=0) / counts
+        if not ignorePixSD and not isZeroPlane(u):
+            # we're going to try to take account of the uncertainties of each pixel:
+            # "Thus the variance of the pooled set is the mean of the variances plus the variance of the means."
+            # by https://arxiv.org/ftp/arxiv/papers/1007/1007.1012.pdf
+            # The calculation assumes that the number of samples that went into each point is the same.
+            var += np.add.reduceat(np.where(good, u * u, 0), starts, axis=0, dtype=np.float64) / counts
+    sds = np.sqrt(var)
+
+    for row, i in enumerate(used):
+        for cc in chans:
+            if counts[row, cc] > 0:
+                out[i][cc] = SpectrumValue(Value(np.float32(means[row, cc]), np.float32(sds[row, cc]),
+                                                 dqs[row, cc]), int(counts[row, cc]))
+    return out
+
+
+def _spectrumChannels(img: ImageCube) -> Tuple[List[Filter], List[int]]:
+    """Get the filters for each channel of an image, and the indices of the channels which have a single source
+    with a filter (and so can be used in a spectrum)."""
+    filters = [img.filter(x) for x in range(img.channels)]
+    chans = [x for x in range(img.channels) if filters[x] is not None]
+    if len(chans) == 0:
+        raise XFormException("DATA", "no single-wavelength channels in image")
+    return filters, chans
 
 
 @dataclass
@@ -105,18 +145,17 @@ class Spectrum:
     # but later we might separate imagecubes from spectra.
     channels: int
 
-    def __init__(self, img: ImageCube, roi: Optional[ROI] = None, ignorePixSD=False):
+    def __init__(self, img: ImageCube, roi: Optional[ROI] = None, ignorePixSD=False,
+                 values: Optional[Dict[int, SpectrumValue]] = None):
+        """Extract the spectrum from an image or an ROI in it. If values is given, it's the result of
+        extractValues() for this ROI (see extractAll())."""
         self.img = img
         self.roi = roi
-        self.data = {}
         self.channels = img.channels
 
         # first, generate a list of indices of channels with a single source which has a filter,
         # and a list of those filters.
-        self.filters = [img.filter(x) for x in range(img.channels)]
-        chans = [x for x in range(img.channels) if self.filters[x] is not None]
-        if len(chans) == 0:
-            raise XFormException("DATA", "no single-wavelength channels in image")
+        self.filters, chans = _spectrumChannels(img)
 
         # create a set of sources
         sources = set()
@@ -124,45 +163,17 @@ class Spectrum:
             sources |= img.sources.sourceSets[x].sourceSet
         self.sources = SourceSet(sources)
 
-        subimg = img.subimage(roi=roi)
+        if values is None:
+            values = extractValues(img, [roi], chans, ignorePixSD=ignorePixSD)[0]
+        # we don't add "bad" data - channels where all the pixels are bad won't be in the values.
+        self.data = {self.filters[cc]: v for cc, v in values.items()}
 
-        # todo refactor this - there's a lot of duplication
-        if len(chans) == 1:
-            # single channel images are stored as 2D arrays.
-            mean, sd, allBitsDQ = getMeanValue(subimg.img[:, :], subimg.uncertainty[:, :], subimg.dq[:, :],
-                                               subimg.mask,
-                                               ignorePixSD=ignorePixSD)
-            # we don't add "bad" data
-            if allBitsDQ != 0:
-                # the channel number will be chans[0] (there is only one)
-                # the filter will be filters[chans[0]]
-                f = self.filters[chans[0]]
-                # subtract bad pixels from the pixel count
-                dq = subimg.maskedDQ()
-                # this will compress the array (give a 1D array of all the unmasked pixels) and then
-                # count. It's how you count non-zero values in a masked array.
-                pixct = subimg.pixelCount() - np.count_nonzero(dq.compressed())
-                dq = np.bitwise_or.reduce(dq, axis=None) & BAD  # OR all the bad bits together
-                self.data[f] = SpectrumValue(Value(mean, sd, dq), pixct)
-        else:
-            for cc in chans:
-                mean, sd, allBitsDQ = getMeanValue(subimg.img[:, :, cc], subimg.uncertainty[:, :, cc],
-                                                   subimg.dq[:, :, cc],
-                                                   subimg.mask,
-                                                   ignorePixSD=ignorePixSD)
-                # we don't add "bad" data
-                if allBitsDQ == 0:
-                    # the channel number will be cc
-                    # the filter will be filters[cc]
-                    f = self.filters[cc]
-                    # subtract bad pixels from the pixel count
-                    dq = subimg.maskedDQ()[:, :, cc]  # get the masked DQ, extract one channel
-                    # this will compress the array (give a 1D array of all the unmasked pixels) and then
-                    # count. It's how you count non-zero values in a masked array. We only worry about
-                    # the BAD pixels.
-                    pixct = subimg.pixelCount() - np.count_nonzero(dq.compressed() & BAD)
-                    dq = np.bitwise_or.reduce(dq, axis=None) & BAD  # OR all the bad bits together
-                    self.data[f] = SpectrumValue(Value(mean, sd, dq), pixct)
+    @classmethod
+    def extractAll(cls, img: ImageCube, rois: List[ROI], ignorePixSD=False) -> List['Spectrum']:
+        """Extract spectra for several ROIs in an image, which is much faster than doing them one at a time"""
+        _, chans = _spectrumChannels(img)
+        values = extractValues(img, rois, chans, ignorePixSD=ignorePixSD)
+        return [cls(img, roi, ignorePixSD=ignorePixSD, values=v) for roi, v in zip(rois, values)]
 
     def get(self, cwlOrName) -> Optional[SpectrumValue]:
         """get the value and pixel count for a particular channel wavelength or filter name"""
@@ -297,12 +308,11 @@ class SpectrumSet(dict, SourcesObtainable):
                 # there are multiple ROIs in this image cube. We may need to prefix
                 # the ROI name with the image cube name to disambiguate them if
                 # there are multiple ROIs with the same name in different image cubes.
-                for r in img.rois:
-                    if r.bb() is None:
-                        # this is an invalid ROI; we'll skip it.
-                        continue
+                # This is done for all the ROIs at once.
+                rois = [r for r in img.rois if r.bb() is not None]  # skip invalid ROIs
+                for r, spec in zip(rois, Spectrum.extractAll(img, rois, ignorePixSD=ignorePixSD)):
                     legend = resolver.resolve(name, r)
-                    data[legend] = Spectrum(img, roi=r, ignorePixSD=ignorePixSD)
+                    data[legend] = spec
                     cols[legend] = r.colour
 
         # we now have a dictionary of spectra, keyed by name, and similarly
@@ -0,0 +1,108 @@
+"""
+Cached range statistics for images, used by the canvas to find normalisation ranges.
+
+Finding the minimum and maximum of a big multi-band image is a full scan, and the canvas needs them on every
+repaint (which happens whenever the mouse moves). A TileStats object scans the image once, the first time it
+is asked, and records the minimum and maximum of each band in each square tile. After that the range of the
+whole image comes from the tile summaries, and the range of a rectangle comes from the summaries of the tiles
+entirely inside it plus a scan of the thin strips around the edge.
+
+The statistics aren't updated if the image changes, so a new TileStats should be made for a new image (the
+canvas does this whenever it is given an image to display).
+"""
+
+import threading
+from typing import Optional, Tuple
+
+import numpy as np
+
+# the default size of a tile in pixels
+TILESIZE = 64
+
+
+class TileStats:
+    """Per-band minimum and maximum of an image (h x w or h x w x bands), overall and for rectangles,
+    found from per-tile summaries which are built the first time they are needed."""
+
+    def __init__(self, img: np.ndarray, tileSize: int = TILESIZE):
+        self.source = img  # the array we were made for
+        self.img = img if img.ndim == 3 else img[:, :, np.newaxis]
+        self.tileSize = tileSize
+        self.tileMin = None
+        self.tileMax = None
+        self.lock = threading.Lock()
+
+    @property
+    def built(self) -> bool:
+        """True if the tile summaries have been calculated"""
+        return self.tileMin is not None
+
+    def _build(self):
+        """Calculate the min and max of each band in each tile, a row of tiles at a time so that the
+        temporary arrays are small"""
+        with self.lock:
+            if self.tileMin is not None:
+                return
+            h, w, bands = self.img.shape
+            t = self.tileSize
+            cols = np.arange(0, w, t)
+            shape = ((h + t - 1) // t, len(cols), bands)
+            mn = np.empty(shape, dtype=self.img.dtype)
+            mx = np.empty(shape, dtype=self.img.dtype)
+            for i, y in enumerate(range(0, h, t)):
+                strip = self.img[y:y + t]
+                mn[i] = np.minimum.reduceat(strip, cols, axis=1).min(axis=0)
+                mx[i] = np.maximum.reduceat(strip, cols, axis=1).max(axis=0)
+            self.tileMin, self.tileMax = mn, mx
+
+    def _tiles(self, rect: Optional[Tuple[int, int, int, int]]):
+        """Clip a rectangle to the image, returning its corners and the range of tiles which lie entirely
+        inside it (the last tile in each direction may be short). There are no such tiles if tx1<=tx0
+        or ty1<=ty0."""
+        h, w = self.img.shape[:2]
+        if h == 0 or w == 0:
+            raise ValueError("cannot find the range of an empty image")
+        if rect is None:
+            x0, y0, x1, y1 = 0, 0, w, h
+        else:
+            x, y, rw, rh = rect
+            x0, y0 = max(0, x), max(0, y)
+            x1, y1 = min(w, x + rw), min(h, y + rh)
+            if x1 <= x0 or y1 <= y0:
+                raise ValueError("cannot find the range of an empty rectangle")
+
+        t = self.tileSize
+        tx0, ty0 = -(-x0 // t), -(-y0 // t)
+        tx1 = w // t + (w % t > 0) if x1 == w else x1 // t
+        ty1 = h // t + (h % t > 0) if y1 == h else y1 // t
+        return (x0, y0, x1, y1), (tx0, ty0, tx1, ty1)
+
+    def needsBuild(self, rect: Optional[Tuple[int, int, int, int]] = None) -> bool:
+        """True if finding the range of a rectangle (or the whole image) would mean building the tile
+        summaries - i.e. a scan of the whole image."""
+        _, (tx0, ty0, tx1, ty1) = self._tiles(rect)
+        return not self.built and tx1 > tx0 and ty1 > ty0
+
+    def range(self, rect: Optional[Tuple[int, int, int, int]] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """Return arrays of the minimum and maximum of each band, either for the whole image or for
+        a rectangle x,y,w,h in it (which will be clipped to the image)."""
+        (x0, y0, x1, y1), (tx0, ty0, tx1, ty1) = self._tiles(rect)
+        if tx1 <= tx0 or ty1 <= ty0:
+            # too small for any whole tiles, so just scan it
+            sub = self.img[y0:y1, x0:x1]
+            return sub.min(axis=(0, 1)), sub.max(axis=(0, 1))
+
+        self._build()
+        mins = [self.tileMin[ty0:ty1, tx0:tx1].min(axis=(0, 1))]
+        maxs = [self.tileMax[ty0:ty1, tx0:tx1].max(axis=(0, 1))]
+        # now the parts of the rectangle around the edges of those tiles
+        h, w = self.img.shape[:2]
+        t = self.tileSize
+        ix0, iy0 = tx0 * t, ty0 * t
+        ix1, iy1 = min(w, tx1 * t), min(h, ty1 * t)
+        for sub in (self.img[y0:iy0, x0:x1], self.img[iy1:y1, x0:x1],
+                    self.img[iy0:iy1, x0:ix0], self.img[iy0:iy1, ix1:x1]):
+            if sub.size > 0:
+                mins.append(sub.min(axis=(0, 1)))
+                maxs.append(sub.max(axis=(0, 1)))
+        return np.min(mins, axis=0), np.max(maxs, axis=0)
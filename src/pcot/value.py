@@ -6,11 +6,34 @@ import numpy as np
 from numpy.typing import NDArray
 
 from pcot import dq, config
+from pcot.utils import image
 from pcot.utils.maths import pooled_sd
 
 
+def _noUnc(u):
+    """True if an uncertainty is zero everywhere, without having to look at each element: it is either
+    a scalar zero or a constant zero plane (see utils.image.constantPlane)"""
+    return u == 0 if np.isscalar(u) else image.isZeroPlane(u)
+
+
+def zeroUnc(ua, ub):
+    """If both uncertainties are known to be zero, return a zero uncertainty for the result of an
+    operation on them (which will be zero for all the operations below), otherwise None. This lets us skip
+    the uncertainty calculation when neither operand has uncertainty."""
+    if not (_noUnc(ua) and _noUnc(ub)):
+        return None
+    if np.isscalar(ua):
+        return ub
+    if np.isscalar(ub) or np.shape(ua) == np.shape(ub):
+        return ua
+    return None
+
+
 def add_sub_unc(ua, ub):
     """For addition and subtraction, errors add in quadrature"""
+    z = zeroUnc(ua, ub)
+    if z is not None:
+        return z
     return np.sqrt(ua ** 2 + ub ** 2)
 
 
@@ -22,6 +45,9 @@ def add_sub_unc_list(lst):
 def mul_unc(a, ua, b, ub):
     """Multiplication - this is derived from the standard answer
     (thanks, Wolfram!) assuming the values are real"""
+    z = zeroUnc(ua, ub)
+    if z is not None:
+        return z
     # This is the "standard answer" - you can confirm it's the same when all unc values are non-negative
     # return np.abs(a*b) * np.sqrt((ua/a)**2 + (ub/b)**2)
 
@@ -32,6 +58,9 @@ def mul_unc(a, ua, b, ub):
 def div_unc(a, ua, b, ub):
     """Division. Also derived from the standard answer.
     """
+    z = zeroUnc(ua, ub)
+    if z is not None:
+        return z
     #   standard answer - throws exceptions with either a or b is 0.
     # return np.abs(a/b) * np.sqrt((ua/a)**2 + (ub/b)**2)
 
@@ -131,7 +160,8 @@ def combineDQs(a, b, extra=None):
         if r is None:
             r = extra
         else:
-            r |= extra
+            # not |=, because r may be one of the DQ arrays we were given
+            r = r | extra
 
     return r
 
@@ -182,9 +212,9 @@ class Value:
         else:
             # N is an array. If U or DQ are scalar, convert to arrays of the same shape
             if np.isscalar(u):
-                u = np.full(n.shape, u, dtype=np.float32)
+                u = image.constantPlane(n.shape, np.float32, u)
             if np.isscalar(d):
-                d = np.full(n.shape, d, dtype=np.uint16)
+                d = image.constantPlane(n.shape, np.uint16, d)
 
             # check all arrays are same shape
             if n.shape != u.shape or n.shape != d.shape:
@@ -256,7 +286,9 @@ class Value:
     def __truediv__(self, other):
         try:
             n = np.where(other.n == 0, 0, self.n / other.n)
-            u = np.where(other.n == 0, 0, div_unc(self.n, self.u, other.n, other.u))
+            u = zeroUnc(self.u, other.u)
+            if u is None:
+                u = np.where(other.n == 0, 0, div_unc(self.n, self.u, other.n, other.u))
 
             extra = np.where(other.n == 0, dq.DIVZERO, dq.NONE) | \
                     np.where((other.n == 0) & (self.n == 0), dq.UNDEF, dq.NONE)
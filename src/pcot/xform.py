@@ -5,6 +5,7 @@ Their behaviour is controlled by the XFormType object to which they link via the
 import base64
 import copy
 import hashlib
+import heapq
 import inspect
 import json
 import time
@@ -13,22 +14,19 @@ import logging
 import sys
 import uuid
 from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 from html import escape
 from io import BytesIO
 from typing import List, Dict, Tuple, ClassVar, Optional, TYPE_CHECKING, Callable, Union, Any, Set
 
 import pyperclip
 
-import pcot.macros
 import pcot.ui as ui
 from pcot import datum
 from pcot.datum import Datum
 
 from pcot.sources import nullSourceSet, MultiBandSource
-from pcot.ui import graphscene
-from pcot.ui.canvas import Canvas
-from pcot.ui.tabs import Tab
-from pcot.utils import archive
+from pcot.utils import archive, nodecache
 
 if TYPE_CHECKING:
     from macros import XFormMacro, MacroInstance
@@ -202,6 +200,15 @@ class XFormType:
         # which run after them). It also never skips due to unset inputs, because these might be because the
         # parent node threw an exception.
         self.alwaysRunAfter = False
+        # If this is true, the type's perform() method doesn't touch the UI or any state shared between nodes
+        # (other than reading its inputs) so it can be run in a worker thread when the graph is run in
+        # parallel (see XFormGraph.threads).
+        self.threadSafe = False
+        # If this is true, the node's outputs depend only on its params, its inputs, its mapping and whether
+        # it is enabled. If none of those have changed since the node last ran, it won't run again - its previous
+        # outputs will be reused (see fingerprint()). Types which keep other state, or override clearData(),
+        # should leave this false.
+        self.reusable = False
 
         # If this is not None, then this type has a set of parameters which can be
         # edited in a parameter file. These will be serialised using a different
@@ -285,6 +292,40 @@ class XFormType:
 
     # DOWN HERE ARE METHODS YOU MAY NEED TO OVERRIDE WHEN WRITING NODE TYPES
 
+    def fingerprint(self, node) -> Tuple[Any, Tuple]:
+        """Only used if the type is reusable. Returns a (key, objects) pair describing everything which affects
+        the node's output other than its inputs: key is plain data which is compared by value, objects is a tuple
+        which is compared by identity. By default this is the serialised params and the node's mapping; override
+        (calling this) if the output depends on something else, such as an input in the document."""
+        key = None if node.params is None else json.dumps(node.params.serialise(), sort_keys=True, default=str)
+        return key, (node.mapping,)
+
+    def contentHash(self, node) -> Optional[str]:
+        """Only used if the type is reusable and the node cache is enabled (see utils/nodecache.py). Returns
+        a hash of everything the node's outputs depend on: the type's name, version and source, the key from
+        fingerprint() and the hashes of the nodes feeding the inputs. Returns None if any of those nodes has
+        no hash, in which case the cache won't be used. Override this (as input nodes do) if the output depends
+        on data which doesn't come through the inputs."""
+        h = hashlib.sha256()
+        key, _ = self.fingerprint(node)
+        h.update(json.dumps([self.name, self.ver, self.md5(), key, node.enabled or node.graph.forceRunDisabled],
+                            default=str).encode())
+        for inp in node.inputs:
+            if inp is None:
+                h.update(b"none")
+            else:
+                parent, i = inp
+                if parent.contentHash is None:
+                    return None
+                h.update(f"{parent.contentHash}/{i}".encode())
+        return h.hexdigest()
+
+    def outputsRestored(self, node):
+        """Called when a node's outputs have been read from the node cache instead of running perform().
+        Override this to set any data perform() would normally set from the outputs (output types,
+        images for display and so on)."""
+        pass
+
     def generateOutputTypes(self, node):
         """this is overriden if a node might change its output type depending on its input types.
             It's called when an input connection is made or broken, and is followed
@@ -410,6 +451,14 @@ class XFormType:
         return 0, 0, 0
 
 
+def sameFingerprint(a, b):
+    """Compare two node fingerprints (see XForm.fingerprint). The first element is compared by value, the second
+    is a tuple of objects (Datums, mappings...) which must be the very same objects."""
+    if a is None or b is None:
+        return False
+    return a[0] == b[0] and len(a[1]) == len(b[1]) and all(x is y for x, y in zip(a[1], b[1]))
+
+
 def serialiseConn(c, connSet):
     """serialise a connection (xform,i) into (xformName,i).
     Will only serialise connections within the set passed in. If None is passed
@@ -428,9 +477,6 @@ class BadTypeException(Exception):
         super().__init__("incorrect output type requested, index {}".format(i))
 
 
-performDepth = 0
-
-
 class XForm:
     """an actual instance of a transformation, often called a "node"."""
 
@@ -484,6 +530,11 @@ class XForm:
     # has this node run already in this graph.perform cycle?
     hasRun: bool
 
+    ## @var lastRun
+    # if the type is reusable, the fingerprint (see XFormType.fingerprint), outputs, error and rect text
+    # from the last time the node ran, so the outputs can be reused if the fingerprint hasn't changed.
+    lastRun: Optional[Tuple[Tuple, List[Optional[Datum]], Optional[XFormException], Optional[str]]]
+
     ## @var graph
     # the graph to which I belong
     graph: 'XFormGraph'
@@ -577,6 +628,9 @@ class XForm:
         self.rect = None  # the main GMainRect rectangle
         self.enabled = tp.startEnabled  # a lot of nodes won't use; see XFormType.
         self.hasRun = False  # used to mark a node as already having performed its stuff
+        self.lastRun = None  # used to reuse outputs when nothing has changed
+        self.runFingerprint = None
+        self.contentHash = None  # used to look up the outputs in the on-disk node cache
         self.inUIChange = False
         # all nodes have a channel mapping, because it's easier. See docs for that class.
         self.mapping = ChannelMapping()
@@ -971,71 +1025,139 @@ class XForm:
             x.nodeChanged()
             x.updateError()
 
-    ## perform the transformation; delegated to the type object - recurses down the children.
-    # Also tells any tab open on a node that its node has changed.
-    # DO NOT CALL DIRECTLY - called either from itself or from performNodes.
-    def perform(self, isAlwaysRunAfter=False, run_children=True):
-        global performDepth
-
-        # don't run "always run after" special nodes unless we're allowed.
-        if self.type.alwaysRunAfter and not isAlwaysRunAfter:
-            return
-
+    ## perform the transformation; delegated to the type object. Also tells any tab open on a node
+    # that its node has changed. Children are not run from here - the graph works out the order
+    # in which nodes should run (see XFormGraph.performNodes) and calls this once per node.
+    # DO NOT CALL DIRECTLY - called from performNodes.
+    def perform(self, isAlwaysRunAfter=False):
         # used to stop perform being called out of context; it should
         # only be called inside the graph's perform.
         if not self.graph.performingGraph:
             raise Exception("Do not call perform directly on a node!")
-        self.timesPerformed += 1
         try:
-            # must clear this with prePerform on the graph, or nodes will
-            # only run once!
-            if self.hasRun:
-                logger.debug(f"----Skipping {self.debugName()}, run already this action")
-            elif not self.canRun():
-                logger.debug(f"----Skipping {self.debugName()}, it can't run (unset inputs)")
-            else:
-                logger.debug(f"---------------------------------{'-' * performDepth}Performing {self.debugName()}")
-                # now run the node, catching any XFormException
-                try:
-                    st = time.perf_counter()
-                    self.type.uichange(self)
-                    # here we check that the node is enabled. If it is NOT, we set all the outputs to None.
-                    # Thus a disabled node will behave exactly as if it has an unconnected input
-                    # (as in test_node_output_none)
-                    # We also check the forceRunDisabled flag in the graph - this is set when we want to
-                    # force all nodes - disabled or not - to run. Typically this is done from a script.
-                    if self.enabled or self.graph.forceRunDisabled:
-                        ui.msg("Performing {}".format(self.debugName()))
-                        # before and after performing the node, we update the graphics and force an event loop
-                        # so the user sees progress.
-                        if self.graph.scene:
-                            self.graph.scene.performing(self)
-                        self.type.perform(self)
-                    else:
-                        # this may end up being done twice, because we do it to all nodes before we run the graph
-                        self.clearOutputsAndTempData()
-                    self.runTime = time.perf_counter() - st
-                except XFormException as e:
-                    # exception caught, set the error. Children will still run.
-                    self.setError(e)
-                self.hasRun = True
-                # tell the tab that this node has changed
-                self.updateTabs()
-
-                if run_children:
-                    # this is a hack to let us guarantee the order children are processed,
-                    # by sorting them by display name. Used in testing.
-                    sorted_children = sorted(self.children.keys(), key=lambda xx: xx.displayName)
-
-                    # run each child (could turn off child processing?)
-                    performDepth += 1
-                    for n in sorted_children:
-                        n.perform()
-                    performDepth -= 1
+            if self.startPerform(isAlwaysRunAfter):
+                self.performType()
+                self.finishPerform()
         except Exception as e:
             traceback.print_exc()
             ui.logXFormException(self, e)
 
+    def startPerform(self, isAlwaysRunAfter=False) -> bool:
+        """The first part of perform(), which must be done in the main thread: check the node can run,
+        call the type's uichange and update the graph display. Returns true if performType() should now be
+        called, which may happen in another thread if the type is thread-safe. Once that has finished,
+        finishPerform() should be called in the main thread."""
+
+        # don't run "always run after" special nodes unless we're allowed.
+        if self.type.alwaysRunAfter and not isAlwaysRunAfter:
+            return False
+        # must clear this with prePerform on the graph, or nodes will
+        # only run once!
+        if self.hasRun:
+            logger.debug(f"----Skipping {self.debugName()}, run already this action")
+            return False
+        if not self.canRun():
+            logger.debug(f"----Skipping {self.debugName()}, it can't run (unset inputs)")
+            return False
+
+        self.runFingerprint = self.fingerprint()
+        if self.lastRun is not None and sameFingerprint(self.runFingerprint, self.lastRun[0]):
+            # nothing has changed since we last ran, so put back the old outputs instead
+            logger.debug(f"----Reusing outputs of {self.debugName()}, fingerprint unchanged")
+            _, outputs, self.error, self.rectText = self.lastRun
+            self.outputs = list(outputs)
+            self.hasRun = True
+            self.outdated = False
+            return False
+        self.lastRun = None
+
+        self.contentHash = None
+        if self.type.reusable and (cache := nodecache.getCache()) is not None:
+            self.contentHash = self.type.contentHash(self)
+            # nodes with no inputs are cheap to run (or, like inputs, have to run to get their hash anyway)
+            if self.contentHash is not None and len(self.inputs) > 0 and self.restoreFromCache(cache):
+                return False
+
+        logger.debug(f"---------------------------------Performing {self.debugName()}")
+        self.timesPerformed += 1
+        self.hasRun = True
+        self.runTime = 0
+        try:
+            self.type.uichange(self)
+        except XFormException as e:
+            self.setError(e)
+            self.finishPerform()
+            return False
+
+        # here we check that the node is enabled. If it is NOT, we set all the outputs to None.
+        # Thus a disabled node will behave exactly as if it has an unconnected input
+        # (as in test_node_output_none)
+        # We also check the forceRunDisabled flag in the graph - this is set when we want to
+        # force all nodes - disabled or not - to run. Typically this is done from a script.
+        if self.enabled or self.graph.forceRunDisabled:
+            ui.msg("Performing {}".format(self.debugName()))
+            # before and after performing the node, we update the graphics and force an event loop
+            # so the user sees progress.
+            if self.graph.scene:
+                self.graph.scene.performing(self)
+            return True
+        else:
+            # this may end up being done twice, because we do it to all nodes before we run the graph
+            self.clearOutputsAndTempData()
+            self.finishPerform()
+            return False
+
+    def performType(self):
+        """Run the type's perform method on the node, catching any XFormException (which will set the error
+        state; children will still run). This must not touch the UI, because it is run in a worker thread
+        when the graph is running in parallel and the type is thread-safe."""
+        st = time.perf_counter()
+        try:
+            self.type.perform(self)
+        except XFormException as e:
+            self.setError(e)
+        self.runTime = time.perf_counter() - st
+
+    def finishPerform(self):
+        """The last part of perform(), done in the main thread: record what we need to reuse the outputs
+        next time if nothing changes, and tell the tabs that this node has changed"""
+        if self.runFingerprint is not None:
+            self.lastRun = (self.runFingerprint, list(self.outputs), self.error, self.rectText)
+        if self.contentHash is not None and len(self.inputs) > 0 and self.error is None \
+                and all(nodecache.canStore(d) for d in self.outputs):
+            cache = nodecache.getCache()
+            if cache is not None:
+                cache.put(self.contentHash, self.outputs, self.rectText)
+        self.updateTabs()
+
+    def restoreFromCache(self, cache: 'nodecache.NodeCache') -> bool:
+        """Try to set the outputs from the node cache entry for our content hash instead of performing.
+        Returns true if there was such an entry."""
+        entry = cache.get(self.contentHash)
+        if entry is None or len(entry[0]) != len(self.outputs):
+            return False
+        logger.debug(f"----Restoring outputs of {self.debugName()} from the node cache")
+        self.outputs, self.rectText = entry
+        for d in self.outputs:
+            if d is not None and d.isImage() and d.val is not None:
+                d.val.setMapping(self.mapping)
+        self.type.outputsRestored(self)
+        self.hasRun = True
+        self.outdated = False
+        self.finishPerform()
+        return True
+
+    def fingerprint(self) -> Optional[Tuple]:
+        """If the type is reusable, return a fingerprint of everything the node's outputs depend on: the type's
+        fingerprint (usually the params and mapping), whether the node will run enabled, and the Datum objects on
+        its inputs. Parents which reused their outputs will give us the same Datum objects, so we can be reused too.
+        Returns None if the type isn't reusable."""
+        if not self.type.reusable:
+            return None
+        key, objects = self.type.fingerprint(self)
+        inputs = tuple(None if inp is None else inp[0].outputs[inp[1]] for inp in self.inputs)
+        return (key, self.enabled or self.graph.forceRunDisabled), objects + inputs
+
     def getInput(self, i: int, tp=None):
         """get the value of an input.
             Optional type; if passed in will check for that type and dereference the contents if
@@ -1144,6 +1266,11 @@ class XFormGraph:
     # force all nodes to run, even if they are disabled
     forceRunDisabled: bool
 
+    # number of worker threads to use when performing nodes. If this is more than 1, nodes whose types
+    # are thread-safe run in a pool of this many threads as soon as their inputs are ready. Off by default.
+    threads: ClassVar[int]
+    threads = 1
+
     def __init__(self, doc, isMacro):
         """constructor, takes whether the graph is a macro prototype or not"""
         self.proto = None
@@ -1285,16 +1412,61 @@ class XFormGraph:
         for n in root.children:
             self.visit(n, fn)
 
-    ## we are about to perform some nodes due to a UI change, so reset errors, hasRun flag, and outputs
-    # of the descendants of the node we are running (or all nodes if we are running the entire graph)
-    def prePerform(self, root: Optional[XForm]):
-        self.rebuildTabsAfterPerform = False
-        nodeset = set()
-        if root is not None:
-            self.visit(root, lambda x: nodeset.add(x))
-        else:
-            nodeset = set(self.nodes)
+    def descendants(self, root: XForm) -> Set[XForm]:
+        """Return a set of the root node and all the nodes below it. Unlike visit(), each node
+        is only looked at once however many paths lead to it."""
+        found = {root}
+        queue = deque([root])
+        while len(queue) > 0:
+            for n in queue.popleft().children:
+                if n not in found:
+                    found.add(n)
+                    queue.append(n)
+        return found
+
+    def topologicalOrder(self, root: Optional[XForm] = None) -> List[XForm]:
+        """Return the nodes which should be performed when root changes (or all nodes if root is None)
+        in an order which guarantees that every node comes after all the nodes it takes inputs from.
+        This uses Kahn's algorithm, so each node appears exactly once however many parents it has.
+
+        When several nodes are ready at the same time we pick them by display name, which keeps the
+        order stable from run to run (tests rely on this). Nodes whose type has alwaysRunAfter set are
+        only picked when there is nothing else ready, so they run after everything else - except their
+        own children, which become ready once they have run.
+        """
+        nodeset = set(self.nodes) if root is None else self.descendants(root)
+        # index of each node in the graph's node list, used to break ties between nodes with the same name
+        seq = {n: i for i, n in enumerate(self.nodes)}
+        # count the parents of each node which are also in the set we're going to run
+        indegree = {n: 0 for n in nodeset}
         for n in nodeset:
+            for c in n.children:
+                if c in nodeset:
+                    indegree[c] += 1
+
+        ready = [(n.type.alwaysRunAfter, n.displayName, seq.get(n, -1), n) for n in nodeset if indegree[n] == 0]
+        heapq.heapify(ready)
+        order = []
+        while len(ready) > 0:
+            n = heapq.heappop(ready)[-1]
+            order.append(n)
+            for c in n.children:
+                if c in nodeset:
+                    indegree[c] -= 1
+                    if indegree[c] == 0:
+                        heapq.heappush(ready, (c.type.alwaysRunAfter, c.displayName, seq.get(c, -1), c))
+
+        if len(order) != len(nodeset):
+            # can't happen unless connect() has let a cycle through
+            raise XFormException('GRPH', "cycle detected in graph")
+        return order
+
+    def prePerform(self, nodes: List[XForm]):
+        """we are about to perform some nodes due to a UI change, so reset errors, hasRun flag, and outputs
+        of the nodes we are about to run (the descendants of the node we are running, or all nodes if we
+        are running the entire graph)"""
+        self.rebuildTabsAfterPerform = False
+        for n in nodes:
             n.clearErrorAndRectText()
             n.clearOutputsAndTempData()
             n.hasRun = False
@@ -1357,7 +1529,7 @@ class XFormGraph:
             ui.msg("Autorun not enabled")
 
         # make sure the caption in any attached window is correct.
-        for xx in ui.mainwindow.MainUI.windows:
+        for xx in ui.mainWindows():
             if xx.graph == self:
                 xx.setCaption(self.doc.settings.captionType)
 
@@ -1366,7 +1538,7 @@ class XFormGraph:
 
     def performNodes(self, node=None):
         """perform the entire graph, or all those nodes below a given node (if autorun is true).
-            If the entire graph, performs a traversal from the root nodes (and always runs children)
+            The nodes are run in topological order (see topologicalOrder()), so each node runs once.
             """
         # if we are already running this method, exit. This
         # will be atomic because GIL. The use case here can
@@ -1376,21 +1548,23 @@ class XFormGraph:
         if self.performingGraph:
             return
 
-        self.prePerform(node)
+        # work out the order in which to run the nodes - this will be every node if we are running the whole
+        # graph, or the node and its descendants if not. Each node is run once, after all its inputs are ready.
+        order = self.topologicalOrder(node)
+        self.prePerform(order)
+        if node is not None and not XFormGraph.autoRun:
+            # outputs below the node have been cleared, but we only run the node itself
+            order = [node]
+
         self.performingGraph = True
-        if node is None:
-            for n in self.nodes:
-                # identify root nodes (no connected inputs) which are NOT alwaysRun.
-                if all(i is None for i in n.inputs) and not n.type.alwaysRunAfter:
-                    n.perform()
-            # having run the root nodes, run those nodes which have the 'alwaysRunAfter' flag
-            # in their type. These are used in testing.
-            for n in self.nodes:
-                if n.type.alwaysRunAfter:
-                    n.perform(isAlwaysRunAfter=True)
+        # "always run after" nodes are only run when we are running the entire graph. They are used
+        # in testing. A node which can't run (because an input node didn't produce an output) is skipped,
+        # and so will its children be.
+        if XFormGraph.threads > 1 and len(order) > 1:
+            self.performParallel(order, isAlwaysRunAfter=node is None)
         else:
-            # we're running an explicit node
-            node.perform(run_children=XFormGraph.autoRun)
+            for n in order:
+                n.perform(isAlwaysRunAfter=node is None)
         self.performingGraph = False
 
         self.showPerformance()
@@ -1399,9 +1573,61 @@ class XFormGraph:
         self.rebuildGraphics()
         if self.rebuildTabsAfterPerform:
             self.rebuildTabsAfterPerform = False
-            ui.mainwindow.MainUI.rebuildAll(scene=False)
+            if ui.mainWindows():
+                ui.mainwindow.MainUI.rebuildAll(scene=False)
         ui.msg("Perform complete")
 
+    def performParallel(self, order: List[XForm], isAlwaysRunAfter: bool):
+        """Perform a list of nodes in topological order (from topologicalOrder()), running the types which
+        are thread-safe in a pool of worker threads as soon as all their inputs are ready. Only
+        XForm.performType() runs in the workers - everything which touches the UI, and the whole of perform
+        for types which aren't thread-safe, is still done in this (the main) thread."""
+        nodeset = set(order)
+        position = {n: i for i, n in enumerate(order)}
+        # the number of parents of each node we are waiting for
+        waiting = {n: len({inp[0] for inp in n.inputs if inp is not None and inp[0] in nodeset}) for n in order}
+        # the ready list is a heap of positions in the order, so we start nodes in that order where we can
+        ready = [position[n] for n in order if waiting[n] == 0]
+        heapq.heapify(ready)
+        running = {}  # future -> node
+
+        def release(n):
+            # node has finished (or been skipped) so its children are waiting for one fewer parent
+            for c in n.children:
+                if c in nodeset:
+                    waiting[c] -= 1
+                    if waiting[c] == 0:
+                        heapq.heappush(ready, position[c])
+
+        with ThreadPoolExecutor(max_workers=XFormGraph.threads, thread_name_prefix="perform") as pool:
+            while len(ready) > 0 or len(running) > 0:
+                # "always run after" nodes have to wait until everything else has finished
+                if len(ready) > 0 and not (order[ready[0]].type.alwaysRunAfter and len(running) > 0):
+                    n = order[heapq.heappop(ready)]
+                    try:
+                        if n.startPerform(isAlwaysRunAfter):
+                            if n.type.threadSafe:
+                                running[pool.submit(n.performType)] = n
+                                continue
+                            n.performType()
+                            n.finishPerform()
+                    except Exception as e:
+                        traceback.print_exc()
+                        ui.logXFormException(n, e)
+                    release(n)
+                else:
+                    # there's nothing we can start, so wait for a worker to finish
+                    finished, _ = wait(running, return_when=FIRST_COMPLETED)
+                    for f in finished:
+                        n = running.pop(f)
+                        try:
+                            f.result()  # will raise any exception from performType()
+                            n.finishPerform()
+                        except Exception as e:
+                            traceback.print_exc()
+                            ui.logXFormException(n, e)
+                        release(n)
+
     def showPerformance(self):
         """show how long each node took to run"""
         tot = 0
@@ -1649,3 +1875,10 @@ class XFormROIType(XFormType):
 
     def getROIDesc(self, node):
         return "no ROI" if node.roi is None else node.roi.details()
+
+
+# These GUI modules import this one, so they are imported at the end - once everything they need from here
+# has been defined. That way, it doesn't matter which of them gets imported first.
+import pcot.macros
+from pcot.ui import graphscene
+from pcot.ui.canvas import Canvas
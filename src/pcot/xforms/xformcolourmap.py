@@ -431,7 +431,7 @@ class XformColourMap(XFormType):
             source = mono.sources.getSources()
             outimg = ImageCube(mono.rgb(), node.mapping, sources=MultiBandSource([source, source, source]))
             outimg.rois = mono.rois  # copy ROIs in so they are visible if desired
-            out = outimg.modifyWithSub(subimage, newsubimg, keepMapping=True)
+            out = outimg.modifyWithSub(subimage, newsubimg, keepMapping=True, inPlace=True)
         else:
             # save the ROIs, because we're going to need them later
             monoROIs = mono.rois
@@ -459,7 +459,7 @@ class XformColourMap(XFormType):
             roiUnion = ROI.roiUnion(monoROIs)  # may return None if there is an unset ROI
             if roiUnion is not None:
                 subimage.setROI(outimg, roiUnion)
-            out = outimg.modifyWithSub(subimage, newsubimg, keepMapping=True)
+            out = outimg.modifyWithSub(subimage, newsubimg, keepMapping=True, inPlace=True)
 
         fs = "{:." + str(node.params.sigfigs) + "}"
         if out is not None:
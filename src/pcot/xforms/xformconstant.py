@@ -71,6 +71,7 @@ class XFormConstant(XFormType):
     def __init__(self):
         super().__init__("constant", "maths", "0.0.0")
         self.addOutputConnector("", Datum.NUMBER)
+        self.reusable = True
         self.params = TaggedDictType(
             val=("The value of the constant", float, 0.0)
         )
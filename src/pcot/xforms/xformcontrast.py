@@ -68,6 +68,11 @@ class XformContrast(XFormType):
             tol=("Contrast stretch tolerance (between 0% and 50%)", float, 0.2),
             sat=("Set the saturated DQ bit on pixels outside the stretch range", bool, True)
         )
+        # perform() only reads the input and writes the output, so this node can run in a worker thread
+        # when the graph is performed in parallel.
+        self.threadSafe = True
+        # and its output only depends on the input and the parameters, so it can be reused if they don't change.
+        self.reusable = True
 
     # this creates a tab when we want to control a node. See below for the class definition.
     def createTab(self, n, w):
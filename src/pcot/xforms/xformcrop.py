@@ -15,6 +15,8 @@ class XformCropROI(XFormType):
         self.addInputConnector("", Datum.IMG)
         self.addOutputConnector("", Datum.IMG)
         self.params = TaggedDictType()  # no parameters
+        self.threadSafe = True
+        self.reusable = True
 
     def createTab(self, n, w):
         return TabGeneric(n, w)
@@ -20,6 +20,8 @@ class XformCurve(XFormType):
         super().__init__("curve", "processing", "0.0.0", hasEnable=True)
         self.addInputConnector("", Datum.IMG)
         self.addOutputConnector("", Datum.IMG)
+        self.threadSafe = True
+        self.reusable = True
 
         self.params = TaggedDictType(
             mul=("multiplicative factor (done first)", float, 1.0),
@@ -118,7 +118,8 @@ class XFormDQMod(XFormType):
 
 
             # put the data back in, preserving the uncertainty and not setting the NOUNC bit.
-            img = img.modifyWithSub(subimg, None, dqv=fulldq, uncertainty=subimg.uncertainty)
+            # we've already copied the image, so we can modify it in place.
+            img = img.modifyWithSub(subimg, None, dqv=fulldq, uncertainty=subimg.uncertainty, inPlace=True)
         else:
             params.band = None
 
@@ -214,6 +214,8 @@ class XFormExpr(XFormType):
         self.addInputConnector("c", Datum.ANY)
         self.addInputConnector("d", Datum.ANY)
         self.addOutputConnector("", Datum.NONE)   # this changes type dynamically
+        # the output only depends on the expression and the inputs, so the previous output can be reused
+        self.reusable = True
         self.params = TaggedDictType(
             expr=("Expression to evaluate", str, "")
         )
@@ -243,7 +245,8 @@ class XFormExpr(XFormType):
 
     def perform(self, node: XForm):
         # we register the input vars here because we have to, they are temporary and apply to
-        # this run only. To register other things, go to expression/eval.py.
+        # this run only. To register other things, go to expression/eval.py. Variables are looked
+        # up when the expression runs, so this doesn't stop the parser reusing the compiled expression.
 
         self.parser.registerVar('a', 'value of input a', lambda: getvar(node.getInput(0)))
         self.parser.registerVar('b', 'value of input b', lambda: getvar(node.getInput(1)))
@@ -253,27 +256,10 @@ class XFormExpr(XFormType):
         try:
             expr = node.params.expr.strip()
             if len(expr) > 0:
-                # get the previous number of channels (or None if the result is not an image)
-                oldChans = None if node.img is None else node.img.channels
                 # run the expression
                 res = self.parser.run(expr)
                 node.setOutput(0, res)
-                if res is not None:   # should never be None, but I'll leave this in
-                    node.img = None
-                    node.changeOutputType(0, res.tp)   # change the output type
-                    if res.tp.image:
-                        # if there's an image on the output, show it
-                        node.img = res.val
-                        if node.img is not None:
-                            # if the number of channels has changed, reset the mapping
-                            if oldChans is not None and node.img.channels != oldChans:
-                                node.mapping = ChannelMapping()
-                            node.img.setMapping(node.mapping)
-                    node.resultStr = res.tp.getDisplayString(res)
-                    node.setRectText(res.tp.getDisplayString(res, True))
-                else:
-                    # no output, so reset the output type
-                    node.changeOutputType(0, Datum.NONE)
+                self.showResult(node, res)
 
         except Exception as e:
             traceback.print_exc()
@@ -284,6 +270,30 @@ class XFormExpr(XFormType):
             ui.error(f"Error in expression: {str(e)}")
             raise XFormException('EXPR', str(e))
 
+    def showResult(self, node, res):
+        """Set the output type, image and result strings for a result which is on the output"""
+        if res is not None:   # should never be None, but I'll leave this in
+            # get the previous number of channels (or None if the result is not an image)
+            oldChans = None if node.img is None else node.img.channels
+            node.img = None
+            node.changeOutputType(0, res.tp)   # change the output type
+            if res.tp.image:
+                # if there's an image on the output, show it
+                node.img = res.val
+                if node.img is not None:
+                    # if the number of channels has changed, reset the mapping
+                    if oldChans is not None and node.img.channels != oldChans:
+                        node.mapping = ChannelMapping()
+                    node.img.setMapping(node.mapping)
+            node.resultStr = res.tp.getDisplayString(res)
+            node.setRectText(res.tp.getDisplayString(res, True))
+        else:
+            # no output, so reset the output type
+            node.changeOutputType(0, Datum.NONE)
+
+    def outputsRestored(self, node):
+        self.showResult(node, node.outputs[0])
+
 
 class TabExpr(pcot.ui.tabs.Tab):
     def __init__(self, node, w):
@@ -69,6 +69,8 @@ class XformHistEqual(XFormType):
         self.addInputConnector("", Datum.IMG)
         self.addOutputConnector("", Datum.IMG)
         self.params = TaggedDictType()  # no parameters
+        self.threadSafe = True
+        self.reusable = True
 
     def createTab(self, n, w):
         return TabGeneric(n, w)
@@ -1,6 +1,7 @@
 from pcot.datum import Datum
 import pcot.inputs
 from pcot.parameters.taggedaggregates import TaggedDictType
+from pcot.utils import nodecache
 
 from pcot.xform import xformtype, XFormType, XFormException
 from pcot.xforms.tabgeneric import TabGeneric
@@ -13,12 +14,27 @@ class XFormInput(XFormType):
         self.addOutputConnector("", Datum.NONE)   # this changes type dynamically
         self.params = TaggedDictType()  # no parameters
         self.idx = idx
+        self.reusable = True
+
+    def fingerprint(self, node):
+        # the input caches its data until it is invalidated, so if we get the same Datum back the input
+        # hasn't changed and we can reuse our output.
+        key, objects = super().fingerprint(node)
+        return key, objects + (node.graph.doc.inputMgr.inputs[self.idx].get(),)
+
+    def contentHash(self, node):
+        # hash the data itself, which is what everything below us depends on. That's expensive, so only do it
+        # when the input gives us a different Datum.
+        d = node.graph.doc.inputMgr.inputs[self.idx].get()
+        if node.inputHash is None or node.inputHash[0] is not d:
+            node.inputHash = (d, nodecache.hashDatum(d))
+        return node.inputHash[1]
 
     def createTab(self, n, w):
         return TabGeneric(n, w)
 
     def init(self, node):
-        pass
+        node.inputHash = None   # (datum, hash of datum) used by the node cache
 
     def perform(self, node):
         # get hold of the document via the graph, get the input manager, and access
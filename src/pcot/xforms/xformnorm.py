@@ -20,6 +20,8 @@ class XformNormImage(XFormType):
         super().__init__("normimage", "processing", "0.0.0")
         self.addInputConnector("", Datum.IMG)
         self.addOutputConnector("", Datum.IMG)
+        self.threadSafe = True
+        self.reusable = True
 
         self.params = TaggedDictType(
             mode=("Mode - nonzero means clamp, zero means normalise", int, 0)
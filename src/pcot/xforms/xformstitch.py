@@ -11,6 +11,7 @@ from pcot.datum import Datum
 from pcot.imagecube import ImageCube
 from pcot.parameters.taggedaggregates import TaggedDictType, TaggedListType, taggedPointListType
 from pcot.sources import MultiBandSource, nullSource
+from pcot.utils import outofcore
 from pcot.ui.tabs import Tab
 from pcot.xform import XFormType, xformtype, XFormException
 
@@ -113,15 +114,12 @@ class XFormStitch(XFormType):
 
         # create an image of that size to compose the images into. We have to deal with the fact that
         # 1-band images are (h,w) while multiband images are (h,w,n).
+        # These may be large, so they may be stored out-of-core (see utils/outofcore.py).
         chans = activeInputImages[0].channels
-        if chans == 1:
-            img = np.zeros((maxy - miny, maxx - minx), dtype=np.float32)
-            unc = np.zeros((maxy - miny, maxx - minx), dtype=np.float32)
-            dqs = np.full((maxy - miny, maxx - minx), dq.NODATA | dq.NOUNCERTAINTY, dtype=np.uint16)
-        else:
-            img = np.zeros((maxy - miny, maxx - minx, chans), dtype=np.float32)
-            unc = np.zeros((maxy - miny, maxx - minx, chans), dtype=np.float32)
-            dqs = np.full((maxy - miny, maxx - minx, chans), dq.NODATA | dq.NOUNCERTAINTY, dtype=np.uint16)
+        shape = (maxy - miny, maxx - minx) if chans == 1 else (maxy - miny, maxx - minx, chans)
+        img = outofcore.zeros(shape, np.float32)
+        unc = outofcore.zeros(shape, np.float32)
+        dqs = outofcore.allocate(shape, np.uint16, dq.NODATA | dq.NOUNCERTAINTY)
 
         # compose the sources - this is a channel-wise union of all the sources
         # in all the images.
@@ -375,3 +375,45 @@ def test_spectrum_table(globaldatadir):
     })
     t = str(ss3.table()).strip().replace('\r\n', '\n')
     assert t == res3
+
+
+def test_extract_all():
+    """Extracting spectra for several ROIs at once (as SpectrumSet does) gives the same results as
+    extracting them one at a time, even if the ROIs overlap, and bad pixels are left out."""
+    import numpy as np
+    from pcot import dq
+
+    img = create_test_image2()
+    # make some pixels bad, and all the pixels in one ROI bad in one channel
+    img.dq[::3, ::4, 0] = dq.NODATA
+    img.dq[20:30, 20:30, 1] = dq.SAT
+    rois = [ROIRect(rect=(20, 20, 10, 10), label="a"),
+            ROICircle(100, 100, 10, label="b"),
+            ROICircle(105, 100, 10, label="c"),
+            ROIRect(rect=(250, 250, 20, 20), label="d")]   # partly outside the image
+
+    for ignorePixSD in (False, True):
+        spectra = Spectrum.extractAll(img, rois, ignorePixSD=ignorePixSD)
+        for roi, s in zip(rois, spectra):
+            sub = img.subimage(roi=roi)
+            assert s.roi is roi
+            for cc in range(img.channels):
+                good = sub.mask & ((sub.dq[:, :, cc] & dq.BAD) == 0)
+                if not np.any(good):
+                    assert s.getByChannel(cc) is None
+                    continue
+                n = sub.img[:, :, cc][good]
+                u = sub.uncertainty[:, :, cc][good]
+                sd = n.std() if ignorePixSD else np.sqrt(n.var() + np.mean(u ** 2))
+                v = s.getByChannel(cc)
+                assert v.pixels == np.count_nonzero(good)
+                assert np.isclose(v.v.n, n.mean(), rtol=1e-5, atol=1e-6)
+                assert np.isclose(v.v.u, sd, rtol=1e-5, atol=1e-6)
+                assert v.v.dq == np.bitwise_or.reduce(sub.dq[:, :, cc][sub.mask]) & dq.BAD
+
+                single = Spectrum(img, roi, ignorePixSD=ignorePixSD).getByChannel(cc)
+                assert single.v == v.v and single.pixels == v.pixels
+
+    # only the first ROI had all the pixels in a channel bad
+    assert spectra[0].getByChannel(1) is None
+    assert spectra[0].getByChannel(0).v.dq == dq.NODATA
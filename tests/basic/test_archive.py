@@ -9,7 +9,9 @@ import os
 
 import numpy as np
 
-from pcot.utils.archive import MemoryArchive, FileArchive
+import zipfile
+
+from pcot.utils.archive import MemoryArchive, FileArchive, COMPRESSION_TYPES
 
 test_data_d1 = {
     "foo": 1,
@@ -197,3 +199,128 @@ def test_cant_read_in_append_mode(globaldatadir):
             with pytest.raises(Exception, match=".* not open for reading"):
                 d1a = a.readJson("data1")
 
+
+
+def test_stored_arrays_are_memory_mapped():
+    """Arrays written uncompressed should be aligned in the file and read back as memory-mapped views"""
+    arrays = {
+        "c": np.arange(60, dtype=np.float32).reshape(3, 4, 5),
+        "f": np.asfortranarray(np.arange(12, dtype=np.uint16).reshape(3, 4)),
+        "strided": np.arange(100, dtype=np.int64)[::3],
+        "empty": np.zeros((0, 3)),
+    }
+    with TemporaryDirectory() as tmpdir:
+        fn = Path(tmpdir) / "test_archive"
+        with FileArchive(fn, "w", storeArrays=True) as a:
+            a.writeJson("block1", test_data_d1)
+            a.writeJson("arrays", arrays)
+
+        with FileArchive(fn, "r") as a:
+            d1_correct(a.readJson("block1"))
+            d = a.readJson("arrays")
+            for k, v in arrays.items():
+                np.testing.assert_array_equal(d[k], v)
+                if k != "empty":
+                    assert isinstance(d[k], np.memmap)
+                    assert d[k].offset % 64 == 0
+            # changes to the views are not written back
+            d["c"][0, 0, 0] = 100
+
+        with FileArchive(fn, "r") as a:
+            assert a.readJson("arrays")["c"][0, 0, 0] == 0
+
+
+def test_overwrite_mapped_archive():
+    """Writing an archive over the file its arrays were mapped from must leave those arrays readable"""
+    arr = np.arange(100000, dtype=np.float32)
+    with TemporaryDirectory() as tmpdir:
+        fn = Path(tmpdir) / "test_archive"
+        with FileArchive(fn, "w", storeArrays=True) as a:
+            a.writeJson("arrays", {"a": arr})
+        with FileArchive(fn, "r") as a:
+            d = a.readJson("arrays")
+        assert isinstance(d["a"], np.memmap)
+
+        with FileArchive(fn, "w", storeArrays=True) as a:
+            a.writeJson("arrays", {"a": d["a"] * 2})
+        np.testing.assert_array_equal(d["a"], arr)
+        with FileArchive(fn, "r") as a:
+            np.testing.assert_array_equal(a.readJson("arrays")["a"], arr * 2)
+        # no temporary files are left behind
+        assert os.listdir(tmpdir) == ["test_archive"]
+
+
+def test_compressed_arrays_not_memory_mapped():
+    with TemporaryDirectory() as tmpdir:
+        fn = Path(tmpdir) / "test_archive"
+        with FileArchive(fn, "w", storeArrays=False) as a:
+            a.writeJson("block2", test_data_d2)
+        with FileArchive(fn, "r") as a:
+            d = a.readJson("block2")
+            d2_correct(d)
+            assert not isinstance(d["baz"], np.memmap)
+
+
+@pytest.mark.parametrize("compression", ["deflate", "lzma", "bzip2", "stored"])
+def test_compression_types(compression):
+    """Several arrays are compressed and decompressed in parallel, using each of the compression methods"""
+    rng = np.random.default_rng(1)
+    arrays = {f"a{i}": rng.integers(0, 10, (50, 40, i + 1)).astype(np.float32) for i in range(6)}
+    arrays["obj"] = [np.arange(10), "string", {"nested": np.ones((3, 3), dtype=np.uint16)}]
+    with TemporaryDirectory() as tmpdir:
+        fn = Path(tmpdir) / "test_archive"
+        with FileArchive(fn, "w", compression=compression, level=1) as a:
+            a.writeJson("block1", test_data_d1)
+            a.writeJson("arrays", arrays)
+
+        with zipfile.ZipFile(fn) as z:
+            assert z.testzip() is None
+            assert all(i.compress_type == COMPRESSION_TYPES[compression] for i in z.infolist())
+
+        with FileArchive(fn, "r") as a:
+            d1_correct(a.readJson("block1"))
+            d = a.readJson("arrays")
+        for i in range(6):
+            np.testing.assert_array_equal(d[f"a{i}"], arrays[f"a{i}"])
+        np.testing.assert_array_equal(d["obj"][0], np.arange(10))
+        assert d["obj"][1] == "string"
+        np.testing.assert_array_equal(d["obj"][2]["nested"], np.ones((3, 3)))
+
+
+def test_write_without_zipfile_internals(monkeypatch):
+    """If we can't use zipfile's private parts, arrays are written serially and stored arrays are unaligned,
+    but can still be read and memory-mapped"""
+    import pcot.utils.archive
+    monkeypatch.setattr(pcot.utils.archive, "_zipInternalsOK", lambda zf: False)
+    arrays = {f"a{i}": np.arange(1000, dtype=np.float32) * i for i in range(4)}
+    with TemporaryDirectory() as tmpdir:
+        for storeArrays in (False, True):
+            fn = Path(tmpdir) / f"test_archive{storeArrays}"
+            with FileArchive(fn, "w", storeArrays=storeArrays) as a:
+                a.writeJson("block1", test_data_d1)
+                a.writeJson("arrays", arrays)
+
+            with zipfile.ZipFile(fn) as z:
+                assert z.testzip() is None
+
+            with FileArchive(fn, "r") as a:
+                d1_correct(a.readJson("block1"))
+                d = a.readJson("arrays")
+                for k, v in arrays.items():
+                    np.testing.assert_array_equal(d[k], v)
+                    assert isinstance(d[k], np.memmap) == storeArrays
+
+
+def test_memory_archive_ignores_configured_compression(monkeypatch):
+    """Memory archives (undo snapshots) always use deflate, whatever is configured for files"""
+    import pcot.config
+    conf = pcot.config.data.archives
+    monkeypatch.setattr(conf, "compression", "lzma")
+    monkeypatch.setattr(conf, "storearrays", True)
+    with MemoryArchive() as a:
+        a.writeJson("block2", test_data_d2)
+    data = a.get()
+    with zipfile.ZipFile(data) as z:
+        assert all(i.compress_type == zipfile.ZIP_DEFLATED for i in z.infolist())
+    with MemoryArchive(data) as a:
+        d2_correct(a.readJson("block2"))
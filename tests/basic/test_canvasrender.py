@@ -0,0 +1,141 @@
+"""
+Tests of preparing canvas images away from the canvas widget (see pcot/ui/canvasrender.py)
+"""
+import numpy as np
+import pytest
+from PySide2.QtCore import QCoreApplication
+
+from pcot import canvasnormalise
+from pcot.ui import canvasrender
+from pcot.ui.canvasdq import CanvasDQSpec
+from pcot.utils.pyramid import Pyramid, halveOr
+from pcot.utils.tilestats import TileStats
+
+
+def makeRequest(w, h, level, rect, dsize, dqs=(), cursor=(5, 5)):
+    rng = np.random.default_rng(1)
+    img = rng.uniform(0, 1, (h, w, 4)).astype(np.float32)
+    rgb = img[:, :, :3].copy()
+    unc = np.zeros_like(img)
+    dq = np.zeros(img.shape, dtype=np.uint16)
+    dq[10:20, 10:20] = 1
+    return canvasrender.RenderRequest(1, rgb, img, 4,
+                                      Pyramid(rgb), Pyramid(unc), Pyramid(dq, halveOr),
+                                      TileStats(rgb), TileStats(img),
+                                      level, rect, dsize,
+                                      canvasnormalise.NormToImg, False, 1.0,
+                                      list(dqs), False, True, cursor)
+
+
+def test_render():
+    req = makeRequest(400, 300, 2, (0, 0, 400, 300), (100, 75))
+    frame = canvasrender.render(req)
+    assert frame.final
+    assert frame.key == req.key
+    assert (frame.qimage.width(), frame.qimage.height()) == (100, 75)
+    assert frame.arr.shape == (75, 100, 3)
+    assert not frame.redrawOnTick
+    # the level was built, and so were the statistics for the whole image
+    assert req.rgbPyramid.hasLevel(2)
+    assert req.imgStats.built
+
+
+def test_preview_only_when_needed():
+    req = makeRequest(400, 300, 1, (0, 0, 400, 300), (200, 150))
+    preview = req.previewRequest()
+    assert preview.preview
+    assert preview.level == 1 + canvasrender.PREVIEW_LEVELS
+    frame = canvasrender.render(preview)
+    assert not frame.final
+    assert (frame.qimage.width(), frame.qimage.height()) == (200, 150)
+    # the preview didn't build anything
+    assert not req.rgbPyramid.hasLevel(1)
+    assert not req.imgStats.built
+
+    canvasrender.render(req)
+    assert req.previewRequest() is None
+
+
+def test_dq_overlay_changes_key():
+    a = makeRequest(100, 100, 0, (0, 0, 100, 100), (100, 100))
+    spec = CanvasDQSpec({'data': 1, 'col': 'red'})
+    b = makeRequest(100, 100, 0, (0, 0, 100, 100), (100, 100), [spec])
+    assert a.key != b.key
+    fa, fb = canvasrender.render(a), canvasrender.render(b)
+    # the DQ bits are drawn in red
+    assert fb.arr[15, 15, 0] == 255 and fb.arr[15, 15, 1] == 0
+    np.testing.assert_array_equal(fa.arr[50:, 50:], fb.arr[50:, 50:])
+
+
+def test_cursor_is_drawn():
+    a = makeRequest(100, 100, 0, (0, 0, 100, 100), (100, 100))
+    b = makeRequest(100, 100, 0, (0, 0, 100, 100), (100, 100), cursor=None)
+    assert a.key != b.key
+    fa, fb = canvasrender.render(a), canvasrender.render(b)
+    assert not np.array_equal(fa.arr[5, 5], fb.arr[5, 5])
+    fa.arr[5, 5] = fb.arr[5, 5]
+    np.testing.assert_array_equal(fa.arr, fb.arr)
+
+
+def test_render_abandoned_when_stale():
+    req = makeRequest(400, 300, 0, (0, 0, 400, 300), (400, 300))
+    assert canvasrender.render(req, lambda: True) is None
+    assert canvasrender.render(req, lambda: False) is not None
+
+
+@pytest.fixture
+def renderer():
+    """A Renderer which records what it delivers"""
+    app = QCoreApplication.instance() or QCoreApplication([])
+    r = canvasrender.Renderer()
+    r.frames = []
+    r.errors = []
+    r.ready.connect(r.frames.append)
+    r.failed.connect(r.errors.append)
+    yield r
+    del app
+
+
+def waitForRenderer():
+    """Wait for the render thread to finish its work and deliver the results"""
+    canvasrender._executor.submit(lambda: None).result()
+    QCoreApplication.processEvents()
+
+
+def test_renderer_delivers_preview_then_final(renderer):
+    req = makeRequest(400, 300, 1, (0, 0, 400, 300), (200, 150))
+    renderer.request(req)
+    assert renderer.pendingKey == req.key
+    waitForRenderer()
+    assert [f.final for f in renderer.frames] == [False, True]
+    assert all(f.key == req.key for f in renderer.frames)
+    assert renderer.pendingKey is None and renderer.errors == []
+
+
+def test_renderer_discards_stale_frames(renderer):
+    reqs = [makeRequest(400, 300, 0, (0, 0, 400 - i, 300), (400 - i, 300)) for i in range(3)]
+    for req in reqs:
+        renderer.request(req)
+    waitForRenderer()
+    # the last request may deliver a preview first, but nothing arrives for the earlier ones
+    assert renderer.frames and renderer.frames[-1].final
+    assert all(f.key == reqs[-1].key for f in renderer.frames)
+    assert renderer.pendingKey is None
+
+
+def test_renderer_cancel(renderer):
+    req = makeRequest(400, 300, 0, (0, 0, 400, 300), (400, 300))
+    renderer.request(req)
+    renderer.cancel()
+    assert renderer.pendingKey is None
+    waitForRenderer()
+    assert renderer.frames == []
+
+
+def test_renderer_error(renderer):
+    req = makeRequest(400, 300, 0, (0, 0, 400, 300), (400, 300))
+    req.rgbPyramid = None
+    renderer.request(req)
+    waitForRenderer()
+    assert renderer.frames == [] and len(renderer.errors) == 1
+    assert renderer.pendingKey is None
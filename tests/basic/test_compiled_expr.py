@@ -0,0 +1,102 @@
+"""
+Tests of the compiled expression cache and precompiled expressions.
+"""
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from pcot.datum import Datum
+from pcot.expressions import ExpressionEvaluator
+from pcot.sources import nullSourceSet
+from pcot.value import Value
+from pcot.xform import XFormException
+
+
+def num(x):
+    return Datum(Datum.NUMBER, Value(x, 0), sources=nullSourceSet)
+
+
+def test_expression_only_parsed_once():
+    e = ExpressionEvaluator()
+    parsed = []
+    parse = e.parse
+    e.parse = lambda s: parsed.append(s) or parse(s)
+
+    assert e.run("a*2+b", {"a": num(1), "b": num(2)}).get(Datum.NUMBER).n == 4
+    assert e.run("a*2+b", {"a": num(3), "b": num(4)}).get(Datum.NUMBER).n == 10
+    assert len(parsed) == 1
+
+    # a new variable changes how expressions compile, so they will be parsed again
+    assert e.run("a*2+b", {"c": num(0)}).get(Datum.NUMBER).n == 10
+    assert len(parsed) == 2
+
+
+def test_new_variable_recompiles():
+    e = ExpressionEvaluator()
+    # with no variable x, this is a naked identifier
+    assert e.run("x").tp == Datum.IDENT
+    assert e.run("x", {"x": num(5)}).get(Datum.NUMBER).n == 5
+
+
+def test_precompiled():
+    e = ExpressionEvaluator()
+    c = e.precompile("(x-y)/2", ["x", "y"])
+    for i in range(5):
+        assert c.run({"x": num(i * 3), "y": num(i)}).get(Datum.NUMBER).n == i
+
+
+def test_precompiled_unbound():
+    c = ExpressionEvaluator().precompile("x+1", ["x"])
+    with pytest.raises(XFormException):
+        c.run()
+
+
+def test_precompiled_vars_are_scoped():
+    e = ExpressionEvaluator()
+    c = e.precompile("x+1", ["x"])
+    assert c.run({"x": num(2)}).get(Datum.NUMBER).n == 3
+    # x isn't a variable for other expressions, so it's still a naked identifier there
+    assert "x" not in e.varRegistry
+    assert e.run("x").tp == Datum.IDENT
+    # and binding a variable of the same name elsewhere doesn't affect the compiled expression
+    assert e.run("x", {"x": num(5)}).get(Datum.NUMBER).n == 5
+    assert c.run({"x": num(2)}).get(Datum.NUMBER).n == 3
+
+
+def test_precompiled_vars_not_kept_between_runs():
+    c = ExpressionEvaluator().precompile("x+y", ["x", "y"])
+    assert c.run({"x": num(1), "y": num(2)}).get(Datum.NUMBER).n == 3
+    with pytest.raises(XFormException):
+        c.run({"x": num(1)})
+
+
+def test_precompiled_unknown_var():
+    c = ExpressionEvaluator().precompile("x+1", ["x"])
+    with pytest.raises(XFormException):
+        c.run({"x": num(1), "z": num(2)})
+
+
+def test_precompiled_threads():
+    c = ExpressionEvaluator().precompile("x*2", ["x"])
+
+    def run(i):
+        return c.run({"x": lambda: time.sleep(0.01) or num(i)}).get(Datum.NUMBER).n
+
+    with ThreadPoolExecutor(4) as pool:
+        assert list(pool.map(run, range(20))) == [i * 2 for i in range(20)]
+
+
+def test_fuse_setting_recompiles(monkeypatch):
+    e = ExpressionEvaluator()
+    parsed = []
+    parse = e.parse
+    e.parse = lambda s: parsed.append(s) or parse(s)
+
+    monkeypatch.setattr(ExpressionEvaluator, "fuseOps", True)
+    fused = e.compile("a*2+b")
+    monkeypatch.setattr(ExpressionEvaluator, "fuseOps", False)
+    unfused = e.compile("a*2+b")
+    assert len(parsed) == 2 and unfused is not fused
+    # and the expression still gives the same answer
+    assert e.run("a*2+b", {"a": num(3), "b": num(4)}).get(Datum.NUMBER).n == 10
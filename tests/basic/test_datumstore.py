@@ -229,6 +229,52 @@ def test_vector_and_cache():
         assert a.read_count == 4
 
 
+def test_cache_stats_and_keep_open():
+    """Test the cache counters, eviction order and keeping the archive open between reads"""
+    pcot.setup()
+
+    with tempfile.TemporaryDirectory() as td:
+        fn = td + "/eek.parc"
+
+        with FileArchive(fn, 'w') as fa:
+            a = DatumStore(fa)
+            for i in range(3):
+                vec = np.linspace(i, i + 1, 1000)
+                a.writeDatum(f"test{i}", Datum(Datum.NUMBER, Value(vec, 0.1, dq.TEST), sources=nullSourceSet))
+
+        a = DatumStore(FileArchive(fn), 20000, keepOpen=True)  # enough for two of the vectors
+        assert not a.archive.is_open()
+        a.get("test0")
+        assert a.archive.is_open()
+        size = a.total_size()
+        a.get("test1")
+        a.get("test0")  # test0 is now more recently used than test1
+        assert a.total_size() == size * 2
+        assert (a.hits, a.misses, a.evictions) == (1, 2, 0)
+
+        a.get("test2")  # should evict test1
+        assert (a.hits, a.misses, a.evictions) == (1, 3, 1)
+        assert list(a.cache.keys()) == ["test0", "test2"]
+        assert a.total_size() == size * 2
+
+        a.close()
+        assert not a.archive.is_open()
+        # reading again reopens it
+        a.get("test1")
+        assert a.archive.is_open() and a.read_count == 4
+        a.close()
+
+        # without keepOpen, a batch of reads keeps it open only until the batch is done
+        a = DatumStore(FileArchive(fn))
+        with a.readBatch():
+            a.get("test0")
+            assert a.archive.is_open()
+            a.get("test1")
+        assert not a.archive.is_open()
+        assert a.read_count == 2 and a.get("test1") is not None
+        assert not a.archive.is_open()
+
+
 def test_datumstore_append(globaldatadir):
     """Test we can append to a datum store. First, we should copy an existing test store"""
 
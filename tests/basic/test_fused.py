@@ -0,0 +1,86 @@
+"""
+Tests of fused evaluation of image arithmetic in expressions (see pcot/expressions/fused.py). These run
+expressions with fusion on and off and check that the results are the same.
+"""
+import numpy as np
+import pytest
+
+from pcot.datum import Datum
+from pcot.expressions import ExpressionEvaluator
+from pcot.expressions.fused import fuse, InstFused
+from pcot.imagecube import ImageCube, ChannelMapping
+from pcot.rois import ROIRect
+from pcot.sources import MultiBandSource, Source, nullSourceSet
+from pcot.value import Value
+
+
+def genrandom(w, h, band, seed, zeros=False):
+    """Generate a 3 band image with random values, uncertainties and DQ bits"""
+    rng = np.random.default_rng(seed)
+    img = rng.uniform(-1, 1, (h, w, 3)).astype(np.float32)
+    if zeros:
+        img[::7, ::5] = 0
+    unc = rng.uniform(0, 0.1, (h, w, 3)).astype(np.float32)
+    dq = rng.choice(np.array([0, 1, 2, 4], dtype=np.uint16), (h, w, 3))
+    sources = MultiBandSource([Source().setBand(f"{band}{i}") for i in range(3)])
+    return ImageCube(img, ChannelMapping(), sources, uncertainty=unc, dq=dq)
+
+
+def run(expr, fused, **kwargs):
+    old = ExpressionEvaluator.fuseOps
+    try:
+        ExpressionEvaluator.fuseOps = fused
+        return ExpressionEvaluator().run(expr, kwargs)
+    finally:
+        ExpressionEvaluator.fuseOps = old
+
+
+def assertSame(a: Datum, b: Datum):
+    assert a.tp == b.tp
+    if a.tp == Datum.IMG:
+        a, b = a.val, b.val
+        np.testing.assert_allclose(a.img, b.img, rtol=1e-6)
+        np.testing.assert_allclose(a.uncertainty, b.uncertainty, rtol=1e-6)
+        np.testing.assert_array_equal(a.dq, b.dq)
+        assert a.sources.long() == b.sources.long()
+        assert len(a.rois) == len(b.rois)
+    else:
+        assert a.val.approxeq(b.val)
+
+
+@pytest.mark.parametrize("expr", [
+    "(a-b)/(a+b)",
+    "-a*2+b",
+    "a/c",
+    "(a*b-c)/(2+3*4)",
+    "!(a*(k+1))",
+    "k*2+1",
+])
+def test_fused_same_as_unfused(expr):
+    # big enough that the image is processed in several strips
+    args = {"a": Datum(Datum.IMG, genrandom(300, 250, "A", 1)),
+            "b": Datum(Datum.IMG, genrandom(300, 250, "B", 2)),
+            "c": Datum(Datum.IMG, genrandom(300, 250, "C", 3, zeros=True)),
+            "k": Datum(Datum.NUMBER, Value(0.5, 0.1), sources=nullSourceSet)}
+
+    assertSame(run(expr, True, **args), run(expr, False, **args))
+
+
+def test_fused_with_roi_falls_back():
+    a = genrandom(100, 80, "A", 1)
+    b = genrandom(100, 80, "B", 2)
+    a.rois.append(ROIRect(sourceROI=None, rect=(10, 10, 30, 20)))
+
+    r = run("a*b+a", True, a=Datum(Datum.IMG, a), b=Datum(Datum.IMG, b))
+    assertSame(r, run("a*b+a", False, a=Datum(Datum.IMG, a), b=Datum(Datum.IMG, b)))
+    # outside the ROI the image is unchanged
+    np.testing.assert_array_equal(r.val.img[0], a.img[0])
+
+
+def test_arithmetic_is_fused():
+    e = ExpressionEvaluator()
+    e.parse("sqrt(a-b)/(a+b)*2")
+    seq = fuse(e.output)
+    # the sqrt call's subtraction and the division/addition/multiplication are each fused
+    assert [type(x) for x in seq].count(InstFused) == 2
+    assert len(seq) < len(e.output)
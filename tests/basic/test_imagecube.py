@@ -2,6 +2,8 @@
 import pcot
 from pcot.document import Document
 from pcot.cameras.filters import Filter
+from pcot.datum import Datum
+from pcot.rois import ROIRect
 from pcot.sources import SourceSet
 import pcot.utils.image as image
 
@@ -277,3 +279,85 @@ def test_imagecube_indexing_bad(rectimage):
 
     with pytest.raises(IndexError):
         x = rectimage[0, -(rectimage.h + 1)]
+
+
+def test_modify_with_sub_in_place():
+    """Splicing in place should give the same result as splicing into a copy, but share the image's arrays"""
+    img = genrgb(50, 50, 0.1, 0.2, 0.3, u=(0.01, 0.02, 0.03), d=(0, 1, 2))
+    img.rois.append(ROIRect(rect=(10, 10, 20, 20)))
+    sub = img.subimage()
+    newimg = sub.img * 2
+    expected = img.modifyWithSub(sub, newimg, uncertainty=sub.uncertainty, dqv=sub.dq)
+    assert not np.shares_memory(expected.img, img.img)
+
+    cp = img.copy()
+    r = cp.modifyWithSub(sub, newimg, uncertainty=sub.uncertainty, dqv=sub.dq, inPlace=True)
+    assert np.shares_memory(r.img, cp.img) and np.shares_memory(r.dq, cp.dq)
+    np.testing.assert_array_equal(r.img, expected.img)
+    np.testing.assert_array_equal(r.uncertainty, expected.uncertainty)
+    np.testing.assert_array_equal(r.dq, expected.dq)
+    # the original image is untouched
+    assert np.all(img.img[15, 15] == np.array([0.1, 0.2, 0.3], dtype=np.float32))
+
+
+def test_constant_planes():
+    """An image with no uncertainty or DQ gets constant planes, which are shared by copies and only turned
+    into real arrays when they are accessed in a way which might write to them"""
+    img = ImageCube(np.full((20, 30, 3), 0.5, dtype=np.float32))
+    assert image.isZeroPlane(img.peekUncertainty())
+    assert image.isConstantPlane(img.peekDQ())
+    assert np.all(img.peekDQ() == dq.NOUNCERTAINTY)
+
+    cp = img.copy()
+    assert cp.peekDQ() is img.peekDQ()
+
+    # adding two such images gives zero uncertainty without calculating it
+    r = (Value(img.img, img.peekUncertainty(), img.peekDQ()) + Value(cp.img, cp.peekUncertainty(), cp.peekDQ()))
+    assert image.isZeroPlane(r.u)
+
+    # writing to the DQ makes it a real array in that image only
+    cp.dq[0, 0, 0] = dq.SAT
+    assert not image.isConstantPlane(cp.peekDQ())
+    assert cp.dq[0, 0, 0] == dq.SAT and cp.dq[1, 1, 0] == dq.NOUNCERTAINTY
+    assert image.isConstantPlane(img.peekDQ())
+
+
+def test_copy_on_write_splice():
+    """Splicing into a copy-on-write copy should only copy the uncertainty and DQ if it changes them"""
+    img = genrgb(50, 50, 0.1, 0.2, 0.3, u=(0.01, 0.02, 0.03), d=(0, 1, 2))
+    img.rois.append(ROIRect(rect=(10, 10, 20, 20)))
+    sub = img.subimage()
+
+    r = img.copyOnWrite().modifyWithSub(sub, sub.img * 2, uncertainty=sub.peekUncertainty(), dqv=sub.peekDQ(),
+                                        inPlace=True)
+    assert not np.shares_memory(r.img, img.img)
+    assert np.shares_memory(r.peekUncertainty(), img.peekUncertainty())
+    assert np.shares_memory(r.peekDQ(), img.peekDQ())
+    assert np.all(r.img[15, 15] == np.array([0.2, 0.4, 0.6], dtype=np.float32))
+
+    r = img.copyOnWrite().modifyWithSub(sub, sub.img * 2, uncertainty=sub.peekUncertainty() * 2, dqv=sub.peekDQ(),
+                                        inPlace=True)
+    assert not np.shares_memory(r.peekUncertainty(), img.peekUncertainty())
+    assert np.shares_memory(r.peekDQ(), img.peekDQ())
+    assert np.allclose(r.uncertainty[15, 15], (0.02, 0.04, 0.06))
+    assert np.allclose(img.uncertainty[15, 15], (0.01, 0.02, 0.03))
+
+
+def test_norm_node_shares_unchanged_planes():
+    """A norm node applied to an ROI copies the nominal data but shares the uncertainty and DQ it doesn't change"""
+    img = genrgb(50, 50, 0.1, 0.2, 0.3, d=(0, 1, 2))
+    img.img[20:30, 20:30] = 0.5
+    img.rois.append(ROIRect(rect=(10, 10, 30, 30)))
+    doc = Document()
+    assert doc.setInputDirectImage(0, img) is None
+    inp = doc.graph.create("input 0")
+    node = doc.graph.create("normimage")
+    node.connect(0, inp, 0, autoPerform=False)
+    doc.run()
+
+    src = inp.getOutput(0, Datum.IMG)
+    out = node.getOutput(0, Datum.IMG)
+    assert not np.shares_memory(out.img, src.img)
+    assert out.img[25, 25, 0] == 1 and out.img[5, 5, 0] == np.float32(0.1)
+    assert np.shares_memory(out.peekDQ(), src.peekDQ())
+    assert image.isConstantPlane(out.peekUncertainty())
@@ -0,0 +1,113 @@
+"""Tests for the on-disk node output cache"""
+
+import os
+
+import numpy as np
+import pytest
+
+import pcot
+import pcot.config
+from fixtures import genrgb
+from pcot.datum import Datum
+from pcot.document import Document
+from pcot.rois import ROIRect
+from pcot.utils import nodecache
+
+
+@pytest.fixture
+def cacheDir(tmp_path):
+    """Turn the node cache on, in a temporary directory, for the duration of a test"""
+    conf = pcot.config.data.nodecache
+    old = conf.enabled, conf.location, conf.maxsize
+    conf.enabled = True
+    conf.location = tmp_path
+    conf.maxsize = 100
+    yield tmp_path
+    conf.enabled, conf.location, conf.maxsize = old
+
+
+def makeDoc(r, expr="a*2"):
+    doc = Document()
+    assert doc.setInputDirectImage(0, genrgb(50, 50, r, 0.2, 0.3)) is None
+    inp = doc.graph.create("input 0")
+    node = doc.graph.create("expr")
+    node.params.expr = expr
+    node.connect(0, inp, 0, autoPerform=False)
+    return doc, node
+
+
+def test_nodecache_restores_outputs(cacheDir):
+    pcot.setup()
+    doc, node = makeDoc(0.1)
+    doc.run()
+    assert node.timesPerformed == 1
+    assert len(list(cacheDir.glob("*.parc"))) == 1
+
+    # a different document with the same graph and input data should get the output from the cache
+    doc, node = makeDoc(0.1)
+    doc.run()
+    assert node.timesPerformed == 0
+    img = node.getOutput(0, Datum.IMG)
+    assert np.allclose(img.img, (0.2, 0.4, 0.6))
+    assert node.img is img
+
+    # but not if the input data or the parameters are different
+    doc, node = makeDoc(0.2)
+    doc.run()
+    assert node.timesPerformed == 1
+    doc, node = makeDoc(0.1, "a*3")
+    doc.run()
+    assert node.timesPerformed == 1
+    assert np.allclose(node.getOutput(0, Datum.IMG).img, (0.3, 0.6, 0.9))
+
+
+def test_nodecache_input_rois(cacheDir):
+    """Input images with the same pixels but different ROIs must not share cache entries"""
+    pcot.setup()
+
+    def makeROIDoc(rect):
+        img = genrgb(50, 50, 0.1, 0.2, 0.3)
+        img.img[:, 25:] = 0.5   # the right half is brighter
+        img.rois.append(ROIRect(rect=rect, label="roi"))
+        doc = Document()
+        assert doc.setInputDirectImage(0, img) is None
+        inp = doc.graph.create("input 0")
+        node = doc.graph.create("expr")
+        node.params.expr = "mean(a)"
+        node.connect(0, inp, 0, autoPerform=False)
+        return doc, node
+
+    doc, node = makeROIDoc((0, 0, 10, 10))
+    doc.run()
+    assert node.timesPerformed == 1
+    left = node.getOutput(0, Datum.NUMBER).n
+
+    # the same ROI hits the cache
+    doc, node = makeROIDoc((0, 0, 10, 10))
+    doc.run()
+    assert node.timesPerformed == 0
+
+    # but a different ROI over the same pixels doesn't
+    doc, node = makeROIDoc((30, 30, 10, 10))
+    doc.run()
+    assert node.timesPerformed == 1
+    right = node.getOutput(0, Datum.NUMBER).n
+    # mean() gives a value for each band
+    assert np.allclose(left, (0.1, 0.2, 0.3)) and np.allclose(right, (0.5, 0.5, 0.5))
+
+
+def test_nodecache_eviction(tmp_path):
+    pcot.setup()
+    cache = nodecache.NodeCache(tmp_path, 1000000)
+    outputs = [Datum(Datum.IMG, genrgb(50, 50, 0.1, 0.2, 0.3))]
+    cache.put("first", outputs, None)
+    size = cache.totalSize()
+    # make the first entry look old, and the cache big enough for only one entry
+    os.utime(tmp_path / "first.parc", (1, 1))
+    cache.maxSize = size + 1
+    cache.put("second", outputs, "text")
+    assert cache.get("first") is None
+    out, rectText = cache.get("second")
+    assert rectText == "text"
+    assert np.allclose(out[0].val.img, (0.1, 0.2, 0.3))
+    assert cache.totalSize() <= cache.maxSize
@@ -1,13 +1,15 @@
 """Basic tests on nodes in a document graph"""
 
+import numpy as np
 import pytest
 
 import pcot
+from fixtures import genrgb
 from pcot.datum import Datum
 from pcot.document import Document
 from pcot.sources import nullSourceSet
 from pcot.value import Value
-from pcot.xform import XFormType, BadTypeException, xformtype
+from pcot.xform import XFormType, BadTypeException, xformtype, XFormGraph
 
 
 def test_nodes_run():
@@ -166,3 +168,127 @@ def test_simple_node():
     out1 = node.getOutput(1, Datum.NUMBER).n
     assert out0 == 1*100+30*1000
     assert out1 == 30*100+1*1000
+
+
+def test_diamond_nodes_run_once():
+    """Build a diamond-shaped graph (one constant feeding two expr nodes which both feed a third) and
+    make sure that every node is performed exactly once when the graph runs, and that the bottom node
+    runs after both its parents."""
+    pcot.setup()
+    doc = Document()
+    top = doc.graph.create("constant")
+    top.params.val = 2.0
+    left = doc.graph.create("expr", displayName="left")
+    left.params.expr = "a+1"
+    right = doc.graph.create("expr", displayName="right")
+    right.params.expr = "a*10"
+    bottom = doc.graph.create("expr", displayName="bottom")
+    bottom.params.expr = "a+b"
+    left.connect(0, top, 0, autoPerform=False)
+    right.connect(0, top, 0, autoPerform=False)
+    bottom.connect(0, left, 0, autoPerform=False)
+    bottom.connect(1, right, 0, autoPerform=False)
+
+    order = doc.graph.topologicalOrder()
+    assert order.index(bottom) > order.index(left)
+    assert order.index(bottom) > order.index(right)
+
+    doc.run()
+    assert bottom.getOutput(0, Datum.NUMBER).n == 23
+    for n in (top, left, right, bottom):
+        assert n.timesPerformed == 1
+
+    # now change the top node and run from there, which should run all four again
+    top.params.val = 3.0
+    doc.graph.performNodes(top)
+    assert bottom.getOutput(0, Datum.NUMBER).n == 34
+    for n in (top, left, right, bottom):
+        assert n.timesPerformed == 2
+
+
+def test_parallel_perform():
+    """Run a graph with several independent branches, some of which are thread-safe, with a pool
+    of worker threads and make sure we get the same answers as when run serially."""
+
+    def build():
+        doc = Document()
+        assert doc.setInputDirectImage(0, genrgb(50, 50, 0.1, 0.2, 0.3)) is None
+        inp = doc.graph.create("input 0")
+        curves = []
+        for i in range(4):
+            curve = doc.graph.create("curve", displayName=f"curve{i}")
+            curve.params.mul = i + 1.0
+            curve.connect(0, inp, 0, autoPerform=False)
+            curves.append(curve)
+        # one node which isn't thread-safe hanging off two of the branches
+        expr = doc.graph.create("expr")
+        expr.params.expr = "a+b"
+        expr.connect(0, curves[0], 0, autoPerform=False)
+        expr.connect(1, curves[3], 0, autoPerform=False)
+        assert curves[0].type.threadSafe and not expr.type.threadSafe
+        return doc, curves + [expr]
+
+    pcot.setup()
+    doc, nodes = build()
+    doc.run()
+    serial = [n.getOutput(0, Datum.IMG).img for n in nodes]
+
+    doc, nodes = build()
+    try:
+        XFormGraph.threads = 4
+        doc.run()
+    finally:
+        XFormGraph.threads = 1
+
+    for n, s in zip(nodes, serial):
+        assert n.error is None
+        assert n.timesPerformed == 1
+        assert np.array_equal(n.getOutput(0, Datum.IMG).img, s)
+
+
+def test_unchanged_nodes_reused():
+    """Make sure that nodes whose params and inputs haven't changed since they last ran are not run again,
+    but reuse their previous outputs - and that changing a node only reruns the nodes which depend on it."""
+    pcot.setup()
+    doc = Document()
+    assert doc.setInputDirectImage(0, genrgb(50, 50, 0.1, 0.2, 0.3)) is None
+    inp = doc.graph.create("input 0")
+    a = doc.graph.create("expr", displayName="a")
+    a.params.expr = "a"
+    a.connect(0, inp, 0, autoPerform=False)
+    b = doc.graph.create("expr", displayName="b")
+    b.params.expr = "a"
+    b.connect(0, inp, 0, autoPerform=False)
+    doc.run()
+    outa = a.getOutputDatum(0)
+    assert np.allclose(outa.val.img, (0.1, 0.2, 0.3))
+    for n in (inp, a, b):
+        assert n.timesPerformed == 1
+
+    # running again shouldn't perform anything, and we should get the same outputs.
+    doc.run()
+    assert a.getOutputDatum(0) is outa
+    for n in (inp, a, b):
+        assert n.timesPerformed == 1
+
+    # change one branch; only that branch should run
+    b.params.expr = "a*2"
+    doc.run()
+    assert np.allclose(b.getOutput(0, Datum.IMG).img, (0.2, 0.4, 0.6))
+    assert a.getOutputDatum(0) is outa
+    assert inp.timesPerformed == 1
+    assert a.timesPerformed == 1
+    assert b.timesPerformed == 2
+
+    # disabling a node also changes its fingerprint
+    b.enabled = False
+    doc.graph.performNodes()
+    assert b.getOutputDatum(0) is None
+    assert b.timesPerformed == 3
+
+    # and a new input image causes everything to run again
+    assert doc.setInputDirectImage(0, genrgb(50, 50, 0.3, 0.2, 0.1)) is None
+    doc.run()
+    assert np.allclose(a.getOutput(0, Datum.IMG).img, (0.3, 0.2, 0.1))
+    assert inp.timesPerformed == 2
+    assert a.timesPerformed == 2
@@ -0,0 +1,75 @@
+"""Tests for storing large image arrays in memory-mapped files"""
+
+import numpy as np
+import pytest
+
+import pcot.config
+from pcot.datum import Datum
+from pcot.expressions import ExpressionEvaluator
+from pcot.imagecube import ImageCube
+from pcot.rois import ROICircle
+from pcot.utils import outofcore
+
+
+@pytest.fixture
+def outOfCore(tmp_path):
+    """Turn on out-of-core storage for arrays over 1MB, processed in 1MB strips"""
+    conf = pcot.config.data.outofcore
+    old = conf.enabled, conf.location, conf.threshold, conf.tilesize
+    conf.enabled = True
+    conf.location = tmp_path
+    conf.threshold = 1
+    conf.tilesize = 1
+    yield tmp_path
+    conf.enabled, conf.location, conf.threshold, conf.tilesize = old
+
+
+def genimg(w, h, seed=0):
+    rng = np.random.default_rng(seed)
+    img = rng.uniform(0, 1, (h, w, 3)).astype(np.float32)
+    unc = rng.uniform(0, 0.1, (h, w, 3)).astype(np.float32)
+    dq = rng.choice(np.array([0, 1, 2], dtype=np.uint16), (h, w, 3))
+    return ImageCube(img, uncertainty=unc, dq=dq)
+
+
+def test_allocate(outOfCore):
+    small = outofcore.zeros((10, 10), np.float32)
+    assert not outofcore.isOutOfCore(small)
+    big = outofcore.allocate((1000, 1000), np.uint16, 7)
+    assert outofcore.isOutOfCore(big)
+    assert outofcore.isOutOfCore(big[10:20])
+    # the result of arithmetic on a mapped array is an ordinary array (even though it's an np.memmap)
+    assert not outofcore.isOutOfCore(big + 1)
+    assert np.all(big == 7)
+    assert len(list(outofcore.strips(big))) == 2
+
+
+def test_copy(outOfCore):
+    img = genimg(400, 500)
+    c = img.copy()
+    assert outofcore.isOutOfCore(c.img)
+    assert outofcore.isOutOfCore(c.dq)
+    np.testing.assert_array_equal(c.img, img.img)
+    np.testing.assert_array_equal(c.uncertainty, img.uncertainty)
+    np.testing.assert_array_equal(c.dq, img.dq)
+
+
+def test_expr_with_roi_same_as_in_core(outOfCore):
+    """An expression on an image with an ROI is performed with modifyWithSub, which splices the result
+    in strip by strip when the image is out-of-core. The result should be the same as in memory."""
+    img = genimg(400, 500)
+    img.rois.append(ROICircle(200, 250, 180))
+
+    def run():
+        return ExpressionEvaluator().run("a*2+a", {"a": Datum(Datum.IMG, img)}).get(Datum.IMG)
+
+    r = run()
+    assert outofcore.isOutOfCore(r.img)
+    assert len(list(outofcore.strips(r.img))) > 1
+    pcot.config.data.outofcore.enabled = False
+    expected = run()
+    assert not outofcore.isOutOfCore(expected.img)
+
+    np.testing.assert_array_equal(r.img, expected.img)
+    np.testing.assert_array_equal(r.uncertainty, expected.uncertainty)
+    np.testing.assert_array_equal(r.dq, expected.dq)
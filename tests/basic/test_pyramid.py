@@ -0,0 +1,63 @@
+"""
+Tests of the image pyramids used by the canvas to draw zoomed-out images (see pcot/utils/pyramid.py)
+"""
+import numpy as np
+import pytest
+
+from pcot.utils.image import constantPlane, isConstantPlane
+from pcot.utils.pyramid import Pyramid, halveOr
+
+
+def test_levels_are_block_means():
+    rng = np.random.default_rng(1)
+    img = rng.uniform(0, 1, (67, 90, 3)).astype(np.float32)
+    p = Pyramid(img)
+    assert p.level(0) is img
+    # level 2 is built on demand, along with level 1
+    lev = p.level(2)
+    assert len(p.levels) == 3
+    assert p.level(1).shape == (34, 45, 3)
+    assert lev.shape == (17, 23, 3)
+    assert lev.dtype == np.float32
+    # an interior pixel is the mean of a 4x4 block of the original
+    np.testing.assert_allclose(lev[3, 5], img[12:16, 20:24].mean(axis=(0, 1)), rtol=1e-5)
+    # an odd edge is padded by repeating the last row
+    np.testing.assert_allclose(p.level(1)[33, 0], img[66, 0:2].mean(axis=0), rtol=1e-5)
+
+
+def test_dq_levels_keep_bits():
+    dq = np.zeros((10, 10), dtype=np.uint16)
+    dq[3, 4] = 1
+    dq[2, 5] = 4
+    dq[9, 9] = 2
+    p = Pyramid(dq, halveOr)
+    lev = p.level(2)
+    assert lev.dtype == np.uint16
+    assert lev.shape == (3, 3)
+    assert lev[0, 1] == 5
+    assert lev[2, 2] == 2
+    assert np.count_nonzero(lev) == 2
+
+
+def test_constant_planes_stay_constant():
+    p = Pyramid(constantPlane((1000, 800, 4), np.float32, 0.5))
+    lev = p.level(3)
+    assert isConstantPlane(lev)
+    assert lev.shape == (125, 100, 4)
+    assert lev[10, 10, 2] == 0.5
+
+
+@pytest.mark.parametrize("scale,level", [(0.25, 0), (1, 0), (1.9, 0), (2, 1), (5, 2), (1000, 4)])
+def test_level_for_scale(scale, level):
+    # a 16 pixel high image can't go below level 4
+    assert Pyramid.levelForScale(scale, (16, 2000, 3)) == level
+
+
+def test_crop():
+    img = np.arange(100 * 100).reshape(100, 100)
+    lev = Pyramid(img).level(2)
+    c = Pyramid.crop(lev, 2, 10, 21, 30, 50)
+    # rounded outwards to whole level-2 pixels: x from 8 to 40, y from 20 to 72
+    assert c.shape == (13, 8)
+    assert c[0, 0] == lev[5, 2]
+    assert Pyramid.crop(img, 0, 10, 21, 30, 50).shape == (50, 30)
@@ -401,3 +401,88 @@ def test_roi_serialisation_base():
     with pytest.raises(Exception):
         x = roi.serialise()
 
+
+def test_mask_caching():
+    """ROI masks are made once and reused until the ROI changes, and unions of the same ROIs are reused"""
+    circles = [ROICircle(10 + i * 10, 10, 4) for i in range(5)]
+    m = circles[0].mask()
+    assert not m.flags.writeable
+    # circles with the same radius share a mask
+    assert all(c.mask() is m for c in circles)
+    circles[0].set(10, 10, 5)
+    assert circles[0].mask() is not m and circles[0].mask().shape == (11, 11)
+
+    poly = ROIPoly()
+    for p in [(0, 0), (10, 0), (10, 10)]:
+        poly.addPoint(*p)
+    m = poly.mask()
+    assert poly.mask() is m
+    poly.moveSelPoint(0, 0)     # no selected point, so no change
+    assert poly.mask() is m
+    poly.addPoint(0, 10)
+    m2 = poly.mask()
+    assert m2 is not m and m2.all()
+    poly.changed()
+    assert poly.mask() is not m2
+
+    rect = ROIRect(rect=(60, 0, 5, 5))
+    u = ROI.roiUnion(circles + [rect])
+    u2 = ROI.roiUnion(circles + [rect])
+    assert u2.mask() is u.mask() and u2.bb() == u.bb()
+    # the sources are still those of the ROIs we passed in
+    assert u2.sources is not u.sources
+    # but if one moves, we get a new union
+    rect.set(61, 0, 5, 5)
+    u3 = ROI.roiUnion(circles + [rect])
+    assert u3.mask() is not u.mask() and u3.bb() != u.bb()
+    assert u3.mask().sum() == u.mask().sum()
+
+    i = ROI.roiIntersection([circles[1], ROIRect(rect=(18, 8, 10, 10))])
+    assert i.mask() is ROI.roiIntersection([circles[1], ROIRect(rect=(18, 8, 10, 10))]).mask()
+    assert i.mask().sum() == circles[1].mask()[2:, 2:].sum()
+
+
+def test_combined_cache_limit(monkeypatch):
+    """The cache of unions is limited by the size of the masks it keeps, not the number of entries"""
+    import pcot.rois
+    monkeypatch.setattr(pcot.rois, '_combinedCache', pcot.rois.OrderedDict())
+    monkeypatch.setattr(pcot.rois, '_combinedCacheBytes', 0)
+    # each union of two 10x10 rects keeps 325 bytes of masks alive (the rects share a 10x10 mask, and the union
+    # is 15x15), so only three fit
+    monkeypatch.setattr(pcot.rois, 'COMBINED_CACHE_BYTES', 1000)
+    for i in range(5):
+        ROI.roiUnion([ROIRect(rect=(i, 0, 10, 10)), ROIRect(rect=(i + 5, 5, 10, 10))])
+        assert pcot.rois._combinedCacheBytes <= 1000
+    assert len(pcot.rois._combinedCache) == 3
+    assert pcot.rois._combinedCacheBytes == 3 * 325
+
+    # a union too big for the cache isn't kept at all
+    ROI.roiUnion([ROIRect(rect=(0, 0, 30, 30)), ROIRect(rect=(0, 0, 10, 10))])
+    assert len(pcot.rois._combinedCache) == 3
+
+
+def test_painted_packed(monkeypatch):
+    """Large painted ROIs store their maps bit-packed, but look the same from the outside"""
+    monkeypatch.setattr(ROIPainted, 'PACK_THRESHOLD', 100)
+    rng = np.random.default_rng(0)
+    mask = rng.uniform(size=(30, 17)) > 0.5
+    roi = ROIPainted(mask=mask, containingImageDimensions=(50, 50))
+    # the size is the size of the serialised (unpacked) map
+    assert roi.getSize() == 30 * 17
+    assert roi.map.dtype == np.uint8
+    np.testing.assert_array_equal(roi.mask(), mask)
+    np.testing.assert_array_equal(roi.map > 0, mask)
+    assert roi.mask() is roi.mask()
+
+    # serialises as an unpacked map
+    d = roi.serialise()
+    monkeypatch.setattr(ROIPainted, 'PACK_THRESHOLD', None)
+    r2 = ROI.fromSerialised(d)
+    assert r2.getSize() == 30 * 17
+    np.testing.assert_array_equal(r2.mask(), mask)
+
+    # painting changes the mask
+    old = roi.mask()
+    roi.setCircle(40, 40, 3, relativeSize=False)
+    assert roi.mask() is not old
+    assert roi.bb() == Rect(0, 0, 44, 44)
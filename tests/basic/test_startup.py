@@ -0,0 +1,55 @@
+"""
+Tests that PCOT can be imported for library and command line use without loading Qt or the node modules.
+These run in a fresh interpreter, because the test session will already have imported everything.
+"""
+import subprocess
+import sys
+
+import pcot
+
+
+def modulesAfter(code):
+    """Run some code in a new interpreter and return the names of the modules it loaded"""
+    out = subprocess.run([sys.executable, "-c", code + "\nimport sys\nprint('\\n'.join(sys.modules))"],
+                         capture_output=True, text=True, check=True)
+    return set(out.stdout.split())
+
+
+def timeToRun(code):
+    """Run some code in a new interpreter and return how long it took, not counting the interpreter's startup"""
+    out = subprocess.run([sys.executable, "-c",
+                          f"import time\nst = time.perf_counter()\n{code}\nprint(time.perf_counter() - st)"],
+                         capture_output=True, text=True, check=True)
+    return float(out.stdout.split()[-1])
+
+
+def test_import_is_headless():
+    mods = modulesAfter("import pcot, pcot.datum, pcot.imagecube")
+    assert not any(m.startswith("PySide2") for m in mods)
+    assert "pcot.ui.mainwindow" not in mods
+    assert "pcot.xforms" not in mods
+    assert "scipy.interpolate" not in mods
+
+
+def test_lazy_submodules():
+    # submodules are still available as attributes of the package
+    mods = modulesAfter("import pcot\nassert pcot.xform.allTypes is not None")
+    assert "pcot.xform" in mods
+    assert not hasattr(pcot, "noSuchModule")
+
+
+def test_setup_does_not_load_main_window():
+    # setup() still loads Qt, because the node types define Qt tabs, but not the main window and the rest
+    # of the GUI. This matters for batch workers, which each call setup().
+    mods = modulesAfter("import pcot\npcot.setup()")
+    assert "pcot.xforms.xformnorm" in mods
+    assert "pcot.ui.mainwindow" not in mods
+    assert "pcot.ui.graphview" not in mods
+
+
+def test_import_time():
+    """A timing guard which doesn't depend on how fast the machine is: importing PCOT for library use
+    should take less time than loading the GUI, which it used to do"""
+    headless = min(timeToRun("import pcot, pcot.datum, pcot.imagecube") for _ in range(3))
+    gui = min(timeToRun("import pcot.ui.mainwindow") for _ in range(3))
+    assert headless < gui
@@ -0,0 +1,64 @@
+"""
+Tests of the cached range statistics used to normalise images on the canvas (see pcot/utils/tilestats.py)
+"""
+import numpy as np
+import pytest
+
+from pcot import canvasnormalise
+from pcot.utils.tilestats import TileStats
+
+
+def test_ranges_match_full_scan():
+    rng = np.random.default_rng(1)
+    img = rng.normal(0, 1, (203, 150, 5)).astype(np.float32)
+    stats = TileStats(img, tileSize=16)
+
+    mn, mx = stats.range()
+    np.testing.assert_array_equal(mn, img.min(axis=(0, 1)))
+    np.testing.assert_array_equal(mx, img.max(axis=(0, 1)))
+    assert stats.tileMin.shape == (13, 10, 5)
+
+    rects = [(0, 0, 150, 203), (3, 5, 7, 9), (10, 17, 100, 150), (16, 32, 64, 48),
+             (140, 190, 100, 100), (-5, -5, 40, 40)]
+    rects += [tuple(rng.integers(0, 140, 4)) for _ in range(50)]
+    for x, y, w, h in rects:
+        w, h = max(1, w), max(1, h)
+        sub = img[max(0, y):y + h, max(0, x):x + w]
+        mn, mx = stats.range((x, y, w, h))
+        np.testing.assert_array_equal(mn, sub.min(axis=(0, 1)))
+        np.testing.assert_array_equal(mx, sub.max(axis=(0, 1)))
+
+
+def test_single_band():
+    img = np.arange(100 * 80, dtype=np.float32).reshape(100, 80)
+    mn, mx = TileStats(img, tileSize=8).range((10, 20, 30, 40))
+    assert mn.tolist() == [20 * 80 + 10]
+    assert mx.tolist() == [59 * 80 + 39]
+    with pytest.raises(ValueError):
+        TileStats(img).range((200, 0, 10, 10))
+
+
+@pytest.mark.parametrize("mode", [canvasnormalise.NormToRGB, canvasnormalise.NormToImg,
+                                  canvasnormalise.NormSeparately])
+@pytest.mark.parametrize("cropped", [False, True])
+def test_normalise_with_cached_stats(mode, cropped):
+    rng = np.random.default_rng(2)
+    img = rng.uniform(-2, 3, (120, 130, 6)).astype(np.float32)
+    rgb = img[:, :, [4, 2, 0]].copy()
+    rect = (20, 30, 50, 40)
+    crop = rgb[30:70, 20:70]
+    rgbStats, imgStats = TileStats(rgb, 32), TileStats(img, 32)
+
+    out = canvasnormalise.canvasNormalise(img, crop, rgb, mode, cropped, rect, rgbStats, imgStats)
+
+    # compare with a full scan of the data
+    if mode == canvasnormalise.NormToImg:
+        data = img[30:70, 20:70] if cropped else img
+    else:
+        data = crop if cropped else rgb
+    axes = (0, 1) if mode == canvasnormalise.NormSeparately else None
+    mn, mx = data.min(axis=axes), data.max(axis=axes)
+    np.testing.assert_allclose(out, (crop - mn) / (mx - mn), rtol=1e-6)
+    # the stats are reused, and are the same without the cache
+    again = canvasnormalise.canvasNormalise(img, crop, rgb, mode, cropped, rect)
+    np.testing.assert_array_equal(out, again)
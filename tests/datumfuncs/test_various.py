@@ -536,3 +536,33 @@ def test_resize():
     assert result[255,0][1] == Value(1, 0.1, dq.NONE)
 
 
+def test_interp():
+    """Check the vectorised band interpolation against the point-by-point trilinear interpolation,
+    and that we can generate several bands at once."""
+    import pcot.utils.interp as ip
+    from pcot.cameras.filters import Filter
+
+    rng = np.random.default_rng(1)
+    data = rng.random((20, 30, 3)).astype(np.float32)
+    wavelengths = [400, 500, 700]
+    sources = MultiBandSource([Source().setBand(Filter(cwl=w, fwhm=10, transmission=1, position=f"p{w}", name=f"f{w}"))
+                               for w in wavelengths])
+    d = Datum(Datum.IMG, ImageCube(data, None, sources))
+
+    out = df.interp(d, 600, 20).get(Datum.IMG)
+    assert out.shape == (13, 20)
+    xs, ys = np.arange(30), np.arange(20)
+    for y in range(1, 13):
+        for x in range(1, 20):
+            expected = ip.trilinear_interpolation_fast(ys, xs, np.array(wavelengths), data,
+                                                       y * 20 / 13, x * 1.5, 600)
+            assert out.img[y, x] == pytest.approx(expected, abs=1e-5)
+
+    # several wavelengths at once give the same bands
+    factors = Datum(Datum.NUMBER, Value(np.array([450.0, 600.0]), np.zeros(2)), nullSourceSet)
+    out2 = df.interp(d, factors, 20).get(Datum.IMG)
+    assert out2.shape == (13, 20, 2)
+    assert np.allclose(out2.img[:, :, 1], out.img)
+    assert np.allclose(out2.img[:, :, 0], df.interp(d, 450, 20).get(Datum.IMG).img)
+    # and each band comes from the bands either side of it
+    assert sorted(s.getFilter().cwl for s in out2.sources.sourceSets[0].sourceSet) == [400, 500]
@@ -7,6 +7,7 @@ import struct
 import tempfile
 
 import numpy as np
+import pytest
 
 import pcot
 from pcot import dq
@@ -493,3 +494,92 @@ def test_preset_raw():
     assert img[0, 15][0].approxeq(Value(0, 0, dq.NOUNCERTAINTY))
     assert img[0, 15][1].approxeq(Value(2/255, 0, dq.NOUNCERTAINTY))
 
+
+@pytest.mark.parametrize("rot,horzflip,vertflip", [(0, False, False), (90, True, False), (270, False, True),
+                                                   (180, True, True)])
+@pytest.mark.parametrize("bigendian", [False, True])
+def test_raw_load_many(rot, horzflip, vertflip, bigendian):
+    """Loading several raw files into a cube at once gives the same results as loading them one at a time,
+    and as the straightforward read-swap-rotate-scale method."""
+    with tempfile.TemporaryDirectory() as d:
+        rng = np.random.default_rng(1)
+        names = []
+        for i in range(3):
+            data = rng.integers(0, 1024, (32, 16), dtype=np.uint16)
+            names.append(os.path.join(d, f"{i}.raw"))
+            with open(names[-1], "wb") as f:
+                f.write(b'\x0A' * 6)
+                f.write(data.astype('>u2' if bigendian else '<u2').tobytes())
+
+        loader = RawLoader(format=RawLoader.UINT16, width=16, height=32, bigendian=bigendian, offset=6,
+                           rot=rot, horzflip=horzflip, vertflip=vertflip)
+        cube = loader.loadMany(names, bitdepth=10)
+        assert cube.shape == loader.shape() + (3,)
+        for i, name in enumerate(names):
+            expected = np.fromfile(name, dtype='>u2' if bigendian else '<u2', offset=6).reshape(32, 16)
+            expected = np.rot90(expected, rot // 90)
+            if horzflip:
+                expected = np.fliplr(expected)
+            if vertflip:
+                expected = np.flipud(expected)
+            expected = expected.astype(np.float32) * (1.0 / 1023)
+            single = loader.load(name, bitdepth=10)
+            assert single.dtype == np.float32
+            np.testing.assert_array_equal(single, expected)
+            np.testing.assert_array_equal(cube[:, :, i], expected)
+
+        # and multifile uses the batch loader when it's not caching
+        img = load.multifile(d, ["0.raw", "1.raw", "2.raw"], rawloader=loader, bitdepth=10, cache=False, filterpat=r"(?P<pos>[0-9])",
+                             really_no_camera=True).get(Datum.IMG)
+        np.testing.assert_array_equal(img.img, cube)
+
+
+def test_multifile_raw_uses_batch_loader(monkeypatch):
+    """When caching, multifile decodes the raw files which aren't in the cache with one call to loadMany"""
+    from pcot.utils import filecache
+    monkeypatch.setattr(filecache, 'cache', filecache.FileCache())
+    batches = []
+    loadMany = RawLoader.loadMany
+    monkeypatch.setattr(RawLoader, 'loadMany', lambda self, names, **kw: batches.append(len(names)) or loadMany(self, names, **kw))
+
+    with tempfile.TemporaryDirectory() as d:
+        rng = np.random.default_rng(2)
+        for i in range(4):
+            rng.integers(0, 256, (32, 16), dtype=np.uint8).tofile(os.path.join(d, f"{i}.raw"))
+        loader = RawLoader(format=RawLoader.UINT8, width=16, height=32)
+
+        def load_files(names):
+            return load.multifile(d, names, rawloader=loader, filterpat=r"(?P<pos>[0-9])",
+                                  really_no_camera=True).get(Datum.IMG).img
+
+        first = load_files(["0.raw", "1.raw"])
+        assert batches == [2]
+        # two of these are cached, so only the other two are decoded
+        img = load_files(["0.raw", "2.raw", "1.raw", "3.raw"])
+        assert batches == [2, 2]
+        assert img.flags.writeable
+        np.testing.assert_array_equal(img[:, :, 0], first[:, :, 0])
+        np.testing.assert_array_equal(img[:, :, 2], first[:, :, 1])
+        for i, name in enumerate(["0.raw", "2.raw", "1.raw", "3.raw"]):
+            np.testing.assert_array_equal(img[:, :, i], loader.load(os.path.join(d, name)))
+        # and all cached, so nothing is decoded
+        load_files(["3.raw", "2.raw"])
+        assert batches == [2, 2]
+
+        # with the cache size set to zero, all the files are decoded in one batch
+        monkeypatch.setattr(filecache, 'enabled', lambda: False)
+        load_files(["0.raw", "1.raw", "2.raw"])
+        assert batches == [2, 2, 3]
+
+
+def test_raw_wrong_length():
+    """Files which are too long have the extra data ignored; files which are too short are an error"""
+    with tempfile.TemporaryDirectory() as d:
+        create_raw_uint8(d, "long.raw", width=16, height=33, fill=[(3, 2, 255)])
+        create_raw_uint8(d, "short.raw", width=16, height=31)
+        loader = RawLoader(format=RawLoader.UINT8, width=16, height=32)
+        img = loader.load(os.path.join(d, "long.raw"))
+        assert img.shape == (32, 16)
+        assert img[2, 3] == 1
+        with pytest.raises(ValueError, match="too short"):
+            loader.load(os.path.join(d, "short.raw"))
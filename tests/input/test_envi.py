@@ -52,3 +52,52 @@ def test_envi_load(envi_image_1):
             else:
                 if not np.array_equal(img.img[y][x], (0, 0, 0, 0)):
                     pytest.fail(f"rectangle mistakenly filled at {x} {y}")
+
+
+@pytest.mark.parametrize("interleave", ["bsq", "bil", "bip"])
+def test_envi_write_read_interleave(tmp_path, interleave):
+    """Write ENVI data with each interleave and read it back"""
+    from pcot.dataformats import envi
+    freqs = [400, 500, 600]
+    img = np.random.default_rng(1).random((30, 40, 3)).astype(np.float32)
+    envi._write(str(tmp_path / "x"), freqs, img, "TEST", interleave)
+
+    h, data = envi.load(tmp_path / "x.hdr")
+    assert h.interleave == interleave
+    np.testing.assert_array_equal(data, img)
+    # BIP float data is mapped straight from the file
+    assert isinstance(data, np.memmap) == (interleave == "bip")
+
+
+@pytest.mark.parametrize("interleave", ["bsq", "bip"])
+def test_envi_write_over_source(tmp_path, interleave):
+    """Write a mapped ENVI image back over the file it was loaded from"""
+    from pcot.dataformats import envi
+    freqs = [400, 500, 600]
+    # big enough to be written in several chunks
+    img = np.random.default_rng(1).random((600, 500, 3)).astype(np.float32)
+    envi._write(str(tmp_path / "x"), freqs, img, "TEST", "bip")
+    h, data = envi.load(tmp_path / "x.hdr")
+    assert isinstance(data, np.memmap)
+
+    envi._write(str(tmp_path / "x"), freqs, data, "TEST", interleave)
+    np.testing.assert_array_equal(data, img)
+    h, data = envi.load(tmp_path / "x.hdr")
+    assert h.interleave == interleave
+    np.testing.assert_array_equal(data, img)
+    assert sorted(os.listdir(tmp_path)) == ["x.dat", "x.hdr"]
+
+
+def test_envi_integer_data_with_gains(tmp_path):
+    """Read big-endian 16-bit BIL data, applying gains and offsets"""
+    from pcot.dataformats import envi
+    dn = np.arange(5 * 4 * 2, dtype=np.uint16).reshape(5, 2, 4)  # lines, bands, samples
+    (tmp_path / "x.dat").write_bytes(dn.astype('>u2').tobytes())
+    (tmp_path / "x.hdr").write_text("ENVI\nsamples = 4\nlines = 5\nbands = 2\ndata type = 12\n"
+                                    "interleave = bil\nbyte order = 1\nheader offset = 0\n"
+                                    "wavelength = {500, 600}\n"
+                                    "data gain values = {2, 0.5}\ndata offset values = {0, 1}\n")
+    h, data = envi.load(tmp_path / "x.hdr")
+    assert data.dtype == np.float32 and data.shape == (5, 4, 2)
+    np.testing.assert_allclose(data[:, :, 0], dn[:, 0, :] * 2)
+    np.testing.assert_allclose(data[:, :, 1], dn[:, 1, :] * 0.5 + 1)
@@ -228,4 +228,39 @@ def test_multifile_raw(globaldatadir):
         assert bands[1].u == 0
         assert bands[1].dq == dq.NOUNCERTAINTY
         assert bands[2].u == 0
-        assert bands[2].dq == dq.NOUNCERTAINTY
\ No newline at end of file
+        assert bands[2].dq == dq.NOUNCERTAINTY
+
+def test_multifile_shared_cache(globaldatadir, monkeypatch):
+    """Files loaded by a multifile go into a shared, size-limited cache keyed on the file and how it was
+    loaded, and are loaded in parallel"""
+    from pcot.dataformats import load
+    from pcot.utils import filecache
+
+    pcot.setup()
+    monkeypatch.setattr(pcot.config.data.loading, 'threads', 4)
+    c = filecache.cache
+    c.clear()
+    names = ["0.png", "32768.png", "65535.png"]
+    d = load.multifile(globaldatadir / "multi", names)
+    assert d.val.channels == 3
+    assert np.allclose(d.val.img[0][0], (0, 32768 / 65535, 1))
+    assert len(c.cache) == 3
+
+    # loading a subset uses the cached data, which can't be modified
+    hits = c.hits
+    d2 = load.multifile(globaldatadir / "multi", names[1:])
+    assert c.hits == hits + 2
+    assert np.array_equal(d2.val.img, d.val.img[:, :, 1:])
+    assert all(not a.flags.writeable for a in c.cache.values())
+    # but the image itself is a copy
+    assert d2.val.img.flags.writeable
+
+    # a different bit depth means different data, so a different entry
+    load.multifile(globaldatadir / "multi", names[:1], bitdepth=8)
+    assert len(c.cache) == 4
+
+    # arrays bigger than the cache aren't cached at all
+    monkeypatch.setattr(pcot.config.data.loading, 'cachesize', 0)
+    c.put(("x",), np.zeros(10))
+    assert len(c.cache) == 4
+    c.clear()
@@ -1,13 +1,19 @@
 """Very basic tests for PDS4 input - more work needs to be done on how PDS4 input will
 work, particularly for HK data (which could be time series) and we need a corpus of known data."""
 import os.path
+from datetime import datetime
 from pathlib import Path
+from types import SimpleNamespace
 
+import numpy as np
 from proctools.products import ProductDepot
 
 import pcot
+import pcot.dataformats.pds4 as pds4
 from direct.test_image_load_pds4 import check_data
-from pcot.dataformats.pds4 import PDS4External
+from pcot import dq
+from pcot.cameras.filters import Filter
+from pcot.dataformats.pds4 import PDS4External, PDS4ImageProduct, ProductList
 
 from pcot.datum import Datum
 from pcot.document import Document
@@ -42,3 +48,92 @@ def test_pds4_load():
     # they have the correct source data (including LIDs).
 
     check_data(img, inpidx=0)
+
+
+def makeFakeProduct(rng, cwl, lid, shape=(20, 30)):
+    """Make an image product without a label, whose 'DataProduct' is just the arrays"""
+    p = PDS4ImageProduct()
+    p.lid, p.sol_id, p.start, p.path = lid, 1, datetime(2030, 1, 1), f"/nonexistent/{lid}.xml"
+    p.seq_num, p.camera, p.rmc_ptu = 1, 'WACL', 0.0
+    p.filt = Filter(cwl, 10, transmission=1.0, name=f"F{cwl}", position=f"F{cwl}")
+    data = rng.uniform(0, 1.1, shape).astype('>f4')
+    err = rng.choice(np.array([0, 0.1], dtype=np.float32), shape)
+    quality = rng.choice(np.array([0, 1], dtype=np.uint8), shape)
+    p.p = SimpleNamespace(data=data, err=err, dq=quality)
+    return p
+
+
+@pytest.mark.parametrize("threads", [1, 4])
+def test_pds4_image_from_products(monkeypatch, threads):
+    """Check the image, uncertainty and DQ built from a list of products"""
+    pcot.setup()
+    monkeypatch.setattr(pcot.config.data.loading, 'threads', threads)
+    rng = np.random.default_rng(1)
+    prods = [makeFakeProduct(rng, cwl, f"prod{i}") for i, cwl in enumerate((440, 540, 640))]
+    img = ProductList(prods).toDatum(multValue=2).get(Datum.IMG)
+
+    assert img.channels == 3
+    for i, p in enumerate(prods):
+        data = p.p.data * 2
+        np.testing.assert_array_equal(img.img[:, :, i], data)
+        np.testing.assert_array_equal(img.uncertainty[:, :, i], p.p.err)
+        expected = np.where(p.p.dq == 1, 0, dq.NODATA)
+        expected |= np.where(data > 0.9999999, dq.SAT, 0)
+        expected |= np.where(p.p.err == 0.0, dq.NOUNCERTAINTY, 0)
+        np.testing.assert_array_equal(img.dq[:, :, i], expected)
+        assert img.sources[i].getOnlyItem().getFilter().cwl == p.filt.cwl
+
+    # products must all be the same size
+    prods.append(makeFakeProduct(rng, 740, "prod3", shape=(20, 31)))
+    with pytest.raises(ValueError, match="same size"):
+        ProductList(prods).toDatum()
+
+
+def test_pds4_label_index(monkeypatch, tmp_path):
+    """Directory scans use an index so that only new or changed labels are read"""
+    pcot.setup()
+    monkeypatch.setattr(pcot.config.data.loading, 'labelindex', True)
+    monkeypatch.setattr(pcot.config.data.loading, 'labelindexlocation', tmp_path / "index")
+
+    rng = np.random.default_rng(1)
+    labels = tmp_path / "labels"
+    labels.mkdir()
+    for i, cwl in enumerate((640, 440, 540)):
+        (labels / f"{i}.xml").write_text(str(cwl))
+    (labels / "junk.xml").write_text("junk")
+
+    read = []
+
+    def readLabel(path):
+        """pretend to read a label, whose text is the filter CWL"""
+        read.append(path.name)
+        if path.name == "junk.xml":
+            return None
+        p = makeFakeProduct(rng, int(path.read_text()), path.stem)
+        return {'type': 'spec-rad', 'product': p.serialise()}
+
+    monkeypatch.setattr(pds4, '_readLabel', readLabel)
+
+    lst = pds4.scanDirectory(labels)
+    assert sorted(read) == ["0.xml", "1.xml", "2.xml", "junk.xml"]
+    assert [p.filt.cwl for p in lst.lst] == [440, 540, 640]
+    assert lst.lst[0].path == str(labels / "1.xml")
+    assert lst.lst[0].p is None     # the label will be read when the data is needed
+
+    # scanning again reads nothing
+    read.clear()
+    lst = pds4.scanDirectory(labels)
+    assert read == []
+    assert [p.lid for p in lst.lst] == ["1", "2", "0"]
+
+    # unless a label has changed
+    (labels / "2.xml").write_text("740")
+    lst = pds4.scanDirectory(labels)
+    assert read == ["2.xml"]
+    assert [p.filt.cwl for p in lst.lst] == [440, 640, 740]
+
+    # or we're not using the index
+    read.clear()
+    monkeypatch.setattr(pcot.config.data.loading, 'labelindex', False)
+    pds4.scanDirectory(labels)
+    assert len(read) == 4
@@ -0,0 +1,87 @@
+"""
+Tests of running several batch jobs, possibly in parallel processes.
+"""
+
+from concurrent.futures.process import BrokenProcessPool
+
+from pcot.parameters.batchjobs import BatchJob, runJobs
+from pcot.xform import XFormGraph
+
+from fixtures import *
+
+
+def writeParamFile(globaldatadir, path, out):
+    path.write_text(f"""
+inputs.0.parc.filename = {globaldatadir / 'parc/multi.parc'}
+.itemname = image0
+outputs.+.file = {out}
+.node = mean
+.append = true
+.prefix = "{{{{vars[0]}}}} "
+k.val = {{{{vars[0]}}}}
+""")
+
+
+@pytest.mark.parametrize("processes", [1, 2])
+def test_jobs_append_to_same_file(globaldatadir, tmp_path, processes):
+    out = tmp_path / "out.txt"
+    pf = tmp_path / "test.params"
+    writeParamFile(globaldatadir, pf, out)
+
+    jobs = [BatchJob(pf, [str(k)]) for k in (1.2, 2.4, 3.6, 4.8)]
+    results = runJobs(globaldatadir / "runner/test2.pcot", jobs, processes=processes)
+    assert [r.job for r in results] == jobs
+    assert all(r.ok for r in results)
+
+    # the order of the lines depends on which job finished first
+    lines = sorted(open(out).read().splitlines())
+    assert lines == ["1.2 0.45332±0.19508",
+                     "2.4 0.90664±0.39016",
+                     "3.6 1.36±0.58524",
+                     "4.8 1.8133±0.78033"]
+    # lock files aren't left next to the outputs
+    assert sorted(os.listdir(tmp_path)) == ["out.txt", "test.params"]
+
+
+def test_failed_job_reported(globaldatadir, tmp_path):
+    out = tmp_path / "out.txt"
+    pf = tmp_path / "test.params"
+    writeParamFile(globaldatadir, pf, out)
+
+    jobs = [BatchJob(pf, ["1.2"]), BatchJob(tmp_path / "missing.params", ["1.2"]), BatchJob(pf, ["2.4"])]
+    results = runJobs(globaldatadir / "runner/test2.pcot", jobs)
+    assert [r.ok for r in results] == [True, False, True]
+    assert "missing.params" in results[1].error
+    assert len(open(out).read().splitlines()) == 2
+
+
+@pytest.mark.parametrize("processes", [1, 2])
+def test_bad_document_raises(tmp_path, processes):
+    pf = tmp_path / "test.params"
+    pf.write_text("")
+    jobs = [BatchJob(pf, ["1"]), BatchJob(pf, ["2"])]
+    with pytest.raises(Exception) as e:
+        runJobs(tmp_path / "missing.pcot", jobs, processes=processes)
+    assert not isinstance(e.value, BrokenProcessPool)
+
+
+def test_serial_run_restores_threads(globaldatadir, tmp_path):
+    pf = tmp_path / "test.params"
+    writeParamFile(globaldatadir, pf, tmp_path / "out.txt")
+    old = XFormGraph.threads
+    runJobs(globaldatadir / "runner/test2.pcot", [BatchJob(pf, ["1.2"])], threads=old + 1)
+    assert XFormGraph.threads == old
+
+
+def test_worker_load_error_reported(tmp_path):
+    """A document which can be opened but not loaded makes each job fail with the real error"""
+    from pcot.utils.archive import FileArchive
+    doc = tmp_path / "bad.pcot"
+    with FileArchive(doc, "w") as a:
+        a.writeJson("JSON", {"NOTAGRAPH": 1})
+    pf = tmp_path / "test.params"
+    pf.write_text("")
+    jobs = [BatchJob(pf, ["1"]), BatchJob(pf, ["2"])]
+    results = runJobs(doc, jobs, processes=2)
+    assert not any(r.ok for r in results)
+    assert all("KeyError" in r.error and "BrokenProcessPool" not in r.error for r in results)
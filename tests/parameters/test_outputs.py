@@ -4,6 +4,7 @@ Tests for the output mechanism of the Runner class - i.e. the outputs of the bat
 
 import tempfile
 import datetime
+import zipfile
 
 import pcot
 from fixtures import *
@@ -11,7 +12,7 @@ from pcot.datum import Datum
 from pcot.document import Document
 from pcot.parameters.parameterfile import ApplyException
 from pcot.parameters.runner import Runner
-from pcot.utils.archive import FileArchive
+from pcot.utils.archive import FileArchive, COMPRESSION_TYPES
 from pcot.utils.datumstore import DatumStore
 import pcot.datumfuncs as df
 
@@ -250,6 +251,29 @@ def test_parc_image_write(globaldatadir):
         assert str(v) == "[0.4557±0.15167, 0.47677±0.13817, 0.47621±0.13479]"
 
 
+@pytest.mark.parametrize("compression", ["lzma", "stored"])
+def test_parc_image_write_compression(globaldatadir, compression):
+    """Test we can set the compression method of a PARC output"""
+    pcot.setup()
+    r = Runner(globaldatadir / "runner/colourmap.pcot")
+
+    with tempfile.TemporaryDirectory() as td:
+        out = os.path.join(td, "output1.parc")
+        r.run(None, f"""
+        outputs.+.file = {out}
+        .annotations = n
+        .node = striproi(a,1)
+        .name = main
+        .compression = {compression}
+        """)
+
+        with zipfile.ZipFile(out) as z:
+            assert z.getinfo("ARAE-0").compress_type == COMPRESSION_TYPES[compression]
+
+        v = df.mean(DatumStore(FileArchive(out)).get("main")).get(Datum.NUMBER)
+        assert str(v) == "[0.4557±0.15167, 0.47677±0.13817, 0.47621±0.13479]"
+
+
 def test_parc_multi(globaldatadir):
     """Test we can add multiple images to a PARC file"""
 
@@ -437,6 +437,43 @@ def test_run_modify_with_reset_node_run(globaldatadir):
         assert txt == "0.45332±0.19508\n"
 
 
+def test_changes_restored_between_runs(globaldatadir):
+    """Changes made by one parameter file should be undone before the next, but inputs which weren't
+    changed should keep their data."""
+
+    pcot.setup()
+    r = Runner(globaldatadir / "runner/test2.pcot")
+    k = r.doc.graph.getByDisplayName("k", single=True)
+    oldval = k.params.val
+    inp = r.doc.inputMgr.getInput(0)
+    oldMethod = inp.activeMethod
+
+    with tempfile.TemporaryDirectory() as td:
+        out1 = os.path.join(td, "output1.txt")
+        out2 = os.path.join(td, "output2.txt")
+
+        r.run(None, f"""
+        inputs.0.parc.filename = {globaldatadir / 'parc/multi.parc'}
+        .itemname = image0
+        outputs.+.file = {out1}
+        .node = mean
+        k.val = 2.4
+        """)
+        assert k.params.val == oldval
+        assert inp.activeMethod == oldMethod
+
+        # the input is set again, but k should be back to its original value
+        r.run(None, f"""
+        inputs.0.parc.filename = {globaldatadir / 'parc/multi.parc'}
+        .itemname = image0
+        outputs.+.file = {out2}
+        .node = mean
+        """)
+
+        assert open(out1).read() == "0.90664±0.39016\n"
+        assert open(out2).read() == "0.45332±0.19508\n"
+
+
 def test_colourmap(globaldatadir):
     """Here we look at the output of a colourmap node on a small part of an image using two different
     colourmap presets. This tests: